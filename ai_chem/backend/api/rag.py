@@ -2,26 +2,232 @@
 教材搜索 API
 提供教材内容检索接口
 """
-from fastapi import APIRouter
+import asyncio
+import hmac
+import json
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from services.context_builder import DEFAULT_CONTEXT_TOKENS
+from services.dense_index import DenseIndexUnavailable
 from services.rag_service import get_rag_instance
+from services.retrieval_pool import RetrievalOverloaded, get_pool
 
 router = APIRouter()
 
+# 单次批量搜索允许的最大问题数
+MAX_BATCH_QUESTIONS = 500
+
+# 每个问题允许返回的最大结果数
+MAX_TOP_K = 100
+
+# 排序方式参数的取值（见 services.rag_service.RANKING_MODES）
+RANKING_PATTERN = "^(keyword|bm25|dense|hybrid)$"
+
+
+class BatchSearchRequest(BaseModel):
+    """批量搜索请求"""
+    questions: List[str] = Field(..., max_length=MAX_BATCH_QUESTIONS)
+    top_k: int = Field(5, ge=1, le=MAX_TOP_K)
+    ranking: str = Field("keyword", pattern=RANKING_PATTERN)
+    # 元数据过滤条件: 字段 -> 取值列表（字段见 GET /search/facets）
+    filters: Optional[Dict[str, List[str]]] = None
+
+
+def search_filters(
+    volume: Optional[List[str]] = Query(None),
+    source: Optional[List[str]] = Query(None),
+    topic: Optional[List[str]] = Query(None),
+    unit: Optional[List[str]] = Query(None),
+    section: Optional[List[str]] = Query(None),
+) -> Optional[Dict[str, List[str]]]:
+    """从查询参数中收集元数据过滤条件，同一字段可以重复出现（取值之间为“或”）"""
+    filters = {"volume": volume, "source": source, "topic": topic, "unit": unit, "section": section}
+    return {field: values for field, values in filters.items() if values} or None
+
 
 @router.post("/search")
-async def search_textbooks(question: str, top_k: int = 5):
+async def search_textbooks(
+    question: str,
+    top_k: int = Query(5, ge=1, le=MAX_TOP_K),
+    ranking: str = Query("keyword", pattern=RANKING_PATTERN),
+    filters: Optional[Dict[str, List[str]]] = Depends(search_filters),
+):
     """
     搜索教材内容
 
     - **question**: 搜索问题
-    - **top_k**: 返回结果数量（默认5）
+    - **top_k**: 返回结果数量（默认5，1~100）
+    - **ranking**: 排序方式，keyword（默认，关键词计数）、bm25、dense（向量检索）或 hybrid（混合检索）
+    - **volume** / **source** / **topic** / **unit** / **section**: 元数据过滤（可重复），
+      如 `volume=one&topic=专题2` 只检索 one 目录教材中专题2的内容
+
+    hybrid 模式下有子检索器超时被放弃时，degraded 为 true。
     """
     rag = get_rag_instance()
-    results = rag.search(question, top_k=top_k)
+    try:
+        # 检索是 CPU 密集操作，放到线程池中执行，避免阻塞事件循环
+        result = await get_pool().run(rag.retrieve, question, top_k=top_k, ranking=ranking, filters=filters)
+    except RetrievalOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except DenseIndexUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
     return {
         "question": question,
-        "keywords": rag.extract_keywords(question),
-        "results": results,
-        "total": len(results)
+        "keywords": result.keywords,
+        "ranking": ranking,
+        "filters": filters,
+        "degraded": result.degraded,
+        "results": result.results,
+        "total": len(result)
+    }
+
+
+def _format_event(event: str, data: Dict[str, Any], fmt: str) -> str:
+    """把一个事件序列化为 SSE 或 NDJSON 格式"""
+    payload = json.dumps(data, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {event}\ndata: {payload}\n\n"
+    return json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+
+
+@router.post("/search/stream")
+async def search_textbooks_stream(
+    question: str,
+    top_k: int = Query(5, ge=1, le=MAX_TOP_K),
+    max_tokens: int = Query(DEFAULT_CONTEXT_TOKENS, gt=0),
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|sse)$"),
+    ranking: str = Query("keyword", pattern=RANKING_PATTERN),
+    filters: Optional[Dict[str, List[str]]] = Depends(search_filters),
+):
+    """
+    流式搜索教材内容
+
+    - **question**: 搜索问题
+    - **top_k**: 返回结果数量（默认5，1~100）
+    - **max_tokens**: 上下文的 token 预算（默认1200，按句子组装，不在句子中间截断）
+    - **format**: ndjson（默认）或 sse
+    - **ranking**: 排序方式，keyword（默认）、bm25、dense 或 hybrid
+    - **volume** / **source** / **topic** / **unit** / **section**: 元数据过滤，同 /search
+
+    依次发送以下事件，前端收到关键词后即可开始渲染：
+    keywords（提取的关键词）→ result（按相关性逐条发送）→ context（LLM上下文和来源信息）→ done
+    """
+    rag = get_rag_instance()
+    pool = get_pool()
+    try:
+        # 先单独提取关键词，第一个事件不必等待全文评分
+        keywords = await pool.run(rag.extract_keywords, question)
+    except RetrievalOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+    async def events() -> AsyncIterator[str]:
+        yield _format_event("keywords", {"question": question, "keywords": keywords}, fmt)
+
+        try:
+            result = await pool.run(rag.retrieve, question, top_k=top_k, ranking=ranking, filters=filters)
+        except (RetrievalOverloaded, DenseIndexUnavailable) as e:
+            yield _format_event("error", {"detail": str(e)}, fmt)
+            return
+
+        for rank, item in enumerate(result.results, 1):
+            yield _format_event("result", {"rank": rank, **item}, fmt)
+
+        try:
+            # 组装上下文要逐句打分，同样放到线程池中执行
+            context = await pool.run(result.to_context, max_tokens)
+        except RetrievalOverloaded as e:
+            yield _format_event("error", {"detail": str(e)}, fmt)
+            return
+
+        yield _format_event("context", {
+            "context": context,
+            "sources": result.to_sources()
+        }, fmt)
+        yield _format_event("done", {"total": len(result), "degraded": result.degraded}, fmt)
+
+    media_type = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.post("/search/batch")
+async def search_textbooks_batch(request: BatchSearchRequest):
+    """
+    批量搜索教材内容（所有问题共用一轮语料扫描）
+
+    - **questions**: 问题列表（最多 500 个）
+    - **top_k**: 每个问题返回的结果数量（默认5，1~100）
+    - **ranking**: 排序方式，keyword（默认）、bm25、dense 或 hybrid
+    - **filters**: 元数据过滤条件，如 {"volume": ["one"], "topic": ["专题2"]}，对所有问题生效
+
+    结果与 questions 的顺序一致。
+    """
+    rag = get_rag_instance()
+    try:
+        batch = await get_pool().run(rag.retrieve_many, request.questions, top_k=request.top_k,
+                                     ranking=request.ranking, filters=request.filters)
+    except RetrievalOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except ValueError as e:
+        # 不支持的过滤字段
+        raise HTTPException(status_code=400, detail=str(e))
+    except DenseIndexUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return {
+        "results": [
+            {
+                "question": question,
+                "keywords": result.keywords,
+                "degraded": result.degraded,
+                "results": result.results,
+                "total": len(result)
+            }
+            for question, result in zip(request.questions, batch)
+        ],
+        "total": len(batch)
     }
+
+
+@router.get("/search/facets")
+async def search_facets():
+    """
+    可用的元数据过滤条件：各字段的取值及对应的文本块数量
+    """
+    return get_rag_instance().facet_values()
+
+
+@router.get("/search/cache")
+async def search_cache_stats():
+    """
+    检索结果缓存的监控指标（命中/未命中/淘汰/过期次数），以及混合检索中各子检索器超时被放弃的次数
+    """
+    rag = get_rag_instance()
+    return {**rag.query_cache.stats(), "pool": get_pool().stats(),
+            "hybrid_dropped": dict(rag.hybrid_dropped)}
+
+
+@router.post("/admin/reload")
+async def reload_textbooks(x_admin_token: Optional[str] = Header(default=None)):
+    """
+    重新加载教材数据（只重新解析内容有变化的文件）
+
+    需要设置环境变量 RAG_ADMIN_TOKEN，并在请求头 X-Admin-Token 中提供相同的值；
+    未设置时接口关闭，一律返回 403。
+    """
+    token = os.getenv("RAG_ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=403, detail="未配置管理令牌，重新加载接口已关闭")
+    if not hmac.compare_digest((x_admin_token or "").encode("utf-8"), token.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="无效的管理令牌")
+
+    rag = get_rag_instance()
+    # 重新加载会解析JSON并修补索引，放到线程中执行；加载期间检索继续使用旧快照
+    summary = await asyncio.to_thread(rag.reload_changed)
+    return {**summary, "total_chunks": rag.num_chunks}
@@ -0,0 +1,31 @@
+"""
+多 worker 部署配置（gunicorn + uvicorn worker）
+
+用法（在 backend 目录下）：
+    gunicorn -c gunicorn.conf.py main:app
+
+主进程先加载教材语料和 jieba 词典，再 fork 出 worker：
+- 持久化索引（.rag_index.bin）通过 mmap 映射，所有 worker 共享同一份页缓存；
+- jieba 词典、化学式索引等 Python 对象由 fork 继承，写时复制共享。
+增加 worker 时每个进程只多出自己的请求处理内存，不再各自持有一份语料。
+分片模式（RAG_SHARDED=1）下主进程只加载 jieba 词典，每个 worker 启动后创建自己的分片进程。
+
+环境变量：
+    WEB_CONCURRENCY  worker 数量，默认为 CPU 核数
+    BIND             监听地址，默认 0.0.0.0:8000
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+# 在主进程中导入应用，fork 之后 worker 直接使用已加载的模块
+preload_app = True
+
+
+def on_starting(server):
+    """fork worker 之前在主进程中加载语料"""
+    from services.rag_service import preload_for_fork
+
+    preload_for_fork()
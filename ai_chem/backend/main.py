@@ -2,11 +2,17 @@
 ChemTutor Backend API
 FastAPI 主服务
 """
+import threading
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 # 导入路由
 from api import rag
+from services.hybrid import shutdown_executor
+from services.rag_service import is_ready, start_reload_watcher, stop_reload_watcher, warm_up
+from services.retrieval_pool import configure_pool, shutdown_pool
 
 app = FastAPI(
     title="ChemTutor API",
@@ -32,6 +38,29 @@ app.add_middleware(
 app.include_router(rag.router, prefix="/api", tags=["RAG"])
 
 
+@app.on_event("startup")
+async def start_warm_up():
+    """启动时在后台预热检索服务（jieba 词典 + 教材索引），预热完成前 /health 返回 503"""
+    # 检索线程池：并发数 RAG_MAX_WORKERS，排队上限 RAG_MAX_PENDING
+    pool = configure_pool()
+    print(f"[RAG] 检索线程池: {pool.max_workers} 线程，最多排队 {pool.max_pending} 个请求")
+    threading.Thread(target=_warm_up_and_watch, name="rag-warm-up", daemon=True).start()
+
+
+def _warm_up_and_watch():
+    """预热检索服务；设置了 RAG_WATCH_INTERVAL 时再启动教材目录监视（热更新）"""
+    warm_up()
+    start_reload_watcher()
+
+
+@app.on_event("shutdown")
+async def stop_retrieval_pool():
+    """关闭检索线程池、混合检索线程池和教材目录监视"""
+    shutdown_pool()
+    shutdown_executor()
+    stop_reload_watcher()
+
+
 @app.get("/")
 async def root():
     """根路径"""
@@ -44,7 +73,9 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """健康检查"""
+    """健康检查（检索服务预热完成前返回 503）"""
+    if not is_ready():
+        return JSONResponse(status_code=503, content={"status": "starting"})
     return {"status": "healthy"}
 
 
@@ -0,0 +1,247 @@
+"""
+检索基准测试脚本
+在自带的教材数据上测量检索链路的性能，作为每次检索优化前后对比的依据：
+
+- 冷启动：在新进程中解析教材JSON建索引、以及映射持久化索引的耗时和峰值内存
+- 延迟：固定问题集逐条检索（关闭结果缓存）的 p50/p95/p99
+- 吞吐：不同并发线程数下的每秒查询数（QPS）
+- 内存：本进程的峰值 RSS
+- 一致性：keyword 排序与参考实现（_calculate_relevance）逐条比较
+
+用法（在 backend 目录下）：
+    python scripts/benchmark_retrieval.py [--rankings keyword,bm25,hybrid] [--rounds 5]
+                                          [--concurrency 1,2,4,8] [--json report.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:
+    # Windows 没有 resource 模块，不统计峰值内存
+    resource = None
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from check_scoring_parity import ranking_of, reference_ranking  # noqa: E402
+from services.dense_index import DenseIndexUnavailable  # noqa: E402
+from services.rag_service import RANKING_MODES, TextbookRAG  # noqa: E402
+
+# 固定问题集：概念类、化学式、离子和多关键词问题，以及只命中常见词的问题
+BENCHMARK_QUESTIONS = [
+    "什么是化学键？",
+    "氨气为什么是极性分子？",
+    "水的化学式是什么？",
+    "氧化还原反应的本质是什么？",
+    "H2SO4 的性质",
+    "Ca(OH)2 与 CO2 反应",
+    "NaCl 溶液的导电性",
+    "Fe3+ 的检验方法",
+    "铝 Al 的两性",
+    "氯气的性质 Cl2",
+    "CuSO4·5H2O 的颜色",
+    "化学反应速率的影响因素",
+    "盐类的水解",
+    "原电池的工作原理",
+    "电解质 电离 离子",
+    "有机物 乙醇 乙酸 酯化反应",
+    "元素周期表 周期律",
+    "物质的量 摩尔质量",
+    "胶体 丁达尔效应",
+    "金属的腐蚀与防护",
+    "共价键 离子键 金属键的区别",
+    "化学平衡常数的计算",
+    "反应",
+    "化学",
+]
+
+DEFAULT_RANKINGS = ("keyword", "bm25", "hybrid")
+DEFAULT_CONCURRENCY = (1, 2, 4, 8)
+
+
+def peak_rss_mb() -> Optional[float]:
+    """本进程的峰值常驻内存（MB），不支持的平台返回 None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法百分位数"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _measure_load(data_dir: Optional[str], persist_index: bool) -> Dict:
+    """在子进程中构建检索器，返回加载耗时和峰值内存"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        rag = TextbookRAG(data_dir=data_dir, persist_index=persist_index)
+        elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "chunks": len(rag.chunks), "peak_rss_mb": peak_rss_mb()}
+
+
+def measure_cold_load(data_dir: Optional[str]) -> Dict[str, Dict]:
+    """
+    在全新的进程中测量冷启动
+
+    parse 为解析全部JSON并建索引（不读写持久化索引），mmap 为映射已保存的持久化索引。
+    """
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    with ctx.Pool(1) as pool:
+        results["parse"] = pool.apply(_measure_load, (data_dir, False))
+
+    # 确保持久化索引已写好，再测映射路径
+    with contextlib.redirect_stdout(io.StringIO()):
+        TextbookRAG(data_dir=data_dir)
+    with ctx.Pool(1) as pool:
+        results["mmap"] = pool.apply(_measure_load, (data_dir, True))
+    return results
+
+
+def measure_latency(rag: TextbookRAG, questions: List[str], ranking: str, rounds: int,
+                    top_k: int) -> Dict[str, float]:
+    """逐条检索，返回延迟分位数（毫秒）"""
+    latencies = []
+    for _ in range(rounds):
+        for question in questions:
+            start = time.perf_counter()
+            rag.search(question, top_k=top_k, ranking=ranking)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "queries": len(latencies),
+        "mean_ms": sum(latencies) / len(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def measure_throughput(rag: TextbookRAG, questions: List[str], ranking: str, rounds: int,
+                       top_k: int, concurrency: int) -> float:
+    """用 concurrency 个线程并发检索，返回每秒查询数"""
+    workload = [question for _ in range(rounds) for question in questions]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        list(executor.map(lambda q: rag.search(q, top_k=top_k, ranking=ranking), workload))
+        elapsed = time.perf_counter() - start
+    return len(workload) / elapsed
+
+
+def check_parity(rag: TextbookRAG, questions: List[str], top_k: int) -> List[str]:
+    """返回 keyword 排序与参考实现不一致的问题"""
+    mismatched = []
+    for question in questions:
+        expected = [(rag.chunks[idx]["content"], score)
+                    for idx, score in reference_ranking(rag, question, top_k=top_k)]
+        if ranking_of(rag.search(question, top_k=top_k)) != expected:
+            mismatched.append(question)
+    return mismatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="教材检索基准测试")
+    parser.add_argument("--data-dir", help="教材数据目录（默认 backend/data/collected/textbok）")
+    parser.add_argument("--rankings", default=",".join(DEFAULT_RANKINGS),
+                        help=f"参与测试的排序方式，逗号分隔（可选: {', '.join(RANKING_MODES)}）")
+    parser.add_argument("--rounds", type=int, default=5, help="问题集重复的轮数")
+    parser.add_argument("--top-k", type=int, default=5, help="每次检索返回的结果数量")
+    parser.add_argument("--concurrency", default=",".join(map(str, DEFAULT_CONCURRENCY)),
+                        help="吞吐测试的并发线程数，逗号分隔")
+    parser.add_argument("--skip-cold", action="store_true", help="跳过冷启动测试")
+    parser.add_argument("--json", help="把结果另存为 JSON 文件，便于前后对比")
+    args = parser.parse_args()
+
+    rankings = [r.strip() for r in args.rankings.split(",") if r.strip()]
+    unknown = [r for r in rankings if r not in RANKING_MODES]
+    if unknown:
+        parser.error(f"未知的排序方式: {', '.join(unknown)}")
+    concurrency_levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    report: Dict = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "questions": len(BENCHMARK_QUESTIONS),
+        "rounds": args.rounds,
+        "top_k": args.top_k,
+    }
+
+    if not args.skip_cold:
+        print("⏳ 冷启动测试...")
+        report["cold_load"] = measure_cold_load(args.data_dir)
+        for mode, result in report["cold_load"].items():
+            rss = result["peak_rss_mb"]
+            print(f"  {mode:<6} {result['seconds'] * 1000:8.1f} ms  {result['chunks']} 个文本块"
+                  + (f"  峰值内存 {rss:.1f} MB" if rss is not None else ""))
+
+    # 关闭结果缓存，每次检索都完整计算
+    with contextlib.redirect_stdout(io.StringIO()):
+        rag = TextbookRAG(data_dir=args.data_dir, cache_size=0)
+        # 预热分词器，首次加载 jieba 词典的耗时不计入延迟
+        rag.extract_keywords(BENCHMARK_QUESTIONS[0])
+    report["scoring_backend"] = rag.scoring_backend
+    report["chunks"] = len(rag.chunks)
+
+    report["latency"] = {}
+    report["throughput"] = {}
+    for ranking in rankings:
+        try:
+            rag.search(BENCHMARK_QUESTIONS[0], top_k=args.top_k, ranking=ranking)
+        except DenseIndexUnavailable as e:
+            print(f"⚠️ 跳过 {ranking}: {e}")
+            continue
+
+        latency = measure_latency(rag, BENCHMARK_QUESTIONS, ranking, args.rounds, args.top_k)
+        report["latency"][ranking] = latency
+        print(f"\n[{ranking}] {latency['queries']} 次查询  "
+              f"p50 {latency['p50_ms']:.2f} ms  p95 {latency['p95_ms']:.2f} ms  p99 {latency['p99_ms']:.2f} ms")
+
+        report["throughput"][ranking] = {}
+        for concurrency in concurrency_levels:
+            qps = measure_throughput(rag, BENCHMARK_QUESTIONS, ranking, args.rounds, args.top_k, concurrency)
+            report["throughput"][ranking][str(concurrency)] = qps
+            print(f"  并发 {concurrency:>2}: {qps:8.1f} QPS")
+
+    mismatched = check_parity(rag, BENCHMARK_QUESTIONS, top_k=10)
+    report["parity"] = {"checked": len(BENCHMARK_QUESTIONS), "mismatched": mismatched}
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    print(f"\n{'='*60}")
+    if report["peak_rss_mb"] is not None:
+        print(f"峰值内存: {report['peak_rss_mb']:.1f} MB")
+    if mismatched:
+        print(f"❌ {len(mismatched)} 个问题的 keyword 排序与参考实现不一致:")
+        for question in mismatched:
+            print(f"  - {question}")
+    else:
+        print(f"✅ {len(BENCHMARK_QUESTIONS)} 个问题的 keyword 排序与参考实现完全一致")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"结果已保存到: {args.json}")
+
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
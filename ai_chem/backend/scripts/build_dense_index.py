@@ -0,0 +1,63 @@
+"""
+向量索引构建脚本
+离线把教材文本块切成段落，用本地 CPU 嵌入模型分批计算向量，
+建立 HNSW 索引并保存到教材数据目录，供 TextbookRAG 的 dense 检索模式使用。
+教材数据变化后需要重新运行。
+
+用法（在 backend 目录下）：
+    python scripts/build_dense_index.py [--model BAAI/bge-small-zh-v1.5] [--batch-size 64]
+
+依赖：
+    pip install sentence-transformers hnswlib
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from services.dense_index import (  # noqa: E402
+    DENSE_AVAILABLE,
+    EMBED_BATCH_SIZE,
+    HNSW_AVAILABLE,
+    DenseIndex,
+    Embedder,
+)
+from services.rag_service import TextbookRAG  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建教材向量索引")
+    parser.add_argument("--data-dir", help="教材数据目录（默认 backend/data/collected/textbok）")
+    parser.add_argument("--model", help="嵌入模型名称或本地路径（默认读取 RAG_EMBEDDING_MODEL）")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="每批嵌入的段落数")
+    args = parser.parse_args()
+
+    if not DENSE_AVAILABLE:
+        print("❌ 未安装 sentence-transformers，请先运行: pip install sentence-transformers hnswlib")
+        sys.exit(1)
+    if not HNSW_AVAILABLE:
+        print("⚠️ 未安装 hnswlib，将只保存向量，检索时使用精确计算")
+
+    rag = TextbookRAG(data_dir=args.data_dir)
+    corpus = rag.corpus
+    if not len(corpus):
+        print("❌ 没有加载到任何教材文本块")
+        sys.exit(1)
+
+    print(f"加载嵌入模型: {args.model or '默认'}")
+    embedder = Embedder(args.model)
+
+    start = time.perf_counter()
+    index = DenseIndex.build(corpus.chunks, embedder, corpus.checksum.hex(), batch_size=args.batch_size)
+    elapsed = time.perf_counter() - start
+    index.save(rag.data_dir)
+
+    print(f"✅ {len(corpus)} 个文本块，{len(index)} 个段落，耗时 {elapsed:.1f} 秒")
+    print(f"   向量索引已保存到: {rag.data_dir}")
+
+
+if __name__ == "__main__":
+    main()
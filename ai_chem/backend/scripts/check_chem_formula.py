@@ -0,0 +1,53 @@
+"""
+化学式识别检查脚本
+对一组固定文本，检查 extract_formulas 识别出的化学式与预期完全一致，
+重点覆盖与英文单词同形的元素符号（"In"、"No"、"As" 等）。
+
+用法（在 backend 目录下）：
+    python scripts/check_chem_formula.py
+"""
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from services.chem_formula import extract_formulas  # noqa: E402
+
+FORMULA_CASES = [
+    # 英文句子中的单词不是元素符号
+    ("In this case, No reaction As expected", []),
+    ("In the lab, what is NaOH?", ["NaOH"]),
+    ("At room temperature He said", []),
+    # 中文语境中的元素符号照常识别
+    ("Be、Mg 的性质", ["Be", "Mg"]),
+    ("He 和 Ne 都是稀有气体", ["He", "Ne"]),
+    ("铝 Al 的两性", ["Al"]),
+    ("As 是第 VA 族元素", ["As"]),
+    # 带下标、电荷或多个元素时不受影响
+    ("In2O3 与 NO2", ["In2O3", "NO2"]),
+    ("As2O3 有毒", ["As2O3"]),
+    ("NO reaction", ["NO"]),
+    ("2 Na + Cl2 = 2 NaCl", ["Na", "Cl2", "NaCl"]),
+    ("Fe3+ 的检验", ["Fe3+"]),
+    ("Ca(OH)2 与 CO2 反应", ["Ca(OH)2", "CO2"]),
+]
+
+
+def main():
+    failures = 0
+    for text, expected in FORMULA_CASES:
+        got = extract_formulas(text)
+        if got != expected:
+            failures += 1
+            print(f"❌ {text!r}: {got} != {expected}")
+
+    print(f"\n{'='*60}")
+    if failures:
+        print(f"❌ 共 {failures} 处不一致")
+        sys.exit(1)
+    print(f"✅ {len(FORMULA_CASES)} 条文本的化学式识别结果与预期一致")
+
+
+if __name__ == "__main__":
+    main()
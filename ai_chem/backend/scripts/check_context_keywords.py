@@ -0,0 +1,67 @@
+"""
+上下文关键词检查脚本
+问题中同时有泛用的疑问词（"什么"、"如何"）和真正的主题词时，组装上下文应当优先选入
+包含主题词的句子，而不是排名更靠前、只含疑问词的句子。
+
+用法（在 backend 目录下）：
+    python scripts/check_context_keywords.py
+"""
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from services.context_builder import estimate_tokens  # noqa: E402
+from services.rag_service import RetrievalResult, _context_keywords, _extract_keywords_cached  # noqa: E402
+
+# (问题, 排名第一、只含疑问词的文本块, 排名第二、包含主题词的句子)
+CONTEXT_CASES = [
+    ("什么是化学键？",
+     "为什么铁在潮湿的空气中容易生锈？你知道其中发生了什么变化吗？",
+     "通常把物质中直接相邻的原子或离子之间强烈的相互作用叫作化学键。"),
+    ("如何检验 Fe3+？",
+     "如何正确使用胶头滴管？滴加液体时滴管应悬空。",
+     "向溶液中滴加 KSCN 溶液，溶液变为红色，说明含有 Fe3+。"),
+    ("盐类的水解有什么特点？",
+     "什么样的物质属于电解质？酸、碱和大多数盐都是电解质。",
+     "盐类的水解是可逆反应，水解程度一般很小。"),
+]
+
+# 主题词必须保留的问题
+KEYWORD_CASES = [
+    ("盐类的水解有什么特点？", ["盐类", "水解"]),
+    ("为什么 NaOH 要密封保存？", ["NaOH", "密封"]),
+    ("化学反应速率的影响因素", ["化学反应", "速率"]),
+]
+
+
+def main():
+    failures = 0
+    for question, filler, topic in CONTEXT_CASES:
+        keywords = list(_extract_keywords_cached(question, 10))
+        results = [{"content": content, "metadata": {}, "source": "check"} for content in (filler, topic)]
+        # 预算恰好放得下主题句
+        expected = f"【来源2】{topic}"
+        context = RetrievalResult(question, keywords, results).to_context(estimate_tokens(expected))
+        if context != expected:
+            failures += 1
+            print(f"❌ {question} (关键词 {keywords}): {context!r}")
+
+    # 去掉泛用词时，主题词一个也不能丢
+    for question, topic in KEYWORD_CASES:
+        kept = _context_keywords(list(_extract_keywords_cached(question, 10)))
+        missing = [kw for kw in topic if kw not in kept]
+        if missing:
+            failures += 1
+            print(f"❌ {question}: 丢掉了主题词 {missing}（保留 {kept}）")
+
+    print(f"\n{'='*60}")
+    if failures:
+        print(f"❌ 共 {failures} 处不符合预期")
+        sys.exit(1)
+    print(f"✅ {len(CONTEXT_CASES)} 个问题的上下文优先选入主题句，{len(KEYWORD_CASES)} 个问题的主题词全部保留")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+增量重新加载一致性检查脚本
+在临时数据目录中构造几组教材文件的变化（新增、修改、删除，含跨文件的近似重复文本块），
+比较 reload_changed 增量构建的语料与从头全量构建的语料是否完全一致：
+文本块（内容、元数据、来源）、倒排索引、化学式索引和检索结果。
+
+用法（在 backend 目录下）：
+    python scripts/check_incremental_reload.py
+"""
+import json
+import random
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from services.rag_service import TextbookRAG  # noqa: E402
+
+SUBDIRS = ["a", "b", "c"]
+QUESTIONS = ["氧化还原", "化学键 电子", "溶液浓度 平衡"]
+
+_POOL = "氢氦锂铍硼碳氮氧氟氖钠镁铝硅磷硫氯氩钾钙酸碱盐键能级电子质子中子原分离晶体溶液浓度平衡速率催化氧化还原"
+
+
+def paragraph(seed: int, length: int = 300) -> str:
+    """互不相似的随机段落"""
+    rng = random.Random(seed)
+    return "".join(rng.choice(_POOL) for _ in range(length))
+
+
+def rewrite(text: str, start: int, count: int, seed: int) -> str:
+    """改写段落中的一段，得到近似重复的段落"""
+    rng = random.Random(seed)
+    return text[:start] + "".join(rng.choice(_POOL) for _ in range(count)) + text[start + count:]
+
+
+P1, P2, P3, P4, P5 = (paragraph(seed) for seed in range(1, 6))
+# 与 P1 近似重复
+P1_A = rewrite(P1, 0, 25, 7)
+P1_B = rewrite(P1, 290, 10, 8)
+# 与 P1_A 近似重复，但与 P1 不够相似
+P1_AA = rewrite(P1_A, 290, 10, 9)
+
+
+def write_file(root: Path, subdir: str, contents) -> None:
+    """写入子目录下的教材文件；contents 为 None 时删除"""
+    path = root / subdir / "textbook.json"
+    if contents is None:
+        path.unlink(missing_ok=True)
+        return
+    data = [{"metadata": {"chapter": f"{subdir}-{i}"}, "content": content} for i, content in enumerate(contents)]
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+def subdir_order(root: Path):
+    """TextbookRAG 遍历教材子目录的顺序"""
+    rag = TextbookRAG.__new__(TextbookRAG)
+    rag.data_dir = root
+    rag.subdirs = None
+    return [path.parent.name for path in rag._list_source_files()]
+
+
+# 按遍历顺序排在第一、第二、第三的文件
+first, middle, last = range(3)
+
+# (说明, 初始文件, 变化的文件)
+SCENARIOS = [
+    ("新文件中的文本块与后面未变化文件的文本块重复",
+     {middle: [P2], last: [P1]}, {first: [P1_A, P3]}),
+    ("修改的文件与前面未变化文件的文本块重复",
+     {first: [P1], middle: [P2], last: [P3]}, {middle: [P1_A, P4]}),
+    ("修改的文件合并到前面的文本块，后面文件之前也合并到了同一个文本块",
+     {first: [P1], middle: [P4], last: [P1_B]}, {middle: [P1_A]}),
+    ("后面文件合并到了前面的文本块，新文本块与它更相似",
+     {first: [P1], middle: [P4], last: [P1_A]}, {middle: [P1_AA, P5]}),
+    ("删除合并到前面文本块的文件",
+     {first: [P1], middle: [P1_A], last: [P2]}, {middle: None}),
+    ("修改合并过后面文件的文本块所在的文件",
+     {first: [P1, P2], middle: [P1_B], last: [P3]}, {first: [P2, P4]}),
+]
+
+
+def corpus_state(rag: TextbookRAG):
+    corpus = rag._corpus
+    chunks = [(chunk["content"], chunk["metadata"], chunk["source"]) for chunk in rag.chunks]
+    postings = {term: dict(posting.items()) for term, posting in corpus.postings.items()}
+    formulas = {formula: dict(posting.items()) for formula, posting in corpus.formulas.items()}
+    results = [[(r["content"], r["relevance_score"]) for r in rag.search(q, top_k=10)] for q in QUESTIONS]
+    return chunks, postings, formulas, results
+
+
+def check(description: str, initial, changes, persist_index: bool) -> bool:
+    root = Path(tempfile.mkdtemp())
+    try:
+        for subdir in SUBDIRS:
+            (root / subdir).mkdir()
+            write_file(root, subdir, [])
+        order = subdir_order(root)
+        for position, contents in initial.items():
+            write_file(root, order[position], contents)
+        incremental = TextbookRAG(data_dir=str(root), persist_index=persist_index, load_workers=1)
+        for position, contents in changes.items():
+            write_file(root, order[position], contents)
+        incremental.reload_changed()
+        cold = TextbookRAG(data_dir=str(root), persist_index=False, load_workers=1)
+
+        names = ["文本块", "倒排索引", "化学式索引", "检索结果"]
+        ok = True
+        for name, got, expected in zip(names, corpus_state(incremental), corpus_state(cold)):
+            if got != expected:
+                ok = False
+                print(f"❌ [{'持久化' if persist_index else '内存'}] {description}: {name}不一致")
+        return ok
+    finally:
+        shutil.rmtree(root)
+
+
+def main():
+    failures = 0
+    for description, initial, changes in SCENARIOS:
+        for persist_index in (False, True):
+            if not check(description, initial, changes, persist_index):
+                failures += 1
+
+    print(f"\n{'='*60}")
+    if failures:
+        print(f"❌ 共 {failures} 处不一致")
+        sys.exit(1)
+    print(f"✅ {len(SCENARIOS)} 组变化在内存和持久化索引上增量构建与全量构建完全一致")
+
+
+if __name__ == "__main__":
+    main()
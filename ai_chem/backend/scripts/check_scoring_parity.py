@@ -0,0 +1,107 @@
+"""
+评分后端一致性检查脚本
+对一组固定问题，比较各评分后端的分数与 TextbookRAG._calculate_relevance（参考实现）
+在每个文本块上的结果，以及 search 返回的排序是否完全一致。
+
+用法（在 backend 目录下）：
+    python scripts/check_scoring_parity.py
+"""
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from services.rag_service import TextbookRAG  # noqa: E402
+from services.sparse_scoring import SPARSE_AVAILABLE  # noqa: E402
+
+PARITY_QUESTIONS = [
+    "什么是化学键？",
+    "氨气为什么是极性分子？",
+    "水的化学式是什么？",
+    "氧化还原反应的本质是什么？",
+    "H2SO4 的性质",
+    "Ca(OH)2 与 CO2 反应",
+    "Fe3+ 的检验",
+    "铝 Al 的两性",
+    "化学反应速率的影响因素",
+    "盐类的水解",
+    "原电池的工作原理",
+    "有机物 乙醇 乙酸 酯化反应",
+    "元素周期表 周期律",
+    "胶体 丁达尔效应",
+]
+
+
+def chunk_keywords(rag: TextbookRAG, keywords, chunk_idx: int):
+    """化学式关键词只在化学式索引给出的文本块中计分，其余文本块中视为不出现"""
+    corpus = rag._corpus
+    return [kw for kw in keywords
+            if corpus.formula_chunks(kw) is None or chunk_idx in corpus.formula_chunks(kw)]
+
+
+def reference_relevance(rag: TextbookRAG, chunk_idx: int, keywords) -> float:
+    """参考实现在一个文本块上的分数"""
+    return rag._calculate_relevance(rag.chunks[chunk_idx]["content"], chunk_keywords(rag, keywords, chunk_idx))
+
+
+def reference_ranking(rag: TextbookRAG, question: str, top_k: int, min_score: float = 0.1):
+    """用参考实现对全部文本块评分并稳定排序"""
+    keywords = rag.extract_keywords(question)
+    if not keywords:
+        return []
+    scored = []
+    for chunk_idx in range(len(rag.chunks)):
+        score = reference_relevance(rag, chunk_idx, keywords)
+        if score >= min_score:
+            scored.append((chunk_idx, score))
+    scored.sort(key=lambda x: x[1], reverse=True)
+    return scored[:top_k]
+
+
+def ranking_of(results):
+    return [(r["content"], r["relevance_score"]) for r in results]
+
+
+def main():
+    backends = ["python"] + (["sparse"] if SPARSE_AVAILABLE else [])
+    if not SPARSE_AVAILABLE:
+        print("⚠️ 未安装 numpy/scipy，跳过 sparse 后端")
+
+    rags = {backend: TextbookRAG(scoring_backend=backend) for backend in backends}
+    reference = rags["python"]
+    failures = 0
+
+    for question in PARITY_QUESTIONS:
+        expected = reference_ranking(reference, question, top_k=10)
+        expected_ranking = [(reference.chunks[idx]["content"], score) for idx, score in expected]
+
+        for backend, rag in rags.items():
+            got = ranking_of(rag.search(question, top_k=10))
+            if got != expected_ranking:
+                failures += 1
+                print(f"❌ [{backend}] 排序不一致: {question}")
+
+        if "sparse" in rags:
+            # 逐块比较全部分数，而不仅是 top-k
+            rag = rags["sparse"]
+            keywords = rag.extract_keywords(question)
+            if keywords:
+                scores = rag._get_sparse_scorer().score_all(keywords)
+                for chunk_idx in range(len(rag.chunks)):
+                    expected_score = reference_relevance(rag, chunk_idx, keywords)
+                    if scores[chunk_idx] != expected_score:
+                        failures += 1
+                        print(f"❌ [sparse] 分数不一致: {question} chunk={chunk_idx} "
+                              f"{scores[chunk_idx]} != {expected_score}")
+                        break
+
+    print(f"\n{'='*60}")
+    if failures:
+        print(f"❌ 共 {failures} 处不一致")
+        sys.exit(1)
+    print(f"✅ {len(PARITY_QUESTIONS)} 个问题在 {', '.join(backends)} 后端上与参考实现完全一致")
+
+
+if __name__ == "__main__":
+    main()
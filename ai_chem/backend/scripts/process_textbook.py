@@ -18,6 +18,13 @@ if sys.platform == "win32":
     except:
         os.system("chcp 65001 > nul 2>&1")
 
+# 化学式切分规则与检索服务共用（services/chem_formula.py）
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from services.chem_formula import extract_chemical_entities  # noqa: E402
+from services.near_dup import DUPLICATES_FIELD, NearDuplicateIndex, signature  # noqa: E402
+
 
 def safe_import_unstructured():
     """安全导入 PDF 解析库，按稳定性排序"""
@@ -172,37 +179,8 @@ def split_into_chunks(text: str, chunk_size: int = 400, overlap_sentences: int =
     return chunks
 
 
-def extract_chemical_entities(text: str) -> Dict[str, List[str]]:
-    """简单的化学实体提取"""
-    entities = {
-        "formulas": [],
-        "elements": [],
-        "compounds": []
-    }
-
-    # 常见元素符号
-    common_elements = [
-        'H', 'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne',
-        'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl', 'Ar', 'K', 'Ca',
-        'Fe', 'Cu', 'Zn', 'Ag', 'Ba', 'Hg', 'Mn'
-    ]
-
-    # 提取化学式（简单模式：大写字母+数字/小写字母+数字）
-    formula_pattern = r'\b[A-Z][a-z]?\d*\b'
-    formulas = re.findall(formula_pattern, text)
-
-    # 过滤并分类
-    for f in set(formulas):
-        if f in common_elements:
-            entities["elements"].append(f)
-        elif len(f) > 1:  # 可能是化合物
-            entities["formulas"].append(f)
-
-    return entities
-
-
-def parse_textbook(pdf_path: Path, output_dir: Path) -> Optional[Dict[str, Any]]:
-    """解析单个教材PDF"""
+def parse_textbook(pdf_path: Path, output_dir: Path, save: bool = True) -> Optional[Dict[str, Any]]:
+    """解析单个教材PDF（save 为 False 时不写出JSON，由调用方去重后用 save_result 保存）"""
     print(f"\n{'='*60}")
     print(f"📖 正在处理: {pdf_path.name}")
     print(f"{'='*60}")
@@ -341,14 +319,57 @@ def parse_textbook(pdf_path: Path, output_dir: Path) -> Optional[Dict[str, Any]]
         ]
     }
 
-    # 保存JSON
-    output_file = output_dir / f"{pdf_path.stem}.json"
+    if save:
+        save_result(result, output_dir / f"{pdf_path.stem}.json")
+
+    return result
+
+
+def save_result(result: Dict[str, Any], output_file: Path) -> None:
+    """保存一本教材的解析结果"""
     with open(output_file, 'w', encoding='utf-8') as f:
         json.dump(result, f, ensure_ascii=False, indent=2)
 
     print(f"💾 已保存到: {output_file}")
 
-    return result
+
+def deduplicate_results(results: List[Dict[str, Any]]) -> int:
+    """
+    合并所有教材中的近似重复文本块（如不同版本教材中相同的段落）
+
+    按教材和章节顺序检测（MinHash + LSH，见 services/near_dup.py），
+    先出现的文本块保留，后出现的近似重复文本块删除，
+    其 chunk_id、来源和章节追加到保留文本块 metadata 的 duplicates 列表中。
+
+    Returns:
+        删除的文本块数量
+    """
+    index = NearDuplicateIndex()
+    kept_chunks: List[Dict[str, Any]] = []
+    removed = 0
+
+    for result in results:
+        for section in result["sections"]:
+            kept = []
+            for chunk in section["chunks"]:
+                canonical = index.add_or_find(len(kept_chunks), signature(chunk["text"]))
+                if canonical is None:
+                    kept.append(chunk)
+                    kept_chunks.append(chunk)
+                    continue
+                duplicates = kept_chunks[canonical]["metadata"].setdefault(DUPLICATES_FIELD, [])
+                duplicates.append({
+                    "chunk_id": chunk["chunk_id"],
+                    "source": chunk["metadata"]["source"],
+                    "section": chunk["section_title"],
+                })
+                duplicates.extend(chunk["metadata"].get(DUPLICATES_FIELD, []))
+                removed += 1
+            section["chunks"] = kept
+            section["chunk_count"] = len(kept)
+        result["total_chunks"] = sum(section["chunk_count"] for section in result["sections"])
+
+    return removed
 
 
 def main():
@@ -383,12 +404,20 @@ def main():
 
     print(f"📚 找到 {len(pdf_files)} 本教材")
 
-    # 处理每本教材
+    # 处理每本教材（全部解析完、跨教材去重后再保存）
     all_results = []
     for pdf_file in pdf_files:
-        result = parse_textbook(pdf_file, output_dir)
+        result = parse_textbook(pdf_file, output_dir, save=False)
         if result:
-            all_results.append(result)
+            all_results.append((pdf_file, result))
+
+    print("\n⏳ 正在合并近似重复文本块...")
+    removed = deduplicate_results([result for _, result in all_results])
+    print(f"✅ 合并了 {removed} 个近似重复文本块")
+
+    for pdf_file, result in all_results:
+        save_result(result, output_dir / f"{pdf_file.stem}.json")
+    all_results = [result for _, result in all_results]
 
     # 生成汇总报告
     print(f"\n{'='*60}")
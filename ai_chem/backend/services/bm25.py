@@ -0,0 +1,114 @@
+"""
+BM25 相关性评分
+与关键词计数评分（_calculate_relevance）不同，BM25 用 IDF 压低“化学”这类常见词的权重，
+并按文本块长度归一化词频，避免长文本块仅因篇幅占优。
+
+文档长度（小写正文的字符数）在加载时统计并随持久化索引保存；
+二元组关键词的文档频率和词频直接来自倒排表，更长的关键词在候选文本块中计数。
+"""
+import math
+from array import array
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from services.chunk_text import NormalizedText
+from services.scoring import TopK, is_self_overlapping
+
+# BM25 参数：词频饱和度和长度归一化强度
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+class CorpusStats:
+    """BM25 需要的语料统计：各文本块长度和平均长度"""
+
+    __slots__ = ("doc_lengths", "avg_length")
+
+    def __init__(self, doc_lengths: array):
+        self.doc_lengths = doc_lengths
+        self.avg_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+
+    @classmethod
+    def from_normalized(cls, normalized: Sequence[NormalizedText]) -> "CorpusStats":
+        return cls(array("I", (len(norm.text) for norm in normalized)))
+
+
+def idf(n_docs: int, df: int) -> float:
+    """BM25 的 IDF（加 1 平滑，始终为正）"""
+    return math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+
+
+class BM25Scorer:
+    """单个查询的 BM25 评分器"""
+
+    def __init__(self, keywords: List[str], corpus, gram_size: int,
+                 allowed: Optional[FrozenSet[int]] = None):
+        """
+        Args:
+            keywords: 查询关键词（按小写去重，与关键词评分的大小写规则一致）
+            corpus: 语料快照（CorpusSnapshot）
+            gram_size: 倒排索引的词项长度
+            allowed: 元数据过滤后允许的文本块，None 表示不限制；
+                     IDF 和平均长度仍按整个语料计算，过滤不改变分数
+        """
+        self.corpus = corpus
+        self.gram_size = gram_size
+        self.allowed = allowed
+        self.terms = list(dict.fromkeys(kw.lower() for kw in keywords))
+
+    def _term_frequencies(self, term: str) -> Tuple[Dict[int, int], int]:
+        """
+        关键词在各文本块中的不重叠出现次数（只包含出现过的文本块；化学式只统计化学式索引中的文本块）
+
+        Returns:
+            (允许的文本块中的词频, 整个语料中的文档频率)
+        """
+        corpus = self.corpus
+        allowed = self.allowed
+        if (len(term) == self.gram_size and not is_self_overlapping(term)
+                and corpus.formula_chunks(term) is None):
+            posting = corpus.postings.get(term) or {}
+            if allowed is None:
+                return dict(posting.items()), len(posting)
+            return {chunk_idx: tf for chunk_idx, tf in posting.items() if chunk_idx in allowed}, len(posting)
+
+        frequencies = {}
+        df = 0
+        for chunk_idx in corpus.candidate_chunks([term]):
+            text = corpus.normalized[chunk_idx].text
+            if allowed is not None and chunk_idx not in allowed:
+                # 过滤掉的文本块只需判断是否出现（计入文档频率），不必计数
+                df += term in text
+                continue
+            count = text.count(term)
+            if count:
+                frequencies[chunk_idx] = count
+                df += 1
+        return frequencies, df
+
+    def scores(self) -> Dict[int, float]:
+        """返回 {文本块下标: BM25 分数}，不含任何关键词的文本块不出现"""
+        corpus = self.corpus
+        stats = corpus.stats
+        n_docs = len(corpus)
+        if not n_docs or not stats.avg_length:
+            return {}
+
+        doc_lengths = stats.doc_lengths
+        norm = BM25_K1 / stats.avg_length
+        scores: Dict[int, float] = {}
+        for term in self.terms:
+            frequencies, df = self._term_frequencies(term)
+            if not frequencies:
+                continue
+            weight = idf(n_docs, df)
+            for chunk_idx, tf in frequencies.items():
+                denom = tf + BM25_K1 * (1.0 - BM25_B) + BM25_B * norm * doc_lengths[chunk_idx]
+                scores[chunk_idx] = scores.get(chunk_idx, 0.0) + weight * tf * (BM25_K1 + 1.0) / denom
+        return scores
+
+    def top_k(self, top_k: int, min_score: float) -> List[Tuple[int, float]]:
+        """返回分数最高的 top_k 个 (文本块下标, 分数)，同分时下标小的优先"""
+        top = TopK(top_k, min_score)
+        for chunk_idx, score in sorted(self.scores().items()):
+            top.push(chunk_idx, score)
+        return top.result()
@@ -0,0 +1,116 @@
+"""
+化学式识别
+按元素符号、括号基团、结晶水和离子电荷切分化学式，供教材预处理（scripts/process_textbook.py）
+和检索时的关键词提取共同使用，两边得到的化学式写法一致。
+
+例如 "Ca(OH)2"、"H2SO4"、"CuSO4·5H2O"、"Fe3+"、"SO42-" 都作为一个整体识别，
+不会被切成 "Ca"、"OH" 这样的片段；单个字母的元素符号（如 "C"、"H"）不单独作为化学式。
+与常见英文单词同形的元素符号（如 "In"、"No"、"As"）前后紧挨着英文单词时视为英文，
+"In this case" 中的 "In" 不是铟，"Be、Mg" 中的 "Be" 仍是铍。
+"""
+import re
+from typing import Dict, List
+
+# 元素周期表中的全部元素符号
+ELEMENT_SYMBOLS = frozenset("""
+H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe Co Ni Cu Zn Ga Ge As Se Br Kr
+Rb Sr Y Zr Nb Mo Tc Ru Rh Pd Ag Cd In Sn Sb Te I Xe Cs Ba La Ce Pr Nd Pm Sm Eu Gd Tb Dy Ho Er Tm Yb
+Lu Hf Ta W Re Os Ir Pt Au Hg Tl Pb Bi Po At Rn Fr Ra Ac Th Pa U Np Pu Am Cm Bk Cf Es Fm Md No Lr
+Rf Db Sg Bh Hs Mt Ds Rg Cn Nh Fl Mc Lv Ts Og
+""".split())
+
+# 上下标数字、电荷符号、全角括号和各种中点统一为 ASCII 写法（结晶水的点统一为 "·"）
+_FORMULA_CHAR_MAP = str.maketrans({
+    **{chr(0x2080 + i): str(i) for i in range(10)},
+    **{sup: str(i) for i, sup in enumerate("⁰¹²³⁴⁵⁶⁷⁸⁹")},
+    "⁺": "+", "⁻": "-", "＋": "+", "－": "-", "−": "-",
+    "（": "(", "）": ")", "［": "(", "］": ")", "[": "(", "]": ")",
+    "•": "·", "・": "·", "∙": "·", "⋅": "·",
+})
+
+# 与常见英文单词同形的元素符号，单独出现（不带下标和电荷）且与英文单词相邻时不作为化学式
+WORD_LIKE_SYMBOLS = frozenset({"In", "No", "As", "At", "Be", "He", "Am"})
+
+# 两个字母的元素符号优先匹配（"Cl" 不能被切成 "C" + "l"）
+_ELEMENT = "(?:" + "|".join(sorted(ELEMENT_SYMBOLS, key=len, reverse=True)) + ")"
+# 一个组成单元：元素符号加下标，或带下标的括号基团，如 "(OH)2"
+_UNIT = rf"(?:{_ELEMENT}\d*|\((?:{_ELEMENT}\d*)+\)\d*)"
+
+# 化学式：前面不能紧跟字母或数字（系数除外），后面不能紧跟小写字母（避免匹配英文单词的开头）。
+# 电荷符号后面不能紧跟字母、数字或括号，"H2+O2" 中的 "+" 是加号而不是电荷。
+FORMULA_PATTERN = re.compile(
+    rf"(?<![A-Za-z0-9])\d*"
+    rf"((?:{_UNIT})+(?:·\d*(?:{_UNIT})+)*(?:\d*[+-](?![A-Za-z0-9(]))?)"
+    rf"(?![a-z])"
+)
+
+
+def normalize_formula_text(text: str) -> str:
+    """把上下标数字、电荷符号和全角括号等转换为 ASCII 写法"""
+    return text.translate(_FORMULA_CHAR_MAP)
+
+
+def _is_bare_letter(token: str) -> bool:
+    """单个字母的元素符号（不带下标和电荷），在正文中多为选项、变量等，不作为化学式"""
+    return len(token) == 1
+
+
+def _is_english_word(text: str, match: re.Match) -> bool:
+    """匹配到的是与英文单词同形的元素符号，且前后（跳过空白）紧挨着英文字母"""
+    if match.group(0) not in WORD_LIKE_SYMBOLS:
+        return False
+    before = text[:match.start()].rstrip()
+    after = text[match.end():].lstrip()
+    return (bool(before) and before[-1].isascii() and before[-1].isalpha()) or \
+        (bool(after) and after[0].isascii() and after[0].isalpha())
+
+
+def extract_formulas(text: str) -> List[str]:
+    """
+    提取文本中的化学式和离子（去重，按首次出现的顺序）
+
+    Returns:
+        化学式列表，如 ["Ca(OH)2", "CO2", "CaCO3"]
+    """
+    text = normalize_formula_text(text)
+    seen = set()
+    formulas = []
+    for match in FORMULA_PATTERN.finditer(text):
+        token = match.group(1)
+        if not _is_bare_letter(token) and not _is_english_word(text, match) and token not in seen:
+            seen.add(token)
+            formulas.append(token)
+    return formulas
+
+
+def is_formula(text: str) -> bool:
+    """text 本身是否恰好是一个化学式（用于判断检索关键词能否直接查化学式索引）"""
+    match = FORMULA_PATTERN.fullmatch(normalize_formula_text(text))
+    return match is not None and match.group(1) == text and not _is_bare_letter(text)
+
+
+def extract_chemical_entities(text: str) -> Dict[str, List[str]]:
+    """
+    化学实体提取
+
+    Returns:
+        {"formulas": 化合物和离子, "elements": 元素符号, "compounds": 预留}
+    """
+    entities = {
+        "formulas": [],
+        "elements": [],
+        "compounds": []
+    }
+
+    for token in extract_formulas(text):
+        if token in ELEMENT_SYMBOLS:
+            entities["elements"].append(token)
+        else:
+            entities["formulas"].append(token)
+
+    return entities
+
+
+def entity_terms(entities: Dict[str, List[str]]) -> List[str]:
+    """化学实体中需要进入化学式索引的词项（化学式和元素符号）"""
+    return list(dict.fromkeys(entities.get("formulas", []) + entities.get("elements", [])))
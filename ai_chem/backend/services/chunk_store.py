@@ -0,0 +1,143 @@
+"""
+文本块存储
+按列保存文本块：正文一列，来源和元数据只保存整数编号，
+编号指向去重后的来源表和元数据表（其中的字符串都经过 intern）。
+检索结果需要返回给调用方时才构造 dict。
+"""
+import json
+import sys
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 一个文本块的三个字段：(正文, 元数据, 来源)
+ChunkRecord = Tuple[str, Dict[str, Any], str]
+
+
+def _intern_value(value: Any) -> Any:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class ChunkStore(Sequence):
+    """
+    列式文本块存储
+
+    store[i] 返回新构造的 {"content", "metadata", "source"} dict（metadata 为副本），
+    调用方修改返回值不会影响存储本身。
+    """
+
+    __slots__ = ("_contents", "_source_ids", "_metadata_ids", "_sources", "_source_index",
+                 "_metadata", "_metadata_index")
+
+    def __init__(self, chunks: Iterable[Dict] = ()):
+        self._contents: List[str] = []
+        self._source_ids = array("I")
+        self._metadata_ids = array("I")
+        # 去重后的来源和元数据，以及反查编号用的字典
+        self._sources: List[str] = []
+        self._source_index: Dict[str, int] = {}
+        self._metadata: List[Dict[str, Any]] = []
+        self._metadata_index: Dict[str, int] = {}
+
+        for chunk in chunks:
+            self.append(chunk)
+
+    def __getstate__(self):
+        # 反查字典可以由列表重建，不随进程间传递
+        return self._contents, self._source_ids, self._metadata_ids, self._sources, self._metadata
+
+    def __setstate__(self, state):
+        self._contents, self._source_ids, self._metadata_ids, self._sources, self._metadata = state
+        self._source_index = {source: i for i, source in enumerate(self._sources)}
+        self._metadata_index = {self._metadata_key(meta): i for i, meta in enumerate(self._metadata)}
+
+    def __len__(self) -> int:
+        return len(self._contents)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return materialize_at(self, idx)
+
+    @staticmethod
+    def _metadata_key(metadata: Dict[str, Any]) -> str:
+        return json.dumps(metadata, ensure_ascii=False, sort_keys=True)
+
+    def _source_id(self, source: str) -> int:
+        source_id = self._source_index.get(source)
+        if source_id is None:
+            source_id = self._source_index[source] = len(self._sources)
+            self._sources.append(sys.intern(source))
+        return source_id
+
+    def _metadata_id(self, metadata: Dict[str, Any]) -> int:
+        key = self._metadata_key(metadata)
+        metadata_id = self._metadata_index.get(key)
+        if metadata_id is None:
+            metadata_id = self._metadata_index[key] = len(self._metadata)
+            self._metadata.append({sys.intern(k): _intern_value(v) for k, v in metadata.items()})
+        return metadata_id
+
+    def append_record(self, content: str, metadata: Dict[str, Any], source: str) -> None:
+        self._contents.append(content)
+        self._source_ids.append(self._source_id(source))
+        self._metadata_ids.append(self._metadata_id(metadata))
+
+    def append(self, chunk: Dict) -> None:
+        """追加一个 {"content", "metadata", "source"} 格式的文本块"""
+        self.append_record(chunk["content"], chunk.get("metadata", {}), chunk.get("source", ""))
+
+    def extend(self, other: Sequence, start: int = 0, count: Optional[int] = None) -> None:
+        """
+        追加另一个存储（或文本块序列）中 [start, start + count) 范围内的文本块
+
+        另一方也是 ChunkStore 时只转换来源和元数据编号，不重新比较字符串。
+        """
+        if count is None:
+            count = len(other) - start
+
+        if isinstance(other, ChunkStore):
+            source_map = [self._source_id(source) for source in other._sources]
+            metadata_map = [self._metadata_id(metadata) for metadata in other._metadata]
+            end = start + count
+            self._contents.extend(other._contents[start:end])
+            self._source_ids.extend(source_map[i] for i in other._source_ids[start:end])
+            self._metadata_ids.extend(metadata_map[i] for i in other._metadata_ids[start:end])
+            return
+
+        for idx in range(start, start + count):
+            self.append_record(*record_at(other, idx))
+
+    def content(self, idx: int) -> str:
+        return self._contents[idx]
+
+    def source(self, idx: int) -> str:
+        return self._sources[self._source_ids[idx]]
+
+    def metadata(self, idx: int) -> Dict[str, Any]:
+        """文本块的元数据（存储内部共享的对象，只读）"""
+        return self._metadata[self._metadata_ids[idx]]
+
+    def record(self, idx: int) -> ChunkRecord:
+        return self._contents[idx], self.metadata(idx), self.source(idx)
+
+    def set_metadata(self, idx: int, metadata: Dict[str, Any]) -> None:
+        """替换一个文本块的元数据（如合并近似重复文本块后追加来源）"""
+        self._metadata_ids[idx] = self._metadata_id(metadata)
+
+
+def record_at(chunks: Sequence, idx: int) -> ChunkRecord:
+    """读取任意文本块序列（ChunkStore、MappedChunks 或 dict 列表）中的一个文本块"""
+    record = getattr(chunks, "record", None)
+    if record is not None:
+        return record(idx)
+    chunk = chunks[idx]
+    return chunk["content"], chunk.get("metadata", {}), chunk.get("source", "")
+
+
+def materialize_at(chunks: Sequence, idx: int, extra: Optional[Dict[str, Any]] = None) -> Dict:
+    """从任意文本块序列构造文本块 dict，附加字段写入同一个 dict"""
+    content, metadata, source = record_at(chunks, idx)
+    chunk = {"content": content, "metadata": dict(metadata), "source": source}
+    if extra:
+        chunk.update(extra)
+    return chunk
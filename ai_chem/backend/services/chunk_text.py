@@ -0,0 +1,68 @@
+"""
+文本块预处理
+在加载教材时一次性计算每个文本块的小写文本和分句边界，检索时直接复用
+"""
+import re
+from array import array
+from bisect import bisect_left
+from typing import Optional
+
+# 分句分隔符（与 _calculate_relevance 的分句规则一致）
+SENTENCE_DELIMITERS = "。！？；\n"
+SENTENCE_SPLIT_PATTERN = re.compile(r'[。！？；\n]')
+
+
+class NormalizedText:
+    """
+    预处理后的文本块
+
+    text 为小写后的正文；sentence_ends 记录每个句子的结束位置（即分隔符位置，
+    最后一句为文本长度），第 i 句为 text[sentence_ends[i-1] + 1:sentence_ends[i]]。
+    """
+
+    __slots__ = ("text", "sentence_ends")
+
+    def __init__(self, text: str, sentence_ends: array):
+        self.text = text
+        self.sentence_ends = sentence_ends
+
+    @property
+    def sentence_count(self) -> int:
+        return len(self.sentence_ends)
+
+    def sentence_start(self, idx: int) -> int:
+        return self.sentence_ends[idx - 1] + 1 if idx > 0 else 0
+
+    def sentence(self, idx: int) -> str:
+        return self.text[self.sentence_start(idx):self.sentence_ends[idx]]
+
+    def sentence_index(self, pos: int) -> int:
+        """返回文本位置 pos 所在句子的序号"""
+        return bisect_left(self.sentence_ends, pos)
+
+    def first_sentence_with(self, keyword: str) -> Optional[int]:
+        """
+        返回第一个包含关键词的句子序号，不存在时返回 None
+
+        关键词本身不含分隔符时，它的第一次出现必然落在某一个句子内部，
+        该句子就是第一个包含它的句子；含分隔符的关键词不可能被任何句子包含。
+        """
+        pos = self.text.find(keyword)
+        if pos < 0:
+            return None
+        if SENTENCE_SPLIT_PATTERN.search(keyword):
+            return None
+        return self.sentence_index(pos)
+
+
+def sentence_ends_of(text: str) -> array:
+    """每个句子的结束位置（分隔符位置，最后一句为文本长度）"""
+    sentence_ends = array("I", (m.start() for m in SENTENCE_SPLIT_PATTERN.finditer(text)))
+    sentence_ends.append(len(text))
+    return sentence_ends
+
+
+def normalize_text(content: str) -> NormalizedText:
+    """计算文本块的小写文本和分句边界"""
+    text = content.lower()
+    return NormalizedText(text, sentence_ends_of(text))
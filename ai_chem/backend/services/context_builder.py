@@ -0,0 +1,216 @@
+"""
+LLM上下文组装
+按 token 预算把检索结果组装为上下文：以句子为单位挑选价值最高的内容，
+不会在句子中间截断；重复的句子（process_textbook.py 分块时相邻文本块故意重叠的句子）
+和几乎相同的文本块只保留一份。
+
+句子价值 = 句中出现的不同关键词数 + 所在文本块的排名权重 1 / (排名 + 1)，
+按价值从高到低放入预算，放不下的句子跳过、继续尝试后面更短的句子。
+文本块中有句子包含关键词时只选这些句子；完全不含关键词的文本块（如向量检索命中的）
+所有句子都可以入选，价值只有排名权重。
+最终每个来源内的句子保持原文顺序，不相邻的句子之间用“……”连接。
+
+文本块可能很长（整章十几万字），关键词直接在加载时预处理好的小写文本（NormalizedText）中查找，
+按分句边界定位到句子，只有候选句子才切出原文；几乎相同的文本块也只比较候选句子。
+
+token 数默认按中文约 1.5 字/token、其他字符约 4 字符/token 估算
+（与 process_textbook.py 分块时的估算一致），也可以传入真实分词器的计数函数。
+"""
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from services.chunk_text import SENTENCE_SPLIT_PATTERN, NormalizedText, normalize_text, sentence_ends_of
+
+# 默认上下文预算（token），约合 1800 个汉字
+DEFAULT_CONTEXT_TOKENS = 1200
+
+# 新文本块与已选文本块候选句子的二元组 Jaccard 相似度达到该值时视为几乎相同，整块跳过
+# （只比较候选句子，用双向的相似度而不是包含比例，避免短文本块的几句话被长文本块"包含"而误判）
+NEAR_DUPLICATE_RATIO = 0.9
+
+# 来源之间的分隔符，以及同一来源内不相邻句子之间的省略号
+SOURCE_SEPARATOR = "\n\n"
+GAP_MARKER = "……"
+
+# 中日韩文字（含全角标点）按字计算 token
+_CJK_PATTERN = re.compile("[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+# 句子去重时忽略的字符：空白和标点
+_DEDUP_IGNORED = re.compile(r"[\s\W_]+")
+
+TokenCounter = Callable[[str], int]
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 数"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return max(1, round(cjk / 1.5 + (len(text) - cjk) / 4))
+
+
+def sentence_key(sentence: str) -> str:
+    """句子去重键：忽略大小写、空白和标点"""
+    return _DEDUP_IGNORED.sub("", sentence.lower())
+
+
+def _sentence_at(content: str, sentence_ends: Sequence[int], idx: int) -> str:
+    """第 idx 句原文：保留结尾的分隔符（包括换行），去掉其余首尾空白"""
+    start = sentence_ends[idx - 1] + 1 if idx > 0 else 0
+    raw = content[start:sentence_ends[idx] + 1]
+    sentence = raw.strip()
+    if sentence and raw.endswith("\n"):
+        sentence += "\n"
+    return sentence
+
+
+def split_sentences(content: str) -> List[str]:
+    """
+    按检索时的分句边界（sentence_ends_of）切分正文
+
+    每句保留结尾的分隔符（包括换行），去掉其余首尾空白；空句子也保留，
+    列表下标就是句子序号，用来判断两个句子在原文中是否相邻。
+    """
+    sentence_ends = sentence_ends_of(content)
+    return [_sentence_at(content, sentence_ends, idx) for idx in range(len(sentence_ends))]
+
+
+def sentence_hits(normalized: NormalizedText, keywords: Iterable[str]) -> Dict[int, int]:
+    """
+    包含关键词的句子及其中出现的不同关键词数
+
+    每个关键词在小写文本中逐次查找，找到后按分句边界定位句子并跳到下一句继续，
+    只访问包含关键词的句子；含分隔符的关键词不可能被任何句子包含。
+    """
+    text = normalized.text
+    sentence_ends = normalized.sentence_ends
+    hits: Dict[int, int] = {}
+    for keyword in keywords:
+        if SENTENCE_SPLIT_PATTERN.search(keyword):
+            continue
+        pos = text.find(keyword)
+        while pos >= 0:
+            idx = normalized.sentence_index(pos)
+            hits[idx] = hits.get(idx, 0) + 1
+            pos = text.find(keyword, sentence_ends[idx] + 1)
+    return hits
+
+
+def _bigrams(text: str) -> Set[str]:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _truncate(text: str, max_tokens: int, count_tokens: TokenCounter) -> str:
+    """截取 text 的最长前缀（加省略号）使其不超过 max_tokens"""
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid] + GAP_MARKER) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + GAP_MARKER if low else ""
+
+
+class _Candidate:
+    """一个候选句子"""
+
+    __slots__ = ("source", "position", "text", "tokens", "value")
+
+    def __init__(self, source: int, position: int, text: str, tokens: int, value: float):
+        self.source = source
+        self.position = position
+        self.text = text
+        self.tokens = tokens
+        self.value = value
+
+
+def build_context(results: Sequence[Dict], keywords: Sequence[str],
+                  max_tokens: int = DEFAULT_CONTEXT_TOKENS,
+                  count_tokens: Optional[TokenCounter] = None,
+                  normalized: Optional[Sequence[Optional[NormalizedText]]] = None) -> str:
+    """
+    在 token 预算内组装上下文
+
+    Args:
+        results: 检索结果（按相关性排序的文本块）
+        keywords: 查询关键词，用于衡量句子价值
+        max_tokens: 上下文的 token 预算（含来源标记和分隔符）
+        count_tokens: token 计数函数，默认为 estimate_tokens
+        normalized: 与 results 对应的预处理文本（语料中的 NormalizedText），缺省时现场计算
+
+    Returns:
+        格式化的上下文字符串，来源编号与 results 的顺序一致（【来源1】对应 results[0]）
+    """
+    count_tokens = count_tokens or estimate_tokens
+    keywords_lower = list(dict.fromkeys(kw.lower() for kw in keywords if kw))
+
+    candidates: List[_Candidate] = []
+    seen_sentences: Set[str] = set()
+    kept_chunks: List[Set[str]] = []
+    for rank, result in enumerate(results):
+        content = result["content"]
+        norm = normalized[rank] if normalized is not None else None
+        if norm is None or len(norm.text) != len(content):
+            # 小写后长度变化的文本（极少数字符）分句位置与原文不对应，按原文重新计算
+            norm = normalize_text(content)
+
+        # 有句子包含关键词时（包括已经在前面的来源中出现过的重复句子）只保留这些句子
+        hits = sentence_hits(norm, keywords_lower)
+        positions = sorted(hits) if hits else range(norm.sentence_count)
+        sentences = [(position, _sentence_at(content, norm.sentence_ends, position)) for position in positions]
+        keys = [sentence_key(sentence) for _, sentence in sentences]
+
+        # 几乎相同的文本块（如同一教材的重复导入）整块跳过
+        grams = set().union(*(_bigrams(key) for key in keys))
+        if grams and any(len(grams & kept) >= NEAR_DUPLICATE_RATIO * len(grams | kept) for kept in kept_chunks):
+            continue
+        kept_chunks.append(grams)
+
+        weight = 1.0 / (rank + 1)
+        for (position, sentence), key in zip(sentences, keys):
+            if not key or key in seen_sentences:
+                continue
+            seen_sentences.add(key)
+            candidates.append(_Candidate(rank, position, sentence, count_tokens(sentence),
+                                         hits.get(position, 0) + weight))
+
+    # 按价值从高到低装入预算；同价值时排名靠前、位置靠前的优先
+    # 来源标记、来源分隔符和省略号也计入预算（省略号按最坏情况预留）
+    budget = max_tokens
+    gap_tokens = count_tokens(GAP_MARKER)
+    separator_tokens = count_tokens(SOURCE_SEPARATOR)
+    opened: Set[int] = set()
+    selected: List[_Candidate] = []
+    for candidate in sorted(candidates, key=lambda c: (-c.value, c.source, c.position)):
+        if candidate.source in opened:
+            cost = candidate.tokens + gap_tokens
+        else:
+            cost = candidate.tokens + count_tokens(f"【来源{candidate.source + 1}】")
+            if opened:
+                cost += separator_tokens
+        if cost > budget:
+            continue
+        budget -= cost
+        opened.add(candidate.source)
+        selected.append(candidate)
+
+    if not selected and candidates:
+        # 没有任何完整的句子放得下（如不含分隔符的超长文本块）时，截断价值最高的句子
+        best = min(candidates, key=lambda c: (-c.value, c.source, c.position))
+        header = f"【来源{best.source + 1}】"
+        text = _truncate(best.text, max_tokens - count_tokens(header), count_tokens)
+        return header + text if text else ""
+
+    # 每个来源内按原文顺序输出
+    by_source: Dict[int, List[Tuple[int, str]]] = {}
+    for candidate in selected:
+        by_source.setdefault(candidate.source, []).append((candidate.position, candidate.text))
+
+    parts = []
+    for source in sorted(by_source):
+        sentences = sorted(by_source[source])
+        text = sentences[0][1]
+        for (prev_position, _), (position, sentence) in zip(sentences, sentences[1:]):
+            text += ("" if position == prev_position + 1 else GAP_MARKER) + sentence
+        parts.append(f"【来源{source + 1}】{text.rstrip()}")
+    return SOURCE_SEPARATOR.join(parts)
@@ -0,0 +1,286 @@
+"""
+语料快照
+把文本块、预处理文本、倒排索引、化学式索引、分面位图和来源文件表打包为一个不可变快照。
+检索时先取得当前快照的引用再使用，重新加载时构建新快照后整体替换，
+正在进行的查询始终看到一份完整的语料。
+"""
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
+
+from services.bm25 import CorpusStats
+from services.chem_formula import entity_terms, extract_chemical_entities
+from services.chunk_store import ChunkStore
+from services.chunk_text import NormalizedText
+from services.facets import FacetIndex, FilterKey, bitmap_ids, select_bitmap
+from services.sparse_scoring import SparseScorer
+
+# 每个快照缓存的过滤结果数量上限
+MAX_CACHED_SELECTIONS = 256
+
+# 倒排索引的词项长度：按字符二元组（bigram）建立索引。
+# 关键词至少两个字符，包含关键词的文本块必然包含它的每个二元组，
+# 因此用二元组倒排表求交集得到的候选集合不会漏掉任何匹配的文本块。
+INDEX_GRAM_SIZE = 2
+
+
+def iter_terms(text: str):
+    """枚举文本中的所有索引词项（字符二元组，可重叠）"""
+    for i in range(len(text) - INDEX_GRAM_SIZE + 1):
+        yield text[i:i + INDEX_GRAM_SIZE]
+
+
+def add_postings(postings: Dict[str, Dict[int, int]], chunk_idx: int, norm: NormalizedText) -> None:
+    """把一个文本块的词项计数加入倒排索引"""
+    for term in iter_terms(norm.text):
+        posting = postings.get(term)
+        if posting is None:
+            posting = postings[term] = {}
+        posting[chunk_idx] = posting.get(chunk_idx, 0) + 1
+
+
+def build_postings(normalized: Sequence[NormalizedText]) -> Dict[str, Dict[int, int]]:
+    """为所有文本块建立倒排索引（词项 -> {chunk下标: 出现次数}）"""
+    postings: Dict[str, Dict[int, int]] = {}
+    for chunk_idx, norm in enumerate(normalized):
+        add_postings(postings, chunk_idx, norm)
+    return postings
+
+
+def build_formula_index(chunks: Sequence[Dict]) -> Dict[str, Dict[int, int]]:
+    """
+    由文本块的化学实体建立化学式索引（化学式 -> {chunk下标: 1}）
+
+    优先使用预处理脚本写入的 entities 字段；没有该字段的文本块（如扁平列表格式）
+    在这里用同一个化学式切分规则提取。索引与倒排表结构相同，可以用同样的方法合并和修补。
+    """
+    formulas: Dict[str, Dict[int, int]] = {}
+    for chunk_idx, chunk in enumerate(chunks):
+        entities = chunk.get("entities")
+        if not isinstance(entities, dict):
+            entities = extract_chemical_entities(chunk["content"])
+        for formula in entity_terms(entities):
+            formulas.setdefault(formula, {})[chunk_idx] = 1
+    return formulas
+
+
+def merge_postings(postings: Dict[str, Dict[int, int]], file_postings: Dict[str, Dict[int, int]],
+                   offset: int) -> None:
+    """
+    把单个文件的倒排索引（文本块下标从 0 开始）合并到 postings 中
+
+    Args:
+        offset: 该文件第一个文本块在语料中的下标
+    """
+    for term, file_posting in file_postings.items():
+        posting = postings.get(term)
+        if posting is None:
+            postings[term] = {chunk_idx + offset: count for chunk_idx, count in file_posting.items()}
+        else:
+            for chunk_idx, count in file_posting.items():
+                posting[chunk_idx + offset] = count
+
+
+def patch_postings(old_items: Iterable[Tuple[str, Dict[int, int]]], old_to_new: Sequence[int],
+                   added: Iterable[Tuple[int, Dict[str, Dict[int, int]]]]) -> Dict[str, Dict[int, int]]:
+    """
+    在旧倒排索引的基础上生成新索引（旧索引保持不变）
+
+    Args:
+        old_items: 旧索引的 (词项, 倒排表)
+        old_to_new: 旧文本块下标 -> 新下标，-1 表示该文本块已删除（所在文件变化或被移除）
+        added: 需要合并进来的 (起始下标, 单个文件的倒排索引)，即变化或新增的文件
+    """
+    postings: Dict[str, Dict[int, int]] = {}
+    for term, posting in old_items:
+        remapped = {}
+        for chunk_idx, count in posting.items():
+            new_idx = old_to_new[chunk_idx]
+            if new_idx >= 0:
+                remapped[new_idx] = count
+        if remapped:
+            postings[term] = remapped
+
+    for offset, file_postings in added:
+        merge_postings(postings, file_postings, offset)
+    return postings
+
+
+class SourceFile:
+    """语料中的一个来源文件及其文本块范围"""
+
+    __slots__ = ("path", "digest", "start", "count")
+
+    def __init__(self, path: str, digest: bytes, start: int, count: int):
+        # 相对数据目录的路径（POSIX 格式）
+        self.path = path
+        # 文件内容的 SHA-256
+        self.digest = digest
+        # 文本块在快照中的起始下标和数量
+        self.start = start
+        self.count = count
+
+    def to_dict(self) -> Dict:
+        return {"path": self.path, "digest": self.digest.hex(), "start": self.start, "count": self.count}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SourceFile":
+        return cls(data["path"], bytes.fromhex(data["digest"]), data["start"], data["count"])
+
+
+class CorpusSnapshot:
+    """一份不可变的语料快照"""
+
+    def __init__(self, chunks: Sequence[Dict], normalized: Sequence[NormalizedText],
+                 postings: Mapping[str, Dict[int, int]], files: List[SourceFile], mapped=None,
+                 stats: Optional[CorpusStats] = None,
+                 formulas: Optional[Mapping[str, Dict[int, int]]] = None,
+                 facets: Optional[FacetIndex] = None):
+        """
+        Args:
+            chunks: 文本块（ChunkStore，或来自持久化索引的 MappedChunks）
+            normalized: 与 chunks 一一对应的预处理文本（小写正文 + 分句边界）
+            postings: 倒排索引: 词项 -> {chunk下标: 词项出现次数}
+            files: 来源文件表（按加载顺序）
+            mapped: 快照来自持久化索引时为对应的 MappedIndex
+            stats: BM25 语料统计，未提供时由 normalized 计算
+            formulas: 化学式索引: 化学式 -> {chunk下标: 1}
+            facets: 分面位图: 分面 -> 取值 -> 文本块位图（见 services.facets）
+        """
+        self.chunks = chunks
+        self.normalized = normalized
+        self.postings = postings
+        self.files = files
+        self.mapped = mapped
+        self.stats = stats if stats is not None else CorpusStats.from_normalized(normalized)
+        self.formulas = formulas if formulas is not None else {}
+        # 小写化学式 -> 包含它的文本块（首次查询时由 formulas 生成）
+        self._formula_lookup: Optional[Dict[str, FrozenSet[int]]] = None
+        self.facets = facets if facets is not None else {}
+        # 规范化的过滤条件 -> 满足条件的文本块
+        self._selections: Dict[FilterKey, FrozenSet[int]] = {}
+        # 在其他分片中出现的化学式（小写），由 TextbookRAG 设置；在本快照中不出现时同样按化学式处理
+        self.external_formulas: FrozenSet[str] = frozenset()
+        # 源文件校验和（由 TextbookRAG 在加载后设置），用于判断向量索引是否与语料一致
+        self.checksum = b""
+        # 向量索引（首次使用向量检索时加载）
+        self.dense_index = None
+        # 快照编号，替换快照时由 TextbookRAG 递增，用于区分缓存
+        self.generation = 0
+        self._sparse_scorer = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def empty(cls) -> "CorpusSnapshot":
+        return cls(ChunkStore(), [], {}, [])
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def file_entries(self) -> List[Tuple[str, bytes]]:
+        """来源文件的 (相对路径, 摘要) 列表，用于判断语料是否变化"""
+        return [(f.path, f.digest) for f in self.files]
+
+    def formula_chunks(self, keyword: str) -> Optional[FrozenSet[int]]:
+        """
+        关键词是已知化学式时，返回以化学式形式包含它的文本块，否则返回 None
+
+        按小写比较（评分本身不区分大小写）。化学式关键词只在这些文本块中计分，
+        "Al" 不会再匹配英文单词 "also"，"H2O" 也不会匹配 "H2O2" 的一部分。
+        """
+        lookup = self._formula_lookup
+        if lookup is None:
+            grouped: Dict[str, Set[int]] = {}
+            for formula, posting in self.formulas.items():
+                grouped.setdefault(formula.lower(), set()).update(posting)
+            lookup = self._formula_lookup = {formula: frozenset(ids) for formula, ids in grouped.items()}
+        keyword_lower = keyword.lower()
+        chunks = lookup.get(keyword_lower)
+        if chunks is None and keyword_lower in self.external_formulas:
+            return frozenset()
+        return chunks
+
+    def formula_vocabulary(self) -> FrozenSet[str]:
+        """本快照中出现的全部化学式（小写）"""
+        return frozenset(formula.lower() for formula in self.formulas)
+
+    def select_chunks(self, filter_key: Optional[FilterKey]) -> Optional[FrozenSet[int]]:
+        """
+        按元数据过滤条件组合分面位图，返回满足条件的文本块（结果在快照内缓存）
+
+        Args:
+            filter_key: services.facets.normalize_filters 规范化后的过滤条件
+
+        Returns:
+            满足条件的文本块下标；没有过滤条件时返回 None（不限制）
+        """
+        if filter_key is None:
+            return None
+        selected = self._selections.get(filter_key)
+        if selected is None:
+            selected = frozenset(bitmap_ids(select_bitmap(self.facets, filter_key, len(self))))
+            with self._lock:
+                if len(self._selections) >= MAX_CACHED_SELECTIONS:
+                    self._selections.clear()
+                self._selections[filter_key] = selected
+        return selected
+
+    def candidate_chunks(self, keywords: List[str], allowed: Optional[FrozenSet[int]] = None) -> List[int]:
+        """
+        通过倒排索引找出至少包含一个关键词的文本块
+
+        化学式关键词直接查化学式索引；其他关键词取其所有二元组倒排表的交集
+        （从最短的倒排表开始），再对所有关键词的结果取并集。
+        提供 allowed（元数据过滤结果）时，每个关键词的倒排表先与它取交集。
+
+        Returns:
+            候选文本块下标列表，按下标升序（与全量遍历的顺序一致）
+        """
+        candidates: Set[int] = set()
+        if allowed is not None and not allowed:
+            return []
+
+        for keyword in keywords:
+            formula_chunks = self.formula_chunks(keyword)
+            if formula_chunks is not None:
+                candidates |= formula_chunks if allowed is None else formula_chunks & allowed
+                continue
+
+            terms = set(iter_terms(keyword.lower()))
+            if not terms:
+                continue
+
+            posting_lists = []
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    posting_lists = []
+                    break
+                posting_lists.append(posting)
+
+            if not posting_lists:
+                continue
+
+            posting_lists.sort(key=len)
+            # 过滤结果比最短的倒排表还小时，从过滤结果开始求交集
+            if allowed is not None and len(allowed) < len(posting_lists[0]):
+                matched = set(allowed)
+            else:
+                matched = set(posting_lists.pop(0))
+                if allowed is not None:
+                    matched &= allowed
+            for posting in posting_lists:
+                matched.intersection_update(posting)
+                if not matched:
+                    break
+
+            candidates |= matched
+
+        return sorted(candidates)
+
+    def sparse_scorer(self) -> SparseScorer:
+        """返回本快照的稀疏评分后端（首次调用时创建）"""
+        if self._sparse_scorer is None:
+            with self._lock:
+                if self._sparse_scorer is None:
+                    self._sparse_scorer = SparseScorer(self.normalized, self.candidate_chunks)
+        return self._sparse_scorer
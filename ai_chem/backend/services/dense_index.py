@@ -0,0 +1,306 @@
+"""
+向量检索
+离线把文本块切成段落，用本地 CPU 嵌入模型分批计算向量，存入 HNSW 近似最近邻索引，
+索引文件保存在教材数据目录下。检索时只计算问题本身的向量，文本块向量不会在请求中计算。
+
+教材文本块很长（最长十几万字），远超嵌入模型的输入长度，因此按句子边界切成
+约 PASSAGE_CHARS 字的段落分别嵌入；文本块的向量得分取其段落得分的最大值。
+
+依赖（均为可选）：
+    sentence-transformers  计算嵌入（默认模型 BAAI/bge-small-zh-v1.5）
+    hnswlib                近似最近邻索引；未安装时用 NumPy 精确计算内积
+"""
+import json
+import os
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+from services.chunk_store import record_at
+from services.chunk_text import SENTENCE_SPLIT_PATTERN
+
+DENSE_AVAILABLE = np is not None and SentenceTransformer is not None
+HNSW_AVAILABLE = np is not None and hnswlib is not None
+
+# 向量索引文件名（位于教材数据目录下）
+DENSE_META_FILE = ".rag_dense.json"
+DENSE_VECTORS_FILE = ".rag_dense.npy"
+DENSE_CHUNKS_FILE = ".rag_dense.chunks.npy"
+DENSE_HNSW_FILE = ".rag_dense.hnsw"
+
+# 默认嵌入模型（中文，512 维以内，CPU 上单条问题编码约数毫秒）
+DEFAULT_EMBEDDING_MODEL = "BAAI/bge-small-zh-v1.5"
+# BGE 模型建议给检索问题加的前缀
+QUERY_INSTRUCTION = "为这个句子生成表示以用于检索相关文章："
+
+# 段落长度（字符数）和构建索引时每批嵌入的段落数
+PASSAGE_CHARS = 300
+EMBED_BATCH_SIZE = 64
+
+# HNSW 参数：每个节点的连接数、构建和查询时的候选列表长度
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+
+class DenseIndexUnavailable(RuntimeError):
+    """向量索引不可用（依赖未安装、索引未构建或与当前语料不一致）"""
+
+
+def split_passages(text: str, max_chars: int = PASSAGE_CHARS) -> List[Tuple[int, int]]:
+    """
+    按句子边界把文本块切成段落
+
+    相邻句子合并到不超过 max_chars 为止；单个句子超长时按 max_chars 硬切。
+
+    Returns:
+        段落在正文中的 (起始, 结束) 位置
+    """
+    # 每个句子的结束位置（包含分隔符）
+    bounds = [match.end() for match in SENTENCE_SPLIT_PATTERN.finditer(text)] + [len(text)]
+    passages = []
+    start = 0
+    end = 0
+    for sentence_end in bounds:
+        if sentence_end - start > max_chars and end > start:
+            passages.append((start, end))
+            start = end
+        while sentence_end - start > max_chars:
+            passages.append((start, start + max_chars))
+            start += max_chars
+        end = sentence_end
+
+    if end > start:
+        passages.append((start, end))
+    return [(s, e) for s, e in passages if text[s:e].strip()]
+
+
+class Embedder:
+    """本地 CPU 嵌入模型（sentence-transformers）"""
+
+    def __init__(self, model_name: Optional[str] = None, device: str = "cpu"):
+        if not DENSE_AVAILABLE:
+            raise DenseIndexUnavailable("未安装 sentence-transformers/numpy，无法计算向量")
+        self.model_name = model_name or os.getenv("RAG_EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+        self._model = SentenceTransformer(self.model_name, device=device)
+
+    @property
+    def dimension(self) -> int:
+        return self._model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: Sequence[str], batch_size: int = EMBED_BATCH_SIZE) -> "np.ndarray":
+        """分批计算文本向量（已归一化，内积即余弦相似度）"""
+        vectors = self._model.encode(list(texts), batch_size=batch_size, normalize_embeddings=True,
+                                     convert_to_numpy=True, show_progress_bar=False)
+        return vectors.astype(np.float32, copy=False)
+
+    def encode_query(self, question: str) -> "np.ndarray":
+        """计算检索问题的向量"""
+        return self.encode([QUERY_INSTRUCTION + question], batch_size=1)[0]
+
+
+class DenseIndex:
+    """段落向量索引"""
+
+    def __init__(self, vectors: "np.ndarray", passage_chunks: array, checksum: str, model_name: str,
+                 ann=None):
+        """
+        Args:
+            vectors: 段落向量矩阵（段落数 × 维度，已归一化）
+            passage_chunks: 每个段落所属的文本块下标
+            checksum: 构建时语料的校验和（十六进制），与当前语料不一致时索引失效
+            model_name: 嵌入模型名称，检索时需要用同一个模型编码问题
+            ann: hnswlib 索引；为 None 时用 NumPy 精确计算
+        """
+        self.vectors = vectors
+        self.passage_chunks = passage_chunks
+        self.checksum = checksum
+        self.model_name = model_name
+        self.ann = ann
+        # hnswlib 的 ef 是索引对象上的共享状态，设置 ef 和查询必须一起完成，
+        # 否则并发检索时一个请求设置的 ef 会被另一个请求使用
+        self._ann_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.passage_chunks)
+
+    @classmethod
+    def build(cls, chunks: Sequence, embedder, checksum: str,
+              batch_size: int = EMBED_BATCH_SIZE) -> "DenseIndex":
+        """
+        为所有文本块的段落计算向量并建立索引（离线执行）
+
+        Args:
+            chunks: 文本块（ChunkStore、MappedChunks 或 dict 列表）
+            embedder: 提供 encode(texts, batch_size) 和 model_name 的嵌入模型
+            checksum: 当前语料的校验和（十六进制）
+        """
+        if np is None:
+            raise DenseIndexUnavailable("未安装 numpy")
+
+        texts: List[str] = []
+        passage_chunks = array("I")
+        for chunk_idx in range(len(chunks)):
+            content = record_at(chunks, chunk_idx)[0]
+            for start, end in split_passages(content):
+                texts.append(content[start:end])
+                passage_chunks.append(chunk_idx)
+
+        vectors = [embedder.encode(texts[i:i + batch_size], batch_size=batch_size)
+                   for i in range(0, len(texts), batch_size)]
+        matrix = np.vstack(vectors).astype(np.float32) if vectors else np.zeros((0, 1), np.float32)
+        return cls(matrix, passage_chunks, checksum, embedder.model_name, cls._build_ann(matrix))
+
+    @staticmethod
+    def _build_ann(vectors: "np.ndarray"):
+        if not HNSW_AVAILABLE or not len(vectors):
+            return None
+        ann = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        ann.init_index(max_elements=len(vectors), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+        ann.add_items(vectors, np.arange(len(vectors)))
+        ann.set_ef(HNSW_EF_SEARCH)
+        return ann
+
+    def save(self, data_dir: Path) -> None:
+        """保存到教材数据目录（先写临时文件再替换，元数据文件最后写入）"""
+        data_dir = Path(data_dir)
+        meta_path = data_dir / DENSE_META_FILE
+        if meta_path.exists():
+            # 先删除元数据，写入过程中中断时不会留下与向量不匹配的索引
+            meta_path.unlink()
+
+        _replace_atomic(data_dir / DENSE_VECTORS_FILE, lambda path: np.save(path, self.vectors))
+        _replace_atomic(data_dir / DENSE_CHUNKS_FILE,
+                        lambda path: np.save(path, np.frombuffer(self.passage_chunks, dtype=np.uint32)))
+        hnsw_path = data_dir / DENSE_HNSW_FILE
+        if self.ann is not None:
+            _replace_atomic(hnsw_path, lambda path: self.ann.save_index(str(path)))
+        elif hnsw_path.exists():
+            hnsw_path.unlink()
+
+        meta = {
+            "checksum": self.checksum,
+            "model": self.model_name,
+            "dimension": int(self.vectors.shape[1]),
+            "passages": len(self.passage_chunks),
+        }
+        _replace_atomic(meta_path, lambda path: path.write_text(json.dumps(meta), encoding="utf-8"))
+
+    @classmethod
+    def load(cls, data_dir: Path, checksum: str) -> "DenseIndex":
+        """读取向量索引；不存在或与当前语料不一致时抛出 DenseIndexUnavailable"""
+        if np is None:
+            raise DenseIndexUnavailable("未安装 numpy")
+
+        data_dir = Path(data_dir)
+        meta_path = data_dir / DENSE_META_FILE
+        if not meta_path.exists():
+            raise DenseIndexUnavailable("向量索引尚未构建，请运行 scripts/build_dense_index.py")
+
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if meta["checksum"] != checksum:
+            raise DenseIndexUnavailable("教材数据已变化，请重新运行 scripts/build_dense_index.py")
+
+        vectors = np.load(data_dir / DENSE_VECTORS_FILE, mmap_mode="r")
+        passage_chunks = array("I")
+        passage_chunks.frombytes(np.load(data_dir / DENSE_CHUNKS_FILE).astype(np.uint32).tobytes())
+        if len(passage_chunks) != meta["passages"] or len(vectors) != meta["passages"]:
+            raise DenseIndexUnavailable("向量索引文件不完整，请重新运行 scripts/build_dense_index.py")
+
+        ann = None
+        hnsw_path = data_dir / DENSE_HNSW_FILE
+        if HNSW_AVAILABLE and hnsw_path.exists():
+            ann = hnswlib.Index(space="ip", dim=meta["dimension"])
+            ann.load_index(str(hnsw_path), max_elements=len(passage_chunks))
+            ann.set_ef(HNSW_EF_SEARCH)
+
+        return cls(vectors, passage_chunks, meta["checksum"], meta["model"], ann)
+
+    def search(self, query: "np.ndarray", top_k: int, min_score: float,
+               allowed: Optional[FrozenSet[int]] = None) -> List[Tuple[int, float]]:
+        """
+        检索与问题向量最相似的文本块
+
+        Args:
+            allowed: 元数据过滤后允许的文本块，None 表示不限制；
+                     有过滤时只对这些文本块的段落精确计算相似度，不经过 ANN 索引
+
+        Returns:
+            (文本块下标, 余弦相似度) 列表，按相似度降序，同分时下标小的优先
+        """
+        if not len(self) or top_k <= 0:
+            return []
+
+        if allowed is not None:
+            chunk_ids = np.fromiter(allowed, dtype=np.uint32, count=len(allowed))
+            passages = np.flatnonzero(np.isin(np.frombuffer(self.passage_chunks, dtype=np.uint32), chunk_ids))
+            return self._rank_chunks(passages.tolist(), (self.vectors[passages] @ query).tolist(),
+                                     top_k, min_score)
+
+        # 多取一些段落，同一文本块的多个段落只保留得分最高的一个；
+        # 一个长文本块的段落可能占满候选，凑不够 top_k 个文本块时加倍重取，直到取完所有段落
+        n_passages = min(len(self), max(top_k * 8, HNSW_EF_SEARCH))
+        while True:
+            passages, scores = self._nearest_passages(query, n_passages)
+            ranked = self._rank_chunks(passages, scores, top_k, min_score)
+            # 最低的候选分数已低于 min_score 时，再多取的段落也不会入选
+            if len(ranked) >= top_k or n_passages >= len(self) or min(scores) < min_score:
+                return ranked
+            n_passages = min(len(self), n_passages * 2)
+
+    def _nearest_passages(self, query: "np.ndarray", n_passages: int) -> Tuple[List[int], List[float]]:
+        """与问题向量最相似的 n_passages 个段落及其余弦相似度（不保证顺序）"""
+        if self.ann is not None:
+            # hnswlib 要求查询时的候选列表长度不小于 k
+            with self._ann_lock:
+                self.ann.set_ef(max(HNSW_EF_SEARCH, n_passages))
+                labels, distances = self.ann.knn_query(query, k=n_passages)
+            # 内积空间中 hnswlib 返回的距离为 1 - 内积
+            return labels[0].tolist(), (1.0 - distances[0]).tolist()
+
+        similarities = self.vectors @ query
+        if n_passages < len(self):
+            top = np.argpartition(-similarities, n_passages - 1)[:n_passages]
+        else:
+            top = np.arange(len(self))
+        return top.tolist(), similarities[top].tolist()
+
+    def _rank_chunks(self, passages: List[int], scores: List[float],
+                     top_k: int, min_score: float) -> List[Tuple[int, float]]:
+        """按文本块取段落的最高分，过滤 min_score 后按相似度降序取前 top_k 个"""
+        best: Dict[int, float] = {}
+        for passage, score in zip(passages, scores):
+            chunk_idx = self.passage_chunks[passage]
+            if score > best.get(chunk_idx, float("-inf")):
+                best[chunk_idx] = score
+
+        ranked = sorted(((chunk_idx, score) for chunk_idx, score in best.items() if score >= min_score),
+                        key=lambda item: (-item[1], item[0]))
+        return ranked[:top_k]
+
+
+def _replace_atomic(path: Path, write) -> None:
+    """调用 write(临时路径) 写入临时文件，再原子替换目标文件"""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp{path.suffix}")
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
@@ -0,0 +1,157 @@
+"""
+元数据分面过滤
+加载语料时为每个分面的每个取值预先计算文本块位图（Python 整数，第 i 位表示第 i 个文本块），
+检索时按过滤条件组合位图，得到允许的文本块集合，再与倒排索引给出的候选文本块取交集后评分。
+
+分面：
+- volume: 教材所在的子目录（如 one、two_e），数据目录下的顶层文件为 ""
+- source: 来源文件名
+- topic / unit / section: 文本块元数据中的同名字段
+
+同一分面的多个取值之间为“或”，不同分面之间为“且”；取值按字符串精确匹配。
+合并了近似重复文本块的文本块（元数据中的 duplicates，见 services.near_dup）
+同时属于被合并文本块的教材子目录、来源文件和元数据取值。
+"""
+from pathlib import PurePosixPath
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+from services.chunk_store import record_at
+from services.near_dup import DUPLICATES_FIELD
+
+# 支持过滤的分面
+FACET_FIELDS = ("volume", "source", "topic", "unit", "section")
+
+# 取自文本块元数据的分面
+METADATA_FACETS = ("topic", "unit", "section")
+
+# 调用方传入的过滤条件: 分面 -> 取值或取值列表
+Filters = Mapping[str, Union[str, Sequence[str]]]
+
+# 规范化后的过滤条件（可哈希，用作缓存键）: ((分面, (取值, ...)), ...)
+FilterKey = Tuple[Tuple[str, Tuple[str, ...]], ...]
+
+# 分面索引: 分面 -> 取值 -> 文本块位图
+FacetIndex = Dict[str, Dict[str, int]]
+
+
+def volume_of(rel_path: str) -> str:
+    """来源文件（相对数据目录的路径）所属的教材子目录"""
+    parent = PurePosixPath(rel_path).parent.as_posix()
+    return "" if parent == "." else parent
+
+
+def ids_bitmap(ids: Iterable[int], n_chunks: int) -> int:
+    """由文本块下标构造位图"""
+    bits = bytearray((n_chunks + 7) // 8)
+    for chunk_idx in ids:
+        bits[chunk_idx >> 3] |= 1 << (chunk_idx & 7)
+    return int.from_bytes(bits, "little")
+
+
+def _add_members(members: Dict[str, Dict[str, List[int]]], chunk_idx: int, source: str,
+                 metadata: Mapping) -> None:
+    """按来源文件名和元数据字段登记一个文本块"""
+    members["source"].setdefault(source, []).append(chunk_idx)
+    for field in METADATA_FACETS:
+        value = metadata.get(field)
+        if value is not None and value != "":
+            members[field].setdefault(str(value), []).append(chunk_idx)
+
+
+def build_facet_index(chunks: Sequence, files: Sequence) -> FacetIndex:
+    """
+    为语料构建分面位图
+
+    Args:
+        chunks: 文本块（ChunkStore、MappedChunks 或 dict 列表）
+        files: 来源文件表（SourceFile，按加载顺序，覆盖全部文本块）
+    """
+    # 先按取值收集文本块下标，最后每个取值只构造一次位图
+    members: Dict[str, Dict[str, List[int]]] = {field: {} for field in FACET_FIELDS}
+    for source_file in files:
+        file_ids = range(source_file.start, source_file.start + source_file.count)
+        members["volume"].setdefault(volume_of(source_file.path), []).extend(file_ids)
+
+        for chunk_idx in file_ids:
+            _, metadata, source = record_at(chunks, chunk_idx)
+            _add_members(members, chunk_idx, source, metadata)
+            for duplicate in metadata.get(DUPLICATES_FIELD, ()):
+                # 加载时合并的文本块记录了来源文件路径；预处理时合并的只有章节等信息，不计入分面
+                if "path" in duplicate:
+                    members["volume"].setdefault(volume_of(duplicate["path"]), []).append(chunk_idx)
+                    _add_members(members, chunk_idx, duplicate["source"], duplicate.get("metadata", {}))
+
+    n_chunks = len(chunks)
+    return {field: {value: ids_bitmap(ids, n_chunks) for value, ids in values.items()}
+            for field, values in members.items()}
+
+
+def normalize_filters(filters: Optional[Filters]) -> Optional[FilterKey]:
+    """
+    规范化过滤条件：取值去重排序，忽略没有取值的分面
+
+    Returns:
+        可哈希的过滤条件；没有任何过滤条件时返回 None
+
+    Raises:
+        ValueError: 分面名称不受支持
+    """
+    if not filters:
+        return None
+
+    key = []
+    for field, values in filters.items():
+        if field not in FACET_FIELDS:
+            raise ValueError(f"不支持的过滤字段: {field}，可选: {', '.join(FACET_FIELDS)}")
+        if values is None:
+            continue
+        if isinstance(values, str):
+            values = [values]
+        values = tuple(sorted(set(map(str, values))))
+        if values:
+            key.append((field, values))
+    return tuple(sorted(key)) or None
+
+
+def select_bitmap(facets: FacetIndex, filter_key: FilterKey, n_chunks: int) -> int:
+    """按规范化的过滤条件组合位图：分面内取并集，分面间取交集"""
+    selected = (1 << n_chunks) - 1
+    for field, values in filter_key:
+        field_bitmaps = facets.get(field, {})
+        union = 0
+        for value in values:
+            union |= field_bitmaps.get(value, 0)
+        selected &= union
+        if not selected:
+            break
+    return selected
+
+
+def bitmap_ids(bitmap: int) -> List[int]:
+    """位图中置位的文本块下标（升序）"""
+    bits = bin(bitmap)[:1:-1]
+    ids = []
+    pos = bits.find("1")
+    while pos != -1:
+        ids.append(pos)
+        pos = bits.find("1", pos + 1)
+    return ids
+
+
+def encode_facets(facets: FacetIndex) -> Dict[str, Dict[str, str]]:
+    """位图转为十六进制字符串（写入持久化索引）"""
+    return {field: {value: format(bitmap, "x") for value, bitmap in sorted(values.items())}
+            for field, values in facets.items()}
+
+
+def decode_facets(data: Mapping[str, Mapping[str, str]]) -> FacetIndex:
+    """encode_facets 的逆操作"""
+    return {field: {value: int(bitmap, 16) for value, bitmap in values.items()}
+            for field, values in data.items()}
+
+
+def facet_values(facets: FacetIndex) -> Dict[str, Dict[str, int]]:
+    """各分面的取值及其文本块数量（供接口列出可用的过滤条件）"""
+    return {field: {value: bin(bitmap).count("1") for value, bitmap in sorted(values.items())}
+            for field, values in facets.items()}
+
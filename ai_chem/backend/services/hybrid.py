@@ -0,0 +1,97 @@
+"""
+混合检索
+多个子检索器（关键词计数、BM25、向量）在共享线程池中并行执行，
+用倒数排名融合（Reciprocal Rank Fusion）合并各自的排序结果。
+整个融合有统一的截止时间，超时的子检索器直接放弃，不阻塞响应。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 参与融合的子检索器（排序方式名称，见 rag_service.RANKING_MODES）
+HYBRID_RETRIEVERS = ("keyword", "bm25", "dense")
+
+# RRF 常数：排名第 r 的结果得分 1 / (RRF_K + r)
+RRF_K = 60
+
+# 每个子检索器取前多少个结果参与融合（至少为 top_k 的这个倍数）
+HYBRID_DEPTH_FACTOR = 4
+HYBRID_MIN_DEPTH = 20
+
+# (文本块下标, 分数) 的排序列表
+Ranking = List[Tuple[int, float]]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Ranking], top_k: int, k: int = RRF_K) -> Ranking:
+    """
+    倒数排名融合
+
+    Args:
+        rankings: 各子检索器的排序结果（按分数降序）
+        top_k: 返回数量
+        k: RRF 常数
+
+    Returns:
+        (文本块下标, 融合分数) 列表，按融合分数降序，同分时下标小的优先
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (chunk_idx, _) in enumerate(ranking, 1):
+            fused[chunk_idx] = fused.get(chunk_idx, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+
+
+def run_with_deadline(tasks: Dict[str, Callable[[], object]], timeout: float,
+                      executor: Optional[ThreadPoolExecutor] = None) -> Tuple[Dict[str, object], List[str]]:
+    """
+    在共享线程池中并行执行多个任务，最多等待 timeout 秒
+
+    Returns:
+        (已完成任务的结果, 超时放弃的任务名称)。任务抛出的异常会原样抛出。
+    """
+    executor = executor or get_executor()
+    futures = {executor.submit(task): name for name, task in tasks.items()}
+    done, pending = wait(futures, timeout=timeout)
+
+    for future in pending:
+        # 尚未开始的直接取消；已经在执行的只能让它跑完，结果丢弃
+        future.cancel()
+
+    results = {}
+    for future in done:
+        results[futures[future]] = future.result()
+    return results, sorted(futures[future] for future in pending)
+
+
+# 子检索器共用的线程池（与 retrieval_pool 的请求线程池分开，避免嵌套提交时互相等待）
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    获取子检索器线程池，首次调用时创建
+
+    线程数从环境变量 RAG_HYBRID_WORKERS 读取，默认为 4。
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = int(os.getenv("RAG_HYBRID_WORKERS", "4"))
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-hybrid")
+        return _executor
+
+
+def shutdown_executor() -> None:
+    """关闭子检索器线程池"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def default_deadline() -> float:
+    """混合检索的截止时间（秒）：环境变量 RAG_HYBRID_DEADLINE_MS，默认 300 毫秒"""
+    return float(os.getenv("RAG_HYBRID_DEADLINE_MS", "300")) / 1000.0
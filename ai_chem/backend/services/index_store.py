@@ -0,0 +1,474 @@
+"""
+教材检索索引的持久化存储
+将文本块、元数据和倒排表写入紧凑的二进制文件，启动时通过 mmap 直接映射，
+多个 uvicorn worker 共享同一份页缓存，无需各自重新解析 JSON 和建索引。
+
+文件布局（小端序）：
+    [文件头] magic | 版本 | 二元组长度 | 文本块数 | 词项数 | 源文件校验和 | 各区偏移 | 来源文件表
+    [文本块表] 每块: 正文偏移 u64 | 正文长度 u32 | 元数据偏移 u64 | 元数据长度 u32
+              | 小写正文偏移 u64 | 小写正文长度 u32 | 句子边界偏移 u64 | 句子数 u32
+    [字符串区] UTF-8 正文 + JSON 元数据（{"metadata": ..., "source": ...}）
+              + 小写正文 + 句子结束位置数组（u32）
+    [词项表] 每项: 词项(UTF-32-BE 定长) | 倒排偏移 u64 | 倒排长度 u32，按词项升序
+    [倒排区] 每条: chunk下标 u32 | 出现次数 u32
+    [文档长度] 每块: 小写正文字符数 u32（BM25 的长度归一化）
+    [来源文件表] JSON: [{"path", "digest", "start", "count"}, ...]
+    [化学式索引] JSON: {化学式: [chunk下标, ...]}
+    [分面位图] JSON: {分面: {取值: 十六进制位图}}
+"""
+import contextlib
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，不做跨进程互斥（最坏情况是多个进程各自构建一次索引）
+    fcntl = None
+
+from services.bm25 import CorpusStats
+from services.chunk_store import record_at
+from services.chunk_text import NormalizedText
+from services.corpus import SourceFile
+from services.facets import FacetIndex, decode_facets, encode_facets
+
+MAGIC = b"RAGIDX01"
+FORMAT_VERSION = 8
+
+# magic(8s) version(I) gram_size(I) n_chunks(I) n_terms(I) checksum(32s)
+# chunk_table_off(Q) strings_off(Q) terms_off(Q) postings_off(Q) lengths_off(Q) files_off(Q) files_len(Q)
+# formulas_off(Q) formulas_len(Q) facets_off(Q) facets_len(Q)
+_HEADER = struct.Struct("<8sIIII32sQQQQQQQQQQQ")
+_CHUNK_RECORD = struct.Struct("<QIQIQIQI")
+_POSTING_FIELDS = 2  # chunk下标, 出现次数
+
+
+def _term_record(gram_size: int) -> struct.Struct:
+    return struct.Struct(f"<{4 * gram_size}sQI")
+
+
+def file_digest(path: Path) -> bytes:
+    """计算单个文件内容的 SHA-256"""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def source_entries(files: Sequence[Path], base_dir: Path) -> List[Tuple[str, bytes]]:
+    """计算源文件的 (相对路径, 内容摘要) 列表"""
+    return [(path.relative_to(base_dir).as_posix(), file_digest(path)) for path in files]
+
+
+def combine_checksum(entries: Sequence[Tuple[str, bytes]], gram_size: int) -> bytes:
+    """
+    由各源文件的 (相对路径, 内容摘要) 计算整体校验和
+
+    文件的相对路径、顺序和内容以及索引格式参数都参与计算，
+    任一变化都会使已持久化的索引失效。
+    """
+    digest = hashlib.sha256()
+    digest.update(MAGIC)
+    digest.update(struct.pack("<II", FORMAT_VERSION, gram_size))
+
+    for rel_path, file_hash in entries:
+        digest.update(rel_path.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(file_hash)
+
+    return digest.digest()
+
+
+def compute_sources_checksum(files: Sequence[Path], base_dir: Path, gram_size: int) -> bytes:
+    """计算所有源JSON文件的校验和"""
+    return combine_checksum(source_entries(files, base_dir), gram_size)
+
+
+@contextlib.contextmanager
+def build_lock(path: Path) -> Iterator[None]:
+    """
+    跨进程的索引构建锁（对索引文件旁的 .lock 文件加 flock）
+
+    多个 worker 同时启动且索引需要重建时，只有拿到锁的进程解析JSON并写入索引，
+    其余进程等待后直接映射写好的索引文件，不再各自构建一份。
+    """
+    lock_file = None
+    if fcntl is not None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            lock_file = open(path.with_name(f"{path.name}.lock"), "a+b")
+        except OSError as e:
+            # 数据目录只读等情况下退化为不加锁
+            print(f"[RAG] 无法创建索引构建锁: {e}")
+
+    if lock_file is None:
+        yield
+        return
+
+    with lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def write_index(path: Path, chunks: Sequence[Dict], normalized: Sequence[NormalizedText],
+                postings: Dict[str, Dict[int, int]], files: List[SourceFile], stats: CorpusStats,
+                formulas: Mapping[str, Dict[int, int]], facets: FacetIndex,
+                gram_size: int, checksum: bytes) -> None:
+    """
+    将文本块和倒排索引写入磁盘
+
+    先写入临时文件再原子替换，并发启动的多个 worker 不会读到写了一半的文件。
+    """
+    term_record = _term_record(gram_size)
+
+    chunk_table = bytearray()
+    strings = bytearray()
+    for chunk_idx, norm in enumerate(normalized):
+        content, metadata, source = record_at(chunks, chunk_idx)
+        content = content.encode("utf-8")
+        meta = json.dumps({"metadata": metadata, "source": source}, ensure_ascii=False).encode("utf-8")
+        lower = norm.text.encode("utf-8")
+        sentence_ends = array("I", norm.sentence_ends)
+        if sys.byteorder != "little":
+            sentence_ends.byteswap()
+
+        content_off = len(strings)
+        meta_off = content_off + len(content)
+        lower_off = meta_off + len(meta)
+        ends_off = lower_off + len(lower)
+        chunk_table += _CHUNK_RECORD.pack(content_off, len(content), meta_off, len(meta),
+                                          lower_off, len(lower), ends_off, len(sentence_ends))
+        strings += content
+        strings += meta
+        strings += lower
+        strings += sentence_ends.tobytes()
+
+    terms = sorted(postings)
+    term_table = bytearray()
+    posting_data = array("I")
+    for term in terms:
+        posting = postings[term]
+        term_table += term_record.pack(term.encode("utf-32-be"), len(posting_data), len(posting))
+        for chunk_idx in sorted(posting):
+            posting_data.append(chunk_idx)
+            posting_data.append(posting[chunk_idx])
+    if sys.byteorder != "little":
+        posting_data.byteswap()
+
+    doc_lengths = array("I", stats.doc_lengths)
+    if sys.byteorder != "little":
+        doc_lengths.byteswap()
+
+    file_table = json.dumps([f.to_dict() for f in files], ensure_ascii=False).encode("utf-8")
+    formula_table = json.dumps({formula: sorted(posting) for formula, posting in sorted(formulas.items())},
+                               ensure_ascii=False).encode("utf-8")
+    facet_table = json.dumps(encode_facets(facets), ensure_ascii=False).encode("utf-8")
+
+    chunk_table_off = _HEADER.size
+    strings_off = chunk_table_off + len(chunk_table)
+    terms_off = strings_off + len(strings)
+    postings_off = terms_off + len(term_table)
+    lengths_off = postings_off + len(posting_data) * posting_data.itemsize
+    files_off = lengths_off + len(doc_lengths) * doc_lengths.itemsize
+    formulas_off = files_off + len(file_table)
+    facets_off = formulas_off + len(formula_table)
+
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, gram_size, len(chunks), len(terms), checksum,
+                          chunk_table_off, strings_off, terms_off, postings_off,
+                          lengths_off, files_off, len(file_table), formulas_off, len(formula_table),
+                          facets_off, len(facet_table))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(chunk_table)
+            f.write(strings)
+            f.write(term_table)
+            f.write(posting_data.tobytes())
+            f.write(doc_lengths.tobytes())
+            f.write(file_table)
+            f.write(formula_table)
+            f.write(facet_table)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+class MappedChunks(Sequence):
+    """只读文本块序列，按需从映射文件中解码"""
+
+    def __init__(self, index: "MappedIndex"):
+        self._index = index
+
+    def __len__(self) -> int:
+        return self._index.n_chunks
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("chunk index out of range")
+        return self._index.chunk(idx)
+
+    def record(self, idx: int):
+        """返回 (正文, 元数据, 来源)，元数据为缓存中共享的对象，只读"""
+        return self._index.record(idx)
+
+
+class MappedNormalized(Sequence):
+    """只读的预处理文本序列，与 MappedChunks 一一对应"""
+
+    def __init__(self, index: "MappedIndex"):
+        self._index = index
+
+    def __len__(self) -> int:
+        return self._index.n_chunks
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("chunk index out of range")
+        return self._index.normalized(idx)
+
+
+class MappedPosting(Mapping):
+    """
+    单个词项的只读倒排表（chunk下标 -> 出现次数），直接读映射文件，不构造 dict
+
+    chunk下标按升序存储，按下标查询时二分查找。
+    """
+
+    __slots__ = ("_ids", "_counts")
+
+    def __init__(self, pairs: Sequence[int]):
+        # pairs 为交替存放的 (chunk下标, 出现次数)
+        self._ids = pairs[0::2]
+        self._counts = pairs[1::2]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._ids)
+
+    def __contains__(self, chunk_idx) -> bool:
+        return self._find(chunk_idx) >= 0
+
+    def __getitem__(self, chunk_idx: int) -> int:
+        pos = self._find(chunk_idx)
+        if pos < 0:
+            raise KeyError(chunk_idx)
+        return self._counts[pos]
+
+    def _find(self, chunk_idx: int) -> int:
+        pos = bisect_left(self._ids, chunk_idx)
+        return pos if pos < len(self._ids) and self._ids[pos] == chunk_idx else -1
+
+    def get(self, chunk_idx: int, default=None):
+        pos = self._find(chunk_idx)
+        return default if pos < 0 else self._counts[pos]
+
+    def items(self) -> Iterator[Tuple[int, int]]:
+        return zip(self._ids, self._counts)
+
+
+class MappedPostings:
+    """只读倒排表，词项在映射文件的有序词项表中二分查找"""
+
+    def __init__(self, index: "MappedIndex"):
+        self._index = index
+
+    def __len__(self) -> int:
+        return self._index.n_terms
+
+    def __contains__(self, term: str) -> bool:
+        return self._index.find_term(term) is not None
+
+    def get(self, term: str, default=None) -> Optional[Mapping[int, int]]:
+        posting = self._index.posting(term)
+        return default if posting is None else posting
+
+    def items(self) -> Iterator[Tuple[str, Mapping[int, int]]]:
+        for pos, term in enumerate(self._index.terms()):
+            yield term, self._index.posting_at(pos)
+
+
+class MappedIndex:
+    """通过 mmap 打开的持久化索引"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            (magic, version, self.gram_size, self.n_chunks, self.n_terms, self.checksum,
+             self._chunk_table_off, self._strings_off, self._terms_off,
+             self._postings_off, self._lengths_off, self._files_off,
+             self._files_len, self._formulas_off, self._formulas_len,
+             self._facets_off, self._facets_len) = _HEADER.unpack_from(self._mm, 0)
+        except struct.error as e:
+            self.close()
+            raise ValueError(f"索引文件头损坏: {e}")
+
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"索引文件格式不兼容: {magic!r} v{version}")
+
+        self._term_record = _term_record(self.gram_size)
+        self._term_size = 4 * self.gram_size
+        # 文本块和预处理文本首次访问时解码，之后每次检索直接复用
+        self._records: List[Optional[Tuple[str, Dict, str]]] = [None] * self.n_chunks
+        self._normalized: List[Optional[NormalizedText]] = [None] * self.n_chunks
+        # 倒排区按 u32 直接映射（小端序主机上不复制数据）
+        self._postings_buffer = memoryview(self._mm)[self._postings_off:self._lengths_off]
+        if sys.byteorder == "little":
+            self._postings = self._postings_buffer.cast("I")
+        else:
+            self._postings = array("I")
+            self._postings.frombytes(self._postings_buffer)
+            self._postings.byteswap()
+
+    @classmethod
+    def open_if_valid(cls, path: Path, checksum: bytes, gram_size: int) -> Optional["MappedIndex"]:
+        """打开索引文件；文件不存在、损坏或校验和不一致时返回 None"""
+        if not path.exists():
+            return None
+        try:
+            index = cls(path)
+        except (OSError, ValueError) as e:
+            print(f"[RAG] 忽略无效的索引文件 {path}: {e}")
+            return None
+
+        if index.checksum != checksum or index.gram_size != gram_size:
+            index.close()
+            return None
+        return index
+
+    def close(self) -> None:
+        # 先释放对映射内存的引用，否则 mmap 无法关闭
+        for view in (getattr(self, "_postings", None), getattr(self, "_postings_buffer", None)):
+            if isinstance(view, memoryview):
+                view.release()
+        self._mm.close()
+
+    def _chunk_record(self, idx: int):
+        return _CHUNK_RECORD.unpack_from(self._mm, self._chunk_table_off + idx * _CHUNK_RECORD.size)
+
+    def chunk(self, idx: int) -> Dict:
+        content, metadata, source = self.record(idx)
+        return {
+            "content": content,
+            "metadata": dict(metadata),
+            "source": source
+        }
+
+    def record(self, idx: int) -> Tuple[str, Dict, str]:
+        """文本块的 (正文, 元数据, 来源)（缓存的对象，只读）"""
+        record = self._records[idx]
+        if record is None:
+            content_off, content_len, meta_off, meta_len = self._chunk_record(idx)[:4]
+            base = self._strings_off
+            content = self._mm[base + content_off:base + content_off + content_len].decode("utf-8")
+            meta = json.loads(self._mm[base + meta_off:base + meta_off + meta_len])
+            record = self._records[idx] = (content, meta["metadata"], meta["source"])
+        return record
+
+    def normalized(self, idx: int) -> NormalizedText:
+        norm = self._normalized[idx]
+        if norm is None:
+            norm = self._normalized[idx] = self._decode_normalized(idx)
+        return norm
+
+    def _decode_normalized(self, idx: int) -> NormalizedText:
+        lower_off, lower_len, ends_off, ends_count = self._chunk_record(idx)[4:]
+        base = self._strings_off
+        text = self._mm[base + lower_off:base + lower_off + lower_len].decode("utf-8")
+        sentence_ends = array("I")
+        sentence_ends.frombytes(self._mm[base + ends_off:base + ends_off + ends_count * 4])
+        if sys.byteorder != "little":
+            sentence_ends.byteswap()
+        return NormalizedText(text, sentence_ends)
+
+    def decode_all(self) -> None:
+        """解码并缓存全部文本块和预处理文本（fork 前在主进程中调用，worker 共享解码结果）"""
+        for idx in range(self.n_chunks):
+            self.record(idx)
+            self.normalized(idx)
+
+    def find_term(self, term: str) -> Optional[int]:
+        """二分查找词项，返回其在词项表中的序号"""
+        if len(term) != self.gram_size:
+            return None
+        key = term.encode("utf-32-be")
+        record_size = self._term_record.size
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self._terms_off + mid * record_size
+            probe = self._mm[start:start + self._term_size]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def corpus_stats(self) -> CorpusStats:
+        """读取各文本块的长度统计"""
+        doc_lengths = array("I")
+        doc_lengths.frombytes(self._mm[self._lengths_off:self._lengths_off + self.n_chunks * 4])
+        if sys.byteorder != "little":
+            doc_lengths.byteswap()
+        return CorpusStats(doc_lengths)
+
+    def source_files(self) -> List[SourceFile]:
+        """读取来源文件表"""
+        data = json.loads(self._mm[self._files_off:self._files_off + self._files_len])
+        return [SourceFile.from_dict(item) for item in data]
+
+    def formula_index(self) -> Dict[str, Dict[int, int]]:
+        """读取化学式索引"""
+        data = json.loads(self._mm[self._formulas_off:self._formulas_off + self._formulas_len])
+        return {formula: dict.fromkeys(chunk_ids, 1) for formula, chunk_ids in data.items()}
+
+    def facet_index(self) -> FacetIndex:
+        """读取分面位图"""
+        return decode_facets(json.loads(self._mm[self._facets_off:self._facets_off + self._facets_len]))
+
+    def posting(self, term: str) -> Optional[MappedPosting]:
+        pos = self.find_term(term)
+        if pos is None:
+            return None
+        return self.posting_at(pos)
+
+    def posting_at(self, pos: int) -> MappedPosting:
+        """词项表中第 pos 个词项的倒排表"""
+        _, posting_off, posting_len = self._term_record.unpack_from(
+            self._mm, self._terms_off + pos * self._term_record.size
+        )
+        return MappedPosting(self._postings[posting_off:posting_off + posting_len * _POSTING_FIELDS])
+
+    def terms(self) -> Iterator[str]:
+        record_size = self._term_record.size
+        for i in range(self.n_terms):
+            start = self._terms_off + i * record_size
+            yield self._mm[start:start + self._term_size].decode("utf-32-be")
@@ -0,0 +1,194 @@
+"""
+教材JSON加载
+读取、解码并解析教材JSON文件，同时完成文本预处理、单个文件的倒排索引和近似重复检测用的签名。
+需要加载的文件较多时在进程池中并行处理；安装了 orjson 时用它解码JSON。
+"""
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import orjson
+    JSON_DECODER = "orjson"
+except ImportError:
+    orjson = None
+    JSON_DECODER = "json"
+
+from services.chunk_store import ChunkStore
+from services.chunk_text import NormalizedText, normalize_text
+from services.corpus import build_formula_index, build_postings
+from services.near_dup import DUPLICATES_FIELD, Signature, signature
+
+# 待加载文件数达到该值时才使用进程池：
+# 进程启动和结果回传有固定开销，只有一两个文件时单进程更快
+PARALLEL_MIN_FILES = 3
+
+
+def decode_json(raw: bytes) -> Any:
+    """解码JSON（优先使用 orjson）"""
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            # orjson 比标准库严格（如不接受 NaN），交给标准库再试一次
+            pass
+    return json.loads(raw.decode("utf-8"))
+
+
+def parse_textbook_data(data: Any, source: str) -> List[Dict]:
+    """
+    解析教材数据，提取文本块
+
+    支持两种格式：
+    1. 列表格式: [{"metadata": {...}, "content": "..."}]
+    2. 嵌套格式: {"sections": [{"chunks": [...]}, ...]}
+
+    文本块带有 entities 字段（process_textbook.py 提取的化学实体）时一并返回，
+    用于建立化学式索引，不进入文本块存储。
+    """
+    chunks = []
+
+    if isinstance(data, list):
+        # 格式1: 扁平列表
+        for item in data:
+            if isinstance(item, dict) and "content" in item:
+                chunks.append({
+                    "content": item["content"],
+                    "metadata": item.get("metadata", {}),
+                    "source": source,
+                    "entities": item.get("entities")
+                })
+
+    elif isinstance(data, dict):
+        # 格式2: 嵌套结构（处理process_textbook.py的输出）
+        if "sections" in data:
+            for section in data["sections"]:
+                if "chunks" in section:
+                    for chunk in section["chunks"]:
+                        chunk_metadata = chunk.get("metadata", {})
+                        metadata = {
+                            "section": section.get("title", ""),
+                            "source": chunk_metadata.get("source", source),
+                            "chunk_id": chunk.get("chunk_id", "")
+                        }
+                        # 预处理时合并的近似重复文本块的来源
+                        if chunk_metadata.get(DUPLICATES_FIELD):
+                            metadata[DUPLICATES_FIELD] = chunk_metadata[DUPLICATES_FIELD]
+                        chunks.append({
+                            "content": chunk.get("text", ""),
+                            "metadata": metadata,
+                            "source": source,
+                            "entities": chunk.get("entities")
+                        })
+
+    return chunks
+
+
+class LoadedFile:
+    """一个教材文件的加载结果"""
+
+    __slots__ = ("name", "chunks", "normalized", "postings", "formulas", "signatures", "elapsed", "error")
+
+    def __init__(self, name: str, chunks: ChunkStore, normalized: List[NormalizedText],
+                 postings: Dict[str, Dict[int, int]], formulas: Dict[str, Dict[int, int]],
+                 signatures: List[Optional[Signature]], elapsed: float, error: Optional[str] = None):
+        self.name = name
+        self.chunks = chunks
+        self.normalized = normalized
+        # 本文件的倒排索引，文本块下标从 0 开始
+        self.postings = postings
+        # 本文件的化学式索引，文本块下标同样从 0 开始
+        self.formulas = formulas
+        # 每个文本块的 MinHash 签名（见 services.near_dup）
+        self.signatures = signatures
+        # 读取到建好索引的耗时（秒）
+        self.elapsed = elapsed
+        self.error = error
+
+
+def load_file(path: str) -> LoadedFile:
+    """读取并解析一个教材JSON文件（可在子进程中执行），失败时返回空结果和错误信息"""
+    start = time.perf_counter()
+    name = os.path.basename(path)
+    try:
+        with open(path, "rb") as f:
+            data = decode_json(f.read())
+
+        # 处理不同的数据格式
+        parsed = parse_textbook_data(data, name)
+        chunks = ChunkStore(parsed)
+        normalized = [normalize_text(chunks.content(i)) for i in range(len(chunks))]
+        postings = build_postings(normalized)
+        formulas = build_formula_index(parsed)
+        signatures = [signature(chunks.content(i)) for i in range(len(chunks))]
+        return LoadedFile(name, chunks, normalized, postings, formulas, signatures, time.perf_counter() - start)
+
+    except Exception as e:
+        return LoadedFile(name, ChunkStore(), [], {}, {}, [], time.perf_counter() - start, str(e))
+
+
+def default_workers() -> int:
+    """加载进程数：环境变量 RAG_LOAD_WORKERS，默认为当前进程可用的 CPU 核数"""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    return max(1, int(os.getenv("RAG_LOAD_WORKERS", str(cpus))))
+
+
+def fork_unsafe() -> bool:
+    """
+    当前是否不宜直接 fork 出进程池
+
+    进程池默认以 fork 启动时，子进程会继承其他线程此刻持有的锁（日志、jieba 等）而可能死锁。
+    服务启动时语料在预热线程中加载，重新加载由监视线程或接口线程触发，这些时候进程中都已有多个线程。
+    """
+    return multiprocessing.get_start_method() == "fork" and threading.active_count() > 1
+
+
+def pool_context() -> Optional[multiprocessing.context.BaseContext]:
+    """
+    创建进程池用的启动方式：能安全 fork 时用默认方式（None），否则用 forkserver
+
+    forkserver 由一个单线程的服务进程 fork 出工作进程，不继承当前进程中其他线程的锁；
+    本模块及其依赖由服务进程预先导入，工作进程 fork 时直接继承。
+    """
+    if not fork_unsafe():
+        return None
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["__main__", __name__])
+    return context
+
+
+def load_files(paths: Sequence[str], workers: Optional[int] = None) -> List[LoadedFile]:
+    """
+    加载一组教材JSON文件
+
+    Args:
+        paths: 文件路径
+        workers: 进程数，默认见 default_workers；为 1 或文件数不足 PARALLEL_MIN_FILES 时
+                 在当前进程中加载；多线程进程中的进程池见 pool_context
+
+    Returns:
+        与 paths 顺序一致的加载结果
+    """
+    if workers is None:
+        workers = default_workers()
+    workers = min(workers, len(paths))
+
+    if workers > 1 and len(paths) >= PARALLEL_MIN_FILES:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as executor:
+                return list(executor.map(load_file, paths))
+        except (OSError, BrokenProcessPool) as e:
+            # 受限环境中可能无法创建子进程
+            print(f"[RAG] 进程池不可用，改为单进程加载: {e}")
+
+    return [load_file(path) for path in paths]
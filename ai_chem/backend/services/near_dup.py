@@ -0,0 +1,154 @@
+"""
+近似重复文本块检测
+用 MinHash 签名和 LSH 分桶找出内容几乎相同的文本块（如同一教材不同版本中重复的段落），
+供预处理脚本（scripts/process_textbook.py）和加载语料（TextbookRAG）时合并重复文本块。
+
+签名：正文去掉空白和标点并转为小写后切成 SHINGLE_SIZE 字的片段（shingle），
+用单次哈希 MinHash（one permutation hashing）计算：每个片段只哈希一次，按哈希值的高位分到
+SIGNATURE_SIZE 个桶，每个桶保留最小值；空桶向右借用最近的非空桶（旋转补全）。
+两个签名对应位置相等的比例就是两段文本片段集合 Jaccard 相似度的估计。
+
+LSH：签名切成 LSH_BANDS 段，任意一段完全相同的文本块才作为候选，再按估计的相似度确认，
+避免两两比较。相似度 0.8 的一对文本块成为候选的概率约为 1 - (1 - 0.8^4)^16 ≈ 0.9996。
+
+签名只依赖 zlib.crc32 和固定的混合常数，不同进程、不同机器上的结果完全一致。
+"""
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 文本片段长度（字符）
+SHINGLE_SIZE = 5
+
+# 签名长度（桶数，须为 2 的幂）和 LSH 分段数
+SIGNATURE_SIZE = 64
+LSH_BANDS = 16
+
+# 估计的 Jaccard 相似度达到该值时视为近似重复
+DUPLICATE_THRESHOLD = 0.8
+
+# 合并后保留的文本块在元数据中记录被合并文本块来源的字段
+DUPLICATES_FIELD = "duplicates"
+
+# 签名: SIGNATURE_SIZE 个整数；没有可用字符的文本没有签名（None），不参与去重
+Signature = Tuple[int, ...]
+
+_BUCKET_BITS = SIGNATURE_SIZE.bit_length() - 1
+_VALUE_BITS = 64 - _BUCKET_BITS
+_VALUE_MASK = (1 << _VALUE_BITS) - 1
+_MASK64 = (1 << 64) - 1
+_MIX = 0x9E3779B97F4A7C15
+_ROWS = SIGNATURE_SIZE // LSH_BANDS
+
+# 计算签名时忽略的字符：空白和标点
+_IGNORED = re.compile(r"[\s\W_]+")
+
+
+def _hash(shingle: str) -> int:
+    """片段的 64 位哈希（crc32 乘以黄金分割常数再混合高低位，高位分布均匀）"""
+    h = (zlib.crc32(shingle.encode("utf-8")) * _MIX) & _MASK64
+    return h ^ (h >> 31)
+
+
+def signature(text: str) -> Optional[Signature]:
+    """计算文本的 MinHash 签名"""
+    key = _IGNORED.sub("", text.lower())
+    if not key:
+        return None
+    if len(key) <= SHINGLE_SIZE:
+        shingles = {key}
+    else:
+        shingles = {key[i:i + SHINGLE_SIZE] for i in range(len(key) - SHINGLE_SIZE + 1)}
+
+    empty = _VALUE_MASK + 1
+    bins = [empty] * SIGNATURE_SIZE
+    for shingle in shingles:
+        h = _hash(shingle)
+        bucket = h >> _VALUE_BITS
+        value = h & _VALUE_MASK
+        if value < bins[bucket]:
+            bins[bucket] = value
+
+    # 空桶取右侧最近的非空桶的值，加上与距离相关的偏移，保证与真实取值区分
+    if empty in bins:
+        for i in range(SIGNATURE_SIZE):
+            if bins[i] != empty:
+                continue
+            for distance in range(1, SIGNATURE_SIZE):
+                source = bins[(i + distance) % SIGNATURE_SIZE]
+                if source != empty and source <= _VALUE_MASK:
+                    bins[i] = source + distance * empty
+                    break
+    return tuple(bins)
+
+
+def similarity(a: Signature, b: Signature) -> float:
+    """由签名估计两段文本的 Jaccard 相似度"""
+    return sum(1 for x, y in zip(a, b) if x == y) / SIGNATURE_SIZE
+
+
+class NearDuplicateIndex:
+    """
+    近似重复文本块的 LSH 索引
+
+    按加载顺序加入文本块；与已有文本块近似重复的文本块不加入索引，
+    只返回它应当合并到的文本块，避免 A≈B、B≈C 时 C 被合并到与它并不相似的 A。
+    """
+
+    def __init__(self, threshold: float = DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self._signatures: Dict[int, Signature] = {}
+        self._bands: List[Dict[Signature, List[int]]] = [{} for _ in range(LSH_BANDS)]
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def find(self, sig: Optional[Signature]) -> Optional[int]:
+        """已加入的文本块中与 sig 最相似且达到阈值的一个（同等相似时取最早加入的）"""
+        if sig is None:
+            return None
+        candidates = set()
+        for band, buckets in enumerate(self._bands):
+            candidates.update(buckets.get(sig[band * _ROWS:(band + 1) * _ROWS], ()))
+
+        best, best_score = None, self.threshold
+        for item_id in sorted(candidates):
+            score = similarity(sig, self._signatures[item_id])
+            if score > best_score or (score == best_score and best is None):
+                best, best_score = item_id, score
+        return best
+
+    def add(self, item_id: int, sig: Optional[Signature]) -> None:
+        """加入一个文本块（没有签名的文本块不加入）"""
+        if sig is None:
+            return
+        self._signatures[item_id] = sig
+        for band, buckets in enumerate(self._bands):
+            buckets.setdefault(sig[band * _ROWS:(band + 1) * _ROWS], []).append(item_id)
+
+    def add_or_find(self, item_id: int, sig: Optional[Signature]) -> Optional[int]:
+        """
+        文本块与已有文本块近似重复时返回应合并到的文本块，否则加入索引并返回 None
+        """
+        canonical = self.find(sig)
+        if canonical is None:
+            self.add(item_id, sig)
+        return canonical
+
+
+def find_duplicates(texts: Iterable[str], threshold: float = DUPLICATE_THRESHOLD) -> List[Optional[int]]:
+    """
+    按顺序检测一组文本中的近似重复
+
+    Returns:
+        与 texts 一一对应：近似重复的文本为应合并到的（更早出现的）文本下标，其余为 None
+    """
+    index = NearDuplicateIndex(threshold)
+    return [index.add_or_find(i, signature(text)) for i, text in enumerate(texts)]
+
+
+def merge_duplicates(metadata: Dict, entries: Sequence[Dict]) -> Dict:
+    """在保留下来的文本块的元数据中追加被合并文本块的来源，返回新的元数据"""
+    merged = dict(metadata)
+    merged[DUPLICATES_FIELD] = list(metadata.get(DUPLICATES_FIELD, ())) + list(entries)
+    return merged
@@ -2,118 +2,610 @@
 RAG检索服务 - 快速方案
 使用关键词匹配和全文搜索从教材中检索相关内容
 """
-import json
+import gc
 import re
 import os
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, FrozenSet, Iterable, Optional, Set, Tuple
+import jieba
 from jieba import analyse
 
+from services.bm25 import BM25Scorer
+from services.chem_formula import FORMULA_PATTERN, extract_formulas, normalize_formula_text
+from services.chunk_store import ChunkStore, materialize_at, record_at
+from services.chunk_text import NormalizedText
+from services.context_builder import DEFAULT_CONTEXT_TOKENS, TokenCounter, build_context
+from services.corpus import (
+    INDEX_GRAM_SIZE,
+    CorpusSnapshot,
+    SourceFile,
+    merge_postings,
+    patch_postings,
+)
+from services.facets import Filters, FilterKey, build_facet_index, facet_values, normalize_filters
+from services.ingest import JSON_DECODER, load_files
+from services.near_dup import DUPLICATES_FIELD, NearDuplicateIndex, merge_duplicates, signature
+from services.dense_index import QUERY_INSTRUCTION, DenseIndex, DenseIndexUnavailable, Embedder
+from services.hybrid import (
+    HYBRID_DEPTH_FACTOR,
+    HYBRID_MIN_DEPTH,
+    HYBRID_RETRIEVERS,
+    default_deadline,
+    reciprocal_rank_fusion,
+    run_with_deadline,
+)
+from services.index_store import (
+    MappedChunks,
+    MappedIndex,
+    MappedNormalized,
+    MappedPostings,
+    build_lock,
+    combine_checksum,
+    source_entries,
+    write_index,
+)
+from services.query_cache import QueryCache, normalize_question
+from services.scoring import BatchScorer, TopK
+from services.sparse_scoring import SPARSE_AVAILABLE, SparseScorer
+
+
+# 持久化索引文件名（位于教材数据目录下）
+INDEX_FILE_NAME = ".rag_index.bin"
+
+# 默认教材数据目录
+DEFAULT_DATA_DIR = Path(__file__).parent.parent / "data" / "collected" / "textbok"
+
+# 评分后端：python 为逐块评分，sparse 为 NumPy/SciPy 稀疏矩阵评分，
+# auto 在文本块数量达到 SPARSE_MIN_CHUNKS 且依赖可用时使用 sparse
+SCORING_BACKENDS = ("auto", "python", "sparse")
+SPARSE_MIN_CHUNKS = 2000
+
+# 排序方式：keyword 为关键词计数 + 同句共现加分（_calculate_relevance），
+# bm25 为 BM25（IDF 加权、按文本块长度归一化），dense 为向量检索（需先离线构建向量索引），
+# hybrid 为以上几种并行检索后做倒数排名融合
+RANKING_MODES = ("keyword", "bm25", "dense", "hybrid")
+
+# 关键词提取结果的缓存条目数
+KEYWORD_CACHE_SIZE = 4096
+
+# 组装上下文时忽略 IDF 不到问题中最高 IDF 该比例的关键词（如 "什么"、"如何" 这类疑问词）
+CONTEXT_KEYWORD_IDF_RATIO = 0.5
+
+
+@lru_cache(maxsize=KEYWORD_CACHE_SIZE)
+def _extract_keywords_cached(question: str, top_k: int) -> Tuple[str, ...]:
+    """提取问题中的关键词（结果按问题缓存）"""
+    # 提取化学式（如 H2O, Ca(OH)2, Fe3+），整体作为关键词；
+    # 分词前先从问题中去掉，避免被 jieba 切成 "Ca"、"OH" 这样的片段
+    question = normalize_formula_text(question)
+    chemical_formulas = extract_formulas(question)
+
+    # 使用TF-IDF提取关键词
+    keywords = analyse.extract_tags(FORMULA_PATTERN.sub(" ", question), topK=top_k, withWeight=False)
+    keywords.extend(chemical_formulas)
+
+    # 去重并保持顺序
+    seen = set()
+    result = []
+    for kw in keywords:
+        if kw not in seen and len(kw) > 1:
+            seen.add(kw)
+            result.append(kw)
+
+    return tuple(result)
+
+
+def _context_keywords(keywords: List[str]) -> List[str]:
+    """
+    组装上下文时用来挑选句子的关键词
+
+    句子价值按命中的关键词数计算，"什么是化学键？" 中的 "什么" 与 "化学键" 同样计 1，
+    只含 "什么" 的句子会挤掉真正的定义句；去掉 IDF 远低于其他关键词的泛用词。
+    词典中没有的词（包括化学式）按 IDF 中位数计。
+    """
+    tfidf = analyse.default_tfidf
+    idf = [tfidf.idf_freq.get(kw, tfidf.median_idf) for kw in keywords]
+    if not idf:
+        return []
+    threshold = max(idf) * CONTEXT_KEYWORD_IDF_RATIO
+    return [kw for kw, value in zip(keywords, idf) if value >= threshold]
+
 
 class TextbookRAG:
     """教材RAG检索器"""
 
-    def __init__(self, data_dir: str = None):
+    def __init__(self, data_dir: str = None, index_path: str = None, persist_index: bool = True,
+                 scoring_backend: str = "auto", cache_size: int = 1024, cache_ttl: float = 600.0,
+                 load_workers: Optional[int] = None, hybrid_deadline: Optional[float] = None,
+                 subdirs: Optional[List[str]] = None):
         """
         初始化RAG检索器
 
         Args:
             data_dir: 教材数据目录，默认为 backend/data/collected/textbok
+            index_path: 持久化索引文件路径，默认为 data_dir/.rag_index.bin
+            persist_index: 是否读写持久化索引（关闭后每次启动都重新解析JSON）
+            scoring_backend: 评分后端，可选 auto / python / sparse
+            cache_size: 检索结果缓存的最大条目数，0 表示关闭缓存
+            cache_ttl: 检索结果缓存的有效期（秒）
+            load_workers: 并行加载教材JSON的进程数，默认读取环境变量 RAG_LOAD_WORKERS（缺省为CPU核数）
+            hybrid_deadline: 混合检索的截止时间（秒），默认读取环境变量 RAG_HYBRID_DEADLINE_MS
+            subdirs: 只加载这些教材子目录（分片模式下每个分片一个子目录），默认加载全部
         """
-        if data_dir is None:
-            # 默认数据目录
-            current_dir = Path(__file__).parent.parent
-            data_dir = current_dir / "data" / "collected" / "textbok"
-
-        self.data_dir = Path(data_dir)
-        self.chunks = []
+        if scoring_backend not in SCORING_BACKENDS:
+            raise ValueError(f"未知的评分后端: {scoring_backend}，可选: {', '.join(SCORING_BACKENDS)}")
+
+        self.data_dir = Path(data_dir) if data_dir is not None else DEFAULT_DATA_DIR
+        self.index_path = Path(index_path) if index_path else self.data_dir / INDEX_FILE_NAME
+        self.persist_index = persist_index
+        self.scoring_backend = scoring_backend
+        self.load_workers = load_workers
+        self.subdirs = list(subdirs) if subdirs is not None else None
+        # 其他分片的化学式（见 set_external_formulas）
+        self.external_formulas: FrozenSet[str] = frozenset()
+        self.hybrid_deadline = hybrid_deadline if hybrid_deadline is not None else default_deadline()
+        # 混合检索中各子检索器因超时被放弃的次数
+        self.hybrid_dropped: Counter = Counter()
+        self._stats_lock = threading.Lock()
+        # 检索结果缓存，语料重新加载时清空
+        self.query_cache = QueryCache(max_size=cache_size, ttl=cache_ttl)
+        # 当前语料快照；重新加载时整体替换，检索过程中只使用开始时取得的快照
+        self._corpus = CorpusSnapshot.empty()
+        self._generation = 0
+        self._reload_lock = threading.Lock()
+        # 向量检索的嵌入模型（首次使用时加载）
+        self._embedder = None
+        self._dense_lock = threading.Lock()
         self.index_built = False
 
         # 初始化时自动加载数据
         self.load_textbooks()
 
+    @property
+    def corpus(self) -> CorpusSnapshot:
+        """当前语料快照"""
+        return self._corpus
+
+    @property
+    def chunks(self):
+        """文本块列表"""
+        return self._corpus.chunks
+
+    @property
+    def num_chunks(self) -> int:
+        """文本块数量"""
+        return len(self._corpus)
+
+    def facet_values(self) -> Dict[str, Dict[str, int]]:
+        """各过滤字段的取值及对应的文本块数量"""
+        if not self.index_built:
+            self.load_textbooks()
+        return facet_values(self._corpus.facets)
+
+    def formula_vocabulary(self) -> FrozenSet[str]:
+        """当前语料中出现的全部化学式（小写）"""
+        return self._corpus.formula_vocabulary()
+
+    @property
+    def normalized(self):
+        """与 chunks 一一对应的预处理文本（小写正文 + 分句边界）"""
+        return self._corpus.normalized
+
+    @property
+    def postings(self):
+        """倒排索引: 词项 -> {chunk下标: 词项出现次数}"""
+        return self._corpus.postings
+
+    def _list_source_files(self) -> List[Path]:
+        """列出所有教材JSON文件（按子目录遍历顺序）"""
+        json_files = []
+        for subdir in self.data_dir.iterdir():
+            if not subdir.is_dir():
+                continue
+            if self.subdirs is not None and subdir.name not in self.subdirs:
+                continue
+            json_files.extend(subdir.glob("*.json"))
+        return json_files
+
     def load_textbooks(self) -> None:
-        """加载所有教材数据并建立索引"""
+        """
+        加载所有教材数据并建立索引
+
+        源文件校验和与持久化索引一致时直接映射索引文件，否则重新解析全部JSON、
+        建立索引并写回磁盘。新语料构建完成后才替换当前快照，加载期间检索不受影响。
+        """
         try:
+            self._reload(incremental=False)
+        except Exception as e:
+            print(f"[RAG] 加载教材数据失败: {e}")
+        self.index_built = True
+
+    def reload_changed(self) -> Dict[str, Any]:
+        """
+        增量重新加载：只重新解析内容发生变化的JSON文件
+
+        未变化文件的文本块和预处理文本直接复用，倒排索引在旧索引的基础上修补，
+        构建完成后原子替换当前快照。
+
+        Returns:
+            变化摘要（新增/修改/删除/未变化的文件）
+        """
+        return self._reload(incremental=True)
+
+    def _reload(self, incremental: bool) -> Dict[str, Any]:
+        """构建新的语料快照并替换当前快照"""
+        with self._reload_lock:
             print(f"[RAG] 正在加载教材数据: {self.data_dir}")
+            summary = {"reloaded": False, "added": [], "changed": [], "removed": [], "unchanged": 0}
 
             if not self.data_dir.exists():
                 print(f"[RAG] 数据目录不存在: {self.data_dir}")
-                self.index_built = True
-                return
-
-            total_chunks = 0
+                return summary
+
+            json_files = self._list_source_files()
+            entries = source_entries(json_files, self.data_dir)
+            current = self._corpus
+
+            base = current if incremental and self.index_built else None
+            summary.update(self._diff_sources(base, entries))
+            if base is not None and base.file_entries() == entries:
+                print("[RAG] 教材数据未变化\n")
+                return summary
+
+            checksum = combine_checksum(entries, INDEX_GRAM_SIZE)
+            if self.persist_index:
+                snapshot = self._open_mapped_snapshot(checksum)
+                if snapshot is None:
+                    # 多个 worker 同时启动时只由一个进程构建索引，其余进程等它写完后直接映射
+                    with build_lock(self.index_path):
+                        snapshot = self._open_mapped_snapshot(checksum)
+                        if snapshot is None:
+                            snapshot = self._build_and_persist(json_files, entries, base, checksum)
+                if snapshot.mapped is not None:
+                    print(f"[RAG] 已映射持久化索引: {self.index_path}")
+            else:
+                snapshot = self._build_snapshot(json_files, entries, base)
+
+            snapshot.checksum = checksum
+            self._swap_corpus(snapshot)
+            summary["reloaded"] = True
+            print(f"[RAG] 教材加载完成，共 {len(snapshot)} 个文本块\n")
+            return summary
+
+    @staticmethod
+    def _diff_sources(base: Optional[CorpusSnapshot], entries: List[Tuple[str, bytes]]) -> Dict[str, Any]:
+        """比较新旧来源文件表"""
+        old = dict(base.file_entries()) if base is not None else {}
+        new = dict(entries)
+        return {
+            "added": [path for path in new if path not in old],
+            "changed": [path for path in new if path in old and old[path] != new[path]],
+            "removed": [path for path in old if path not in new],
+            "unchanged": sum(1 for path in new if old.get(path) == new[path]),
+        }
+
+    def _build_and_persist(self, json_files: List[Path], entries: List[Tuple[str, bytes]],
+                           base: Optional[CorpusSnapshot], checksum: bytes) -> CorpusSnapshot:
+        """构建快照并写入持久化索引，写入成功时换成映射索引的快照"""
+        snapshot = self._build_snapshot(json_files, entries, base)
+        try:
+            write_index(self.index_path, snapshot.chunks, snapshot.normalized,
+                        snapshot.postings, snapshot.files, snapshot.stats,
+                        snapshot.formulas, snapshot.facets, INDEX_GRAM_SIZE, checksum)
+            print(f"[RAG] 索引已保存: {self.index_path}")
+            # 换成映射的索引，多个 worker 共享同一份页缓存
+            return self._open_mapped_snapshot(checksum) or snapshot
+        except OSError as e:
+            print(f"[RAG] 保存索引失败: {e}")
+            return snapshot
+
+    def _open_mapped_snapshot(self, checksum: bytes) -> Optional[CorpusSnapshot]:
+        """校验和一致时映射持久化索引，返回对应的快照"""
+        mapped = MappedIndex.open_if_valid(self.index_path, checksum, INDEX_GRAM_SIZE)
+        if mapped is None:
+            return None
+        return CorpusSnapshot(MappedChunks(mapped), MappedNormalized(mapped), MappedPostings(mapped),
+                              mapped.source_files(), mapped=mapped, stats=mapped.corpus_stats(),
+                              formulas=mapped.formula_index(), facets=mapped.facet_index())
+
+    @staticmethod
+    def _duplicate_entries(rel_path: str, metadata: Dict, source: str) -> List[Dict]:
+        """被合并的文本块的来源记录（连同它自己之前合并的来源）"""
+        own = {key: value for key, value in metadata.items() if key != DUPLICATES_FIELD}
+        return [{"path": rel_path, "source": source, "metadata": own}] + list(metadata.get(DUPLICATES_FIELD, ()))
+
+    @staticmethod
+    def _duplicate_groups(duplicates: List[Dict]) -> Tuple[List[Dict], List[List[Dict]]]:
+        """
+        把 duplicates 拆成文本块自带的记录（预处理时合并的，没有 path）和按文件合并进来的各组记录
 
-            # 遍历所有子目录
-            for subdir in self.data_dir.iterdir():
-                if not subdir.is_dir():
-                    continue
+        每组以一条带 path 的记录开头，后面是被合并的文本块自带的记录（见 _duplicate_entries）。
+        """
+        own: List[Dict] = []
+        groups: List[List[Dict]] = []
+        for entry in duplicates:
+            if "path" in entry:
+                groups.append([entry])
+            elif groups:
+                groups[-1].append(entry)
+            else:
+                own.append(entry)
+        return own, groups
+
+    @staticmethod
+    def _stale_paths(base: CorpusSnapshot, entries: List[Tuple[str, bytes]]) -> Set[str]:
+        """base 中内容变化或已删除的文件"""
+        current = dict(entries)
+        return {f.path for f in base.files if current.get(f.path) != f.digest}
+
+    @staticmethod
+    def _absorbed_others(base: CorpusSnapshot, stale: Set[str]) -> bool:
+        """stale 文件中的文本块是否合并过其他文件的文本块（这些文本块随之失效，只能全量重建）"""
+        for source_file in base.files:
+            if source_file.path not in stale:
+                continue
+            for chunk_idx in range(source_file.start, source_file.start + source_file.count):
+                _, metadata, _ = record_at(base.chunks, chunk_idx)
+                if any(entry.get("path") not in stale for entry in metadata.get(DUPLICATES_FIELD, ())
+                       if "path" in entry):
+                    return True
+        return False
+
+    def _build_snapshot(self, json_files: List[Path], entries: List[Tuple[str, bytes]],
+                        base: Optional[CorpusSnapshot]) -> CorpusSnapshot:
+        """
+        解析教材JSON并构建快照
 
-                # 查找JSON文件
-                json_files = list(subdir.glob("*.json"))
+        提供 base 时，内容未变化的文件直接复用 base 中的文本块，倒排索引在 base 的基础上修补；
+        否则解析全部文件并重新建立索引。需要解析的文件由 services.ingest 并行加载。
 
-                for json_file in json_files:
-                    try:
-                        with open(json_file, 'r', encoding='utf-8') as f:
-                            data = json.load(f)
+        新解析的文本块按加载顺序做近似重复检测（services.near_dup）：与已有文本块近似重复的
+        不进入语料，它的来源追加到保留下来的文本块元数据的 duplicates 字段中。
+        增量构建与全量构建按同样的文件顺序检测，结果完全一致；新文本块会改变排在它后面的
+        复用文本块的检测结果时（复用的文本块与它重复，或后面的文件有文本块合并到了别处），改为全量重建。
+        """
+        stale: Set[str] = set()
+        if base is not None:
+            stale = self._stale_paths(base, entries)
+            if self._absorbed_others(base, stale):
+                # 变化的文件中有文本块合并过其他文件的重复内容，增量修补会丢失这些内容
+                print("[RAG] 变化的文件包含合并过的重复文本块，改为全量重建")
+                base = None
+
+        base_files = {f.path: f for f in base.files} if base is not None else {}
+        positions = {rel_path: pos for pos, (rel_path, _) in enumerate(entries)}
+        old_to_new = [-1] * len(base) if base is not None else []
+
+        # 需要重新加载的文件（新增或内容变化）
+        reuse = [base_files.get(rel_path) for rel_path, _ in entries]
+        reuse = [old if old is not None and old.digest == digest else None
+                 for old, (_, digest) in zip(reuse, entries)]
+        to_load = [str(json_file) for json_file, old in zip(json_files, reuse) if old is None]
+
+        start = time.perf_counter()
+        loaded = iter(load_files(to_load, self.load_workers))
+
+        chunks = ChunkStore()
+        normalized: List[NormalizedText] = []
+        files: List[SourceFile] = []
+        # 需要合并进倒排索引的 (起始下标, 单个文件的倒排索引)，以及对应的化学式索引
+        added: List[Tuple[int, Dict[str, Dict[int, int]]]] = []
+        added_formulas: List[Tuple[int, Dict[str, Dict[int, int]]]] = []
+        # 近似重复检测：按文件顺序把保留下来的文本块（按新下标）加入索引，与全量构建相同
+        dedup = NearDuplicateIndex()
+        # 保留下来的文本块 -> 新合并进来的重复文本块来源
+        absorbed: Dict[int, List[Dict]] = {}
+        merged = 0
+        # 第一个保留了新文本块的文件的位置，以及复用的文本块合并过的最靠后的文件的位置
+        first_new = None
+        last_absorbed = -1
+        rebuild = False
+
+        for (rel_path, digest), old in zip(entries, reuse):
+            offset = len(chunks)
+
+            if old is not None:
+                chunks.extend(base.chunks, old.start, old.count)
+                for i in range(old.count):
+                    normalized.append(base.normalized[old.start + i])
+                    old_to_new[old.start + i] = offset + i
+                    metadata = chunks.metadata(offset + i)
+                    duplicates = metadata.get(DUPLICATES_FIELD)
+                    if duplicates:
+                        own, groups = self._duplicate_groups(duplicates)
+                        if stale and any(group[0]["path"] in stale for group in groups):
+                            # 去掉来自变化或已删除文件的来源记录（变化的文件会重新参与检测）
+                            groups = [group for group in groups if group[0]["path"] not in stale]
+                            remaining = own + [entry for group in groups for entry in group]
+                            metadata = {key: value for key, value in metadata.items() if key != DUPLICATES_FIELD}
+                            if remaining:
+                                metadata[DUPLICATES_FIELD] = remaining
+                            chunks.set_metadata(offset + i, metadata)
+                        for group in groups:
+                            last_absorbed = max(last_absorbed, positions[group[0]["path"]])
+                    if to_load:
+                        sig = signature(record_at(base.chunks, old.start + i)[0])
+                        if dedup.find(sig) is not None:
+                            # 复用的文本块与排在前面的新文本块重复，全量构建时它会被合并掉
+                            rebuild = True
+                            break
+                        dedup.add(offset + i, sig)
+                if rebuild:
+                    break
+            else:
+                result = next(loaded)
+                if result.error is None:
+                    print(f"  [OK] {result.name}: {len(result.chunks)} 个文本块 ({result.elapsed * 1000:.1f} ms)")
+                else:
+                    print(f"  [ERR] 加载 {result.name} 失败: {result.error}")
+
+                # 文件内下标 -> 语料中的新下标，-1 表示作为近似重复合并掉
+                local_to_new = []
+                kept = 0
+                for i, sig in enumerate(result.signatures):
+                    canonical = dedup.add_or_find(offset + kept, sig)
+                    if canonical is None:
+                        local_to_new.append(kept)
+                        kept += 1
+                    else:
+                        local_to_new.append(-1)
+                        absorbed.setdefault(canonical, []).extend(
+                            self._duplicate_entries(rel_path, result.chunks.metadata(i), result.chunks.source(i)))
+                        merged += 1
+
+                if kept and first_new is None:
+                    first_new = len(files)
+                if kept == len(result.chunks):
+                    chunks.extend(result.chunks)
+                    normalized.extend(result.normalized)
+                    added.append((offset, result.postings))
+                    added_formulas.append((offset, result.formulas))
+                else:
+                    for i, new_idx in enumerate(local_to_new):
+                        if new_idx >= 0:
+                            chunks.append_record(*result.chunks.record(i))
+                            normalized.append(result.normalized[i])
+                    added.append((offset, patch_postings(result.postings.items(), local_to_new, [])))
+                    added_formulas.append((offset, patch_postings(result.formulas.items(), local_to_new, [])))
+
+            files.append(SourceFile(rel_path, digest, offset, len(chunks) - offset))
+
+        if first_new is not None and last_absorbed > first_new:
+            # 后面的文件有文本块合并到了别处，全量构建时它们可能改为合并到新文本块
+            rebuild = True
+        if rebuild:
+            print("[RAG] 新文本块与后面未变化文件的文本块重复，改为全量重建")
+            return self._build_snapshot(json_files, entries, None)
+
+        if to_load:
+            print(f"[RAG] 加载 {len(to_load)} 个文件耗时 {(time.perf_counter() - start) * 1000:.1f} ms"
+                  f"（JSON解码: {JSON_DECODER}）")
+        for chunk_idx, duplicates in absorbed.items():
+            metadata = merge_duplicates(chunks.metadata(chunk_idx), duplicates)
+            if base is not None:
+                # 复用的文本块原有的来源记录在前，新合并的在后；按文件顺序重排，与全量构建一致
+                own, groups = self._duplicate_groups(metadata[DUPLICATES_FIELD])
+                groups.sort(key=lambda group: positions[group[0]["path"]])
+                metadata[DUPLICATES_FIELD] = own + [entry for group in groups for entry in group]
+            chunks.set_metadata(chunk_idx, metadata)
+        if merged:
+            print(f"[RAG] 合并近似重复文本块 {merged} 个")
+
+        if base is not None:
+            postings = patch_postings(base.postings.items(), old_to_new, added)
+            formulas = patch_postings(base.formulas.items(), old_to_new, added_formulas)
+            print(f"[RAG] 倒排索引已增量更新（{len(to_load)} 个文件重新索引），共 {len(postings)} 个词项")
+        else:
+            postings: Dict[str, Dict[int, int]] = {}
+            for offset, file_postings in added:
+                merge_postings(postings, file_postings, offset)
+            formulas: Dict[str, Dict[int, int]] = {}
+            for offset, file_formulas in added_formulas:
+                merge_postings(formulas, file_formulas, offset)
+            print(f"[RAG] 倒排索引构建完成，共 {len(postings)} 个词项")
+        print(f"[RAG] 化学式索引共 {len(formulas)} 个化学式")
+        facets = build_facet_index(chunks, files)
+
+        return CorpusSnapshot(chunks, normalized, postings, files, formulas=formulas, facets=facets)
+
+    def _swap_corpus(self, snapshot: CorpusSnapshot) -> None:
+        """原子替换当前语料快照，并让旧快照的缓存结果失效"""
+        self._generation += 1
+        snapshot.generation = self._generation
+        snapshot.external_formulas = self.external_formulas
+        self._corpus = snapshot
+        self.query_cache.clear()
+
+    def set_external_formulas(self, formulas: Iterable[str]) -> None:
+        """
+        设置其他分片中出现的化学式（分片检索时使用）
 
-                        # 处理不同的数据格式
-                        chunks = self._parse_textbook_data(data, json_file.name)
-                        self.chunks.extend(chunks)
-                        total_chunks += len(chunks)
+        化学式关键词只在以化学式形式包含它的文本块中计分；某个化学式只出现在其他分片时，
+        本分片也要按化学式处理（不计分），而不是退回普通子串匹配，合并结果才与不分片时一致。
+        """
+        with self._reload_lock:
+            self.external_formulas = frozenset(formula.lower() for formula in formulas)
+            # 替换为同一份语料的新快照，旧编号的缓存结果随之失效
+            current = self._corpus
+            snapshot = CorpusSnapshot(current.chunks, current.normalized, current.postings, current.files,
+                                      mapped=current.mapped, stats=current.stats, formulas=current.formulas,
+                                      facets=current.facets)
+            snapshot.checksum = current.checksum
+            snapshot.dense_index = current.dense_index
+            self._swap_corpus(snapshot)
+
+    def _candidate_chunks(self, keywords: List[str], corpus: Optional[CorpusSnapshot] = None) -> List[int]:
+        """
+        通过倒排索引找出至少包含一个关键词的文本块
 
-                        print(f"  [OK] {json_file.name}: {len(chunks)} 个文本块")
+        Returns:
+            候选文本块下标列表，按下标升序（与全量遍历的顺序一致）
+        """
+        return (corpus or self._corpus).candidate_chunks(keywords)
+
+    def _get_sparse_scorer(self, corpus: Optional[CorpusSnapshot] = None) -> Optional[SparseScorer]:
+        """按 scoring_backend 配置返回稀疏评分后端；使用逐块评分时返回 None"""
+        corpus = corpus or self._corpus
+        if self.scoring_backend == "python":
+            return None
+        if self.scoring_backend == "auto" and len(corpus) < SPARSE_MIN_CHUNKS:
+            return None
+        if not SPARSE_AVAILABLE:
+            if self.scoring_backend == "sparse":
+                print("[RAG] 未安装 numpy/scipy，稀疏评分后端不可用，改用逐块评分")
+                self.scoring_backend = "python"
+            return None
+
+        return corpus.sparse_scorer()
+
+    def _get_dense_index(self, corpus: Optional[CorpusSnapshot] = None) -> DenseIndex:
+        """
+        返回与语料快照一致的向量索引（首次使用时从数据目录加载）
 
-                    except Exception as e:
-                        print(f"  [ERR] 加载 {json_file.name} 失败: {e}")
+        Raises:
+            DenseIndexUnavailable: 依赖未安装、索引未构建或索引与当前语料不一致
+        """
+        corpus = corpus or self._corpus
+        if corpus.dense_index is None:
+            with self._dense_lock:
+                if corpus.dense_index is None:
+                    corpus.dense_index = DenseIndex.load(self.data_dir, corpus.checksum.hex())
+                    print(f"[RAG] 已加载向量索引: {len(corpus.dense_index)} 个段落，"
+                          f"模型 {corpus.dense_index.model_name}")
+        return corpus.dense_index
+
+    def _get_embedder(self, model_name: str) -> Embedder:
+        """返回问题编码用的嵌入模型（与构建向量索引时的模型一致）"""
+        embedder = self._embedder
+        if embedder is None or embedder.model_name != model_name:
+            with self._dense_lock:
+                embedder = self._embedder
+                if embedder is None or embedder.model_name != model_name:
+                    embedder = self._embedder = Embedder(model_name)
+        return embedder
+
+    def warm_dense(self) -> bool:
+        """
+        预先加载向量索引和嵌入模型，并编码一次问题，避免第一个 dense/hybrid 请求承担模型加载的延迟
 
-            self.index_built = True
-            print(f"[RAG] 教材加载完成，共 {total_chunks} 个文本块\n")
-        except Exception as e:
-            print(f"[RAG] 加载教材数据失败: {e}")
-            self.index_built = True
-
-    def _parse_textbook_data(self, data: Any, source: str) -> List[Dict]:
-        """
-        解析教材数据，提取文本块
-
-        支持两种格式：
-        1. 列表格式: [{"metadata": {...}, "content": "..."}]
-        2. 嵌套格式: {"sections": [{"chunks": [...]}, ...]}
-        """
-        chunks = []
-
-        if isinstance(data, list):
-            # 格式1: 扁平列表
-            for item in data:
-                if isinstance(item, dict) and "content" in item:
-                    chunks.append({
-                        "content": item["content"],
-                        "metadata": item.get("metadata", {}),
-                        "source": source
-                    })
-
-        elif isinstance(data, dict):
-            # 格式2: 嵌套结构（处理process_textbook.py的输出）
-            if "sections" in data:
-                for section in data["sections"]:
-                    if "chunks" in section:
-                        for chunk in section["chunks"]:
-                            chunks.append({
-                                "content": chunk.get("text", ""),
-                                "metadata": {
-                                    "section": section.get("title", ""),
-                                    "source": chunk.get("metadata", {}).get("source", source),
-                                    "chunk_id": chunk.get("chunk_id", "")
-                                },
-                                "source": source
-                            })
-
-        return chunks
+        Returns:
+            向量检索是否可用（依赖未安装或索引未构建时为 False）
+        """
+        try:
+            dense_index = self._get_dense_index()
+            self._get_embedder(dense_index.model_name).encode_query("化学键")
+        except DenseIndexUnavailable as e:
+            print(f"[RAG] 跳过向量检索预热: {e}")
+            return False
+        return True
 
     def extract_keywords(self, question: str, top_k: int = 10) -> List[str]:
         """
-        提取问题中的关键词
+        提取问题中的关键词（按问题缓存，同一问题只分词一次）
 
         Args:
             question: 用户问题
@@ -122,63 +614,254 @@ class TextbookRAG:
         Returns:
             关键词列表
         """
-        # 使用TF-IDF提取关键词
-        keywords = analyse.extract_tags(question, topK=top_k, withWeight=False)
+        return list(_extract_keywords_cached(question, top_k))
 
-        # 添加一些化学相关的特殊处理
-        # 提取化学式（如 H2O, NH3, CO2）
-        chemical_formulas = re.findall(r'\b[A-Z][a-z]?\d*\b', question)
-        keywords.extend([f for f in chemical_formulas if len(f) > 1])
+    def search(self, question: str, top_k: int = 5, min_score: float = 0.1,
+               ranking: str = "keyword", filters: Optional[Filters] = None) -> List[Dict]:
+        """
+        根据问题搜索相关教材内容
 
-        # 去重并保持顺序
-        seen = set()
-        result = []
-        for kw in keywords:
-            if kw not in seen and len(kw) > 1:
-                seen.add(kw)
-                result.append(kw)
+        Args:
+            question: 用户问题
+            top_k: 返回结果数量
+            min_score: 最小相关分数阈值
+            ranking: 排序方式，可选 keyword / bm25 / dense / hybrid
+            filters: 元数据过滤条件，如 {"volume": "one", "topic": ["专题1", "专题2"]}（见 services.facets）
 
-        return result
+        Returns:
+            匹配的文本块列表，按相关性排序
+        """
+        return self.retrieve(question, top_k=top_k, min_score=min_score, ranking=ranking,
+                             filters=filters).copy_results()
 
-    def search(self, question: str, top_k: int = 5, min_score: float = 0.1) -> List[Dict]:
+    def retrieve(self, question: str, top_k: int = 5, min_score: float = 0.1,
+                 ranking: str = "keyword", filters: Optional[Filters] = None) -> "RetrievalResult":
         """
-        根据问题搜索相关教材内容
+        执行一次检索，返回可同时渲染上下文和来源信息的检索结果
 
         Args:
             question: 用户问题
             top_k: 返回结果数量
             min_score: 最小相关分数阈值
+            ranking: 排序方式，可选 keyword / bm25 / dense / hybrid
+            filters: 元数据过滤条件，只在满足条件的文本块中检索
 
         Returns:
-            匹配的文本块列表，按相关性排序
+            RetrievalResult（包含关键词和按相关性排序的文本块）。
+            结果会被缓存并在相同问题间共享，调用方不应修改其中的文本块。
         """
         if not self.index_built:
             self.load_textbooks()
 
-        # 提取关键词
-        keywords = self.extract_keywords(question)
+        # 检索全程使用同一份快照；缓存键带上快照编号，重新加载前的结果不会被命中
+        corpus = self._corpus
+        filter_key = normalize_filters(filters)
+        cache_key = (normalize_question(question), top_k, min_score, ranking, filter_key, corpus.generation)
+        cached = self.query_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        result = self._retrieve_uncached(question, top_k, min_score, corpus, ranking, filter_key)
+        # 有子检索器超时的混合检索结果不完整，不放入缓存
+        if not result.degraded:
+            self.query_cache.put(cache_key, result)
+        return result
+
+    def retrieve_many(self, questions: List[str], top_k: int = 5, min_score: float = 0.1,
+                      ranking: str = "keyword", filters: Optional[Filters] = None) -> List["RetrievalResult"]:
+        """
+        批量检索多个问题
+
+        未命中缓存的问题合并关键词后一起评分：每个文本块只扫描一次，
+        相同的问题只检索一次。
 
-        if not keywords:
-            # 如果没有提取到关键词，返回空列表
-            return []
+        Args:
+            questions: 问题列表
+            top_k: 每个问题返回的结果数量
+            min_score: 最小相关分数阈值
+            ranking: 排序方式，可选 keyword / bm25 / dense / hybrid
+            filters: 元数据过滤条件（所有问题相同）
+
+        Returns:
+            与 questions 顺序一致的 RetrievalResult 列表
+        """
+        if not self.index_built:
+            self.load_textbooks()
 
-        # 计算每个chunk的相关性分数
-        scored_chunks = []
+        corpus = self._corpus
+        filter_key = normalize_filters(filters)
+        results: List[Optional[RetrievalResult]] = [None] * len(questions)
+        # 未命中缓存的问题：缓存键 -> 该问题在输入中的所有位置
+        pending: Dict[tuple, List[int]] = {}
+
+        for i, question in enumerate(questions):
+            cache_key = (normalize_question(question), top_k, min_score, ranking, filter_key, corpus.generation)
+            if cache_key in pending:
+                pending[cache_key].append(i)
+                continue
+            cached = self.query_cache.get(cache_key)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending[cache_key] = [i]
+
+        if pending:
+            cache_keys = list(pending)
+            batch = self._retrieve_batch_uncached(
+                [questions[pending[key][0]] for key in cache_keys], top_k, min_score, corpus, ranking, filter_key
+            )
+            for cache_key, result in zip(cache_keys, batch):
+                if not result.degraded:
+                    self.query_cache.put(cache_key, result)
+                for i in pending[cache_key]:
+                    results[i] = result
+
+        return results
+
+    def search_many(self, questions: List[str], top_k: int = 5, min_score: float = 0.1,
+                    ranking: str = "keyword", filters: Optional[Filters] = None) -> List[List[Dict]]:
+        """
+        批量搜索多个问题
 
-        for chunk in self.chunks:
-            content = chunk["content"]
-            score = self._calculate_relevance(content, keywords)
+        Returns:
+            与 questions 顺序一致的结果列表，每项为按相关性排序的文本块列表
+        """
+        return [result.copy_results() for result in self.retrieve_many(questions, top_k, min_score, ranking, filters)]
+
+    def _retrieve_uncached(self, question: str, top_k: int, min_score: float,
+                           corpus: Optional[CorpusSnapshot] = None,
+                           ranking: str = "keyword",
+                           filter_key: Optional[FilterKey] = None) -> "RetrievalResult":
+        """执行检索（不经过缓存）"""
+        return self._retrieve_batch_uncached([question], top_k, min_score, corpus, ranking, filter_key)[0]
+
+    def _retrieve_batch_uncached(self, questions: List[str], top_k: int, min_score: float,
+                                 corpus: Optional[CorpusSnapshot] = None,
+                                 ranking: str = "keyword",
+                                 filter_key: Optional[FilterKey] = None) -> List["RetrievalResult"]:
+        """对一组问题执行检索（不经过缓存），所有问题共用一轮语料扫描"""
+        if ranking not in RANKING_MODES:
+            raise ValueError(f"未知的排序方式: {ranking}，可选: {', '.join(RANKING_MODES)}")
+        corpus = corpus or self._corpus
+        # 元数据过滤：分面位图组合出允许的文本块，各排序方式在评分前与候选文本块取交集
+        allowed = corpus.select_chunks(filter_key)
+        # 提取关键词；没有提取到关键词的问题直接返回空结果
+        keyword_lists = [self.extract_keywords(question) for question in questions]
+
+        dropped: List[str] = []
+        if ranking == "hybrid":
+            winners, dropped = self._rank_hybrid(questions, keyword_lists, top_k, min_score, corpus, allowed)
+        else:
+            winners = self._rank_batch(questions, keyword_lists, top_k, min_score, corpus, ranking, allowed)
+
+        # 文本块只在进入结果时才构造 dict，相关性分数直接写入同一个 dict
+        return [
+            RetrievalResult(question, keywords, [
+                materialize_at(corpus.chunks, chunk_idx, {"relevance_score": score})
+                for chunk_idx, score in question_winners
+            ], degraded=bool(dropped), normalized=[corpus.normalized[chunk_idx] for chunk_idx, _ in question_winners])
+            for question, keywords, question_winners in zip(questions, keyword_lists, winners)
+        ]
+
+    def _rank_batch(self, questions: List[str], keyword_lists: List[List[str]], top_k: int,
+                    min_score: float, corpus: CorpusSnapshot, ranking: str,
+                    allowed: Optional[FrozenSet[int]] = None) -> List[List[Tuple[int, float]]]:
+        """
+        按指定排序方式为每个问题选出 top_k 个文本块
+
+        提供 allowed（元数据过滤结果）时只在这些文本块中评分，分数与不过滤时相同。
 
-            if score >= min_score:
-                scored_chunks.append({
-                    **chunk,
-                    "relevance_score": score
-                })
+        Returns:
+            与 questions 顺序一致的 (文本块下标, 分数) 列表，按分数降序
+        """
+        active = [i for i, keywords in enumerate(keyword_lists) if keywords]
+        winners: List[List[Tuple[int, float]]] = [[] for _ in questions]
+        if allowed is not None and not allowed:
+            return winners
+
+        if ranking == "dense":
+            # 向量检索不依赖关键词；文本块向量已离线算好，这里只编码问题
+            dense_index = self._get_dense_index(corpus)
+            embedder = self._get_embedder(dense_index.model_name)
+            asked = [i for i, question in enumerate(questions) if question.strip()]
+            if asked:
+                query_vectors = embedder.encode([QUERY_INSTRUCTION + questions[i] for i in asked])
+                for i, query_vector in zip(asked, query_vectors):
+                    winners[i] = dense_index.search(query_vector, top_k, min_score, allowed)
+
+        elif active:
+            active_keywords = [keyword_lists[i] for i in active]
+            # 有元数据过滤时候选文本块通常很少，逐块评分比整个语料的矩阵运算更快
+            use_sparse = ranking == "keyword" and allowed is None
+            sparse_scorer = self._get_sparse_scorer(corpus) if use_sparse else None
+
+            if ranking == "bm25":
+                # BM25 逐个关键词遍历倒排表，不需要逐块扫描
+                for i in active:
+                    winners[i] = BM25Scorer(keyword_lists[i], corpus, INDEX_GRAM_SIZE,
+                                            allowed).top_k(top_k, min_score)
+            elif sparse_scorer is not None:
+                scores = sparse_scorer.score_batch(active_keywords)
+                for col, i in enumerate(active):
+                    winners[i] = SparseScorer.top_k(scores[:, col], top_k, min_score)
+            else:
+                scorer = BatchScorer(active_keywords, corpus.postings, INDEX_GRAM_SIZE, corpus.formula_chunks)
+
+                # 不含任何关键词的文本块得分为0；只有 min_score > 0 时才能跳过它们
+                if min_score > 0:
+                    chunk_ids = corpus.candidate_chunks(scorer.keywords, allowed)
+                elif allowed is not None:
+                    chunk_ids = sorted(allowed)
+                else:
+                    chunk_ids = range(len(corpus))
+
+                # 每个问题只保留 top_k 个 (下标, 分数)，最后再构建结果
+                tops = [TopK(top_k, min_score) for _ in active]
+                for chunk_idx in chunk_ids:
+                    chunk_scores = scorer.score(corpus.normalized[chunk_idx], chunk_idx)
+                    for top, score in zip(tops, chunk_scores):
+                        top.push(chunk_idx, score)
+
+                for top, i in zip(tops, active):
+                    winners[i] = top.result()
+
+        return winners
+
+    def _rank_hybrid(self, questions: List[str], keyword_lists: List[List[str]], top_k: int,
+                     min_score: float, corpus: CorpusSnapshot,
+                     allowed: Optional[FrozenSet[int]] = None) -> Tuple[List[List[Tuple[int, float]]], List[str]]:
+        """
+        混合检索：各子检索器并行排序，再用倒数排名融合
 
-        # 按分数排序，返回top_k
-        scored_chunks.sort(key=lambda x: x["relevance_score"], reverse=True)
+        min_score 作用于各子检索器自己的分数；融合分数（RRF）不再按阈值过滤。
+        向量索引不可用时只融合其余子检索器；超过截止时间的子检索器被放弃。
 
-        return scored_chunks[:top_k]
+        Returns:
+            (融合后的排序结果, 超时放弃的子检索器名称)
+        """
+        depth = max(top_k * HYBRID_DEPTH_FACTOR, HYBRID_MIN_DEPTH)
+
+        def sub_retriever(mode: str):
+            def run():
+                try:
+                    return self._rank_batch(questions, keyword_lists, depth, min_score, corpus, mode, allowed)
+                except DenseIndexUnavailable:
+                    return None
+            return run
+
+        results, dropped = run_with_deadline(
+            {mode: sub_retriever(mode) for mode in HYBRID_RETRIEVERS}, self.hybrid_deadline
+        )
+        if dropped:
+            with self._stats_lock:
+                self.hybrid_dropped.update(dropped)
+
+        rankings = [results[mode] for mode in HYBRID_RETRIEVERS if results.get(mode) is not None]
+        fused = [
+            reciprocal_rank_fusion([ranking[i] for ranking in rankings], top_k)
+            for i in range(len(questions))
+        ]
+        return fused, dropped
 
     def _calculate_relevance(self, content: str, keywords: List[str]) -> float:
         """
@@ -188,6 +871,9 @@ class TextbookRAG:
         - 完全匹配关键词：每个 +2 分
         - 部分匹配（包含关键词）：每个 +1 分
         - 多个关键词在同一句中：额外加分
+
+        这是评分规则的参考实现；search 使用预处理文本和 services.scoring 计算同样的分数。
+        化学式关键词只在化学式索引给出的文本块中计分，调用方应只传入在该文本块中有效的关键词。
         """
         score = 0.0
         content_lower = content.lower()
@@ -216,86 +902,301 @@ class TextbookRAG:
 
         return score
 
-    def get_context(self, question: str, max_length: int = 3000) -> str:
+    def get_context(self, question: str, max_tokens: int = DEFAULT_CONTEXT_TOKENS) -> str:
         """
         获取问题相关的上下文内容
 
         Args:
             question: 用户问题
-            max_length: 返回内容的最大长度（字符数）
+            max_tokens: 上下文的 token 预算（见 services.context_builder）
 
         Returns:
             格式化的上下文字符串
         """
-        results = self.search(question, top_k=5)
+        return self.retrieve(question, top_k=5).to_context(max_tokens)
 
-        if not results:
-            return ""
+    def get_source_info(self, question: str) -> List[Dict]:
+        """
+        获取检索结果的来源信息
+
+        Returns:
+            来源信息列表，用于显示给用户
+        """
+        return self.retrieve(question, top_k=5).to_sources()
+
+    def get_context_and_sources(self, question: str,
+                                max_tokens: int = DEFAULT_CONTEXT_TOKENS) -> Tuple[str, List[Dict]]:
+        """
+        只检索一次，同时返回上下文和来源信息
 
-        # 构建上下文
-        context_parts = []
+        Args:
+            question: 用户问题
+            max_tokens: 上下文的 token 预算
 
-        current_length = 0
-        for i, result in enumerate(results):
-            content = result["content"]
+        Returns:
+            (上下文字符串, 来源信息列表)
+        """
+        result = self.retrieve(question, top_k=5)
+        return result.to_context(max_tokens), result.to_sources()
 
-            # 截断过长的内容
-            if current_length + len(content) > max_length:
-                remaining = max_length - current_length
-                if remaining > 100:  # 至少保留100字符
-                    content = content[:remaining] + "..."
-                    context_parts.append(f"【来源{i+1}】{content}")
-                break
 
-            context_parts.append(f"【来源{i+1}】{content}")
-            current_length += len(content)
+class RetrievalResult:
+    """一次检索的结果，可渲染为LLM上下文或来源列表"""
 
-        return "\n\n".join(context_parts)
+    def __init__(self, question: str, keywords: List[str], results: List[Dict], degraded: bool = False,
+                 normalized: Optional[List[NormalizedText]] = None):
+        self.question = question
+        self.keywords = keywords
+        self.results = results
+        # 混合检索中有子检索器超时被放弃
+        self.degraded = degraded
+        # 与 results 对应的预处理文本（分句边界），组装上下文时直接使用
+        self.normalized = normalized
 
-    def get_source_info(self, question: str) -> List[Dict]:
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def copy_results(self) -> List[Dict]:
         """
-        获取检索结果的来源信息
+        结果文本块的副本
 
-        Returns:
-            来源信息列表，用于显示给用户
+        检索结果会被缓存并返回给之后的相同查询，results 中的 dict 由所有调用方共享；
+        需要交给调用方修改的结果（search / search_many）应使用副本。
+        """
+        return [{**item, "metadata": dict(item["metadata"])} for item in self.results]
+
+    def to_context(self, max_tokens: int = DEFAULT_CONTEXT_TOKENS,
+                   count_tokens: Optional[TokenCounter] = None) -> str:
+        """
+        格式化为上下文字符串
+
+        按句子挑选与关键词最相关的内容装入 token 预算，不在句子中间截断，
+        重复的句子和几乎相同的文本块只保留一份；【来源i】与 to_sources() 的第 i 项对应。
+
+        Args:
+            max_tokens: 上下文的 token 预算
+            count_tokens: token 计数函数，默认按字符估算
         """
-        results = self.search(question, top_k=5)
+        if not self.results:
+            return ""
+        return build_context(self.results, _context_keywords(self.keywords), max_tokens, count_tokens,
+                             self.normalized)
 
+    def to_sources(self) -> List[Dict]:
+        """转换为来源信息列表，用于显示给用户（合并过近似重复内容的文本块附带其他出处）"""
         sources = []
-        for result in results:
+        for result in self.results:
             metadata = result.get("metadata", {})
-            sources.append({
+            source = {
                 "section": metadata.get("section", "未知章节"),
                 "source": metadata.get("source", "未知来源"),
                 "score": result.get("relevance_score", 0)
-            })
+            }
+            duplicates = metadata.get(DUPLICATES_FIELD)
+            if duplicates:
+                source["also_in"] = [
+                    {
+                        "section": entry.get("metadata", entry).get("section", "未知章节"),
+                        "source": entry.get("metadata", entry).get("source", entry.get("source", "未知来源")),
+                    }
+                    for entry in duplicates
+                ]
+            sources.append(source)
 
         return sources
 
 
 # 全局单例
 _rag_instance: Optional[TextbookRAG] = None
+# 保护单例的创建：并发的首个请求（以及预热线程）只会构建一个实例
+_rag_instance_lock = threading.Lock()
 
 
 def get_rag_instance() -> TextbookRAG:
     """获取RAG单例实例"""
     global _rag_instance
-    if _rag_instance is None:
-        try:
-            _rag_instance = TextbookRAG()
-        except Exception as e:
-            print(f"[RAG] 初始化失败: {e}")
-            _rag_instance = TextbookRAG.__new__(TextbookRAG)
-            _rag_instance.data_dir = Path("")
-            _rag_instance.chunks = []
-            _rag_instance.index_built = False
-    return _rag_instance
+    rag = _rag_instance
+    if rag is not None:
+        return rag
+
+    with _rag_instance_lock:
+        if _rag_instance is None:
+            _rag_instance = _create_rag_instance()
+        return _rag_instance
+
+
+def _create_rag_instance() -> TextbookRAG:
+    """
+    创建检索器；初始化失败时返回一个空语料的实例，服务仍可启动
+
+    环境变量 RAG_SHARDED=1 时创建分片检索协调器（services.sharding.ShardedRAG），
+    每个教材子目录由一个独立的工作进程检索。
+    """
+    try:
+        if os.getenv("RAG_SHARDED") == "1":
+            # 延迟导入：sharding 依赖本模块
+            from services.sharding import ShardedRAG
+            return ShardedRAG()
+        return TextbookRAG()
+    except Exception as e:
+        print(f"[RAG] 初始化失败: {e}")
+        rag = TextbookRAG.__new__(TextbookRAG)
+        rag.data_dir = Path("")
+        rag.index_path = Path("")
+        rag.persist_index = False
+        rag.scoring_backend = "python"
+        rag.load_workers = 1
+        rag.subdirs = None
+        rag.external_formulas = frozenset()
+        rag.hybrid_deadline = default_deadline()
+        rag.hybrid_dropped = Counter()
+        rag._stats_lock = threading.Lock()
+        rag.query_cache = QueryCache(max_size=0)
+        rag._corpus = CorpusSnapshot.empty()
+        rag._generation = 0
+        rag._reload_lock = threading.Lock()
+        rag._embedder = None
+        rag._dense_lock = threading.Lock()
+        rag.index_built = False
+        return rag
 
 
 def reset_rag_instance():
     """重置RAG实例"""
     global _rag_instance
-    _rag_instance = None
+    stop_reload_watcher()
+    with _rag_instance_lock:
+        if _rag_instance is not None:
+            _rag_instance.query_cache.clear()
+            close = getattr(_rag_instance, "close", None)
+            if close is not None:
+                close()
+        _rag_instance = None
+
+
+# 教材目录监视线程
+_watcher: Optional[threading.Thread] = None
+_watcher_stop = threading.Event()
+
+
+def _source_signature(rag: TextbookRAG) -> List[Tuple[str, int, int]]:
+    """教材JSON文件的 (路径, 修改时间, 大小)，只用 stat 判断是否可能发生变化"""
+    signature = []
+    for json_file in rag._list_source_files():
+        try:
+            stat = json_file.stat()
+        except OSError:
+            continue
+        signature.append((str(json_file), stat.st_mtime_ns, stat.st_size))
+    return signature
+
+
+def _watch_sources(rag: TextbookRAG, interval: float) -> None:
+    """定期检查教材目录，文件有变化时增量重新加载"""
+    last = _source_signature(rag)
+    while not _watcher_stop.wait(interval):
+        try:
+            current = _source_signature(rag)
+            if current == last:
+                continue
+            last = current
+            summary = rag.reload_changed()
+            if summary["reloaded"]:
+                print(f"[RAG] 检测到教材变化: 新增 {len(summary['added'])}，"
+                      f"修改 {len(summary['changed'])}，删除 {len(summary['removed'])}")
+        except Exception as e:
+            print(f"[RAG] 教材热更新失败: {e}")
+
+
+def start_reload_watcher(interval: Optional[float] = None) -> bool:
+    """
+    启动教材目录监视线程（轮询文件的修改时间和大小）
+
+    未指定 interval 时从环境变量 RAG_WATCH_INTERVAL 读取（秒），0 表示不监视。
+
+    Returns:
+        是否启动了监视线程
+    """
+    global _watcher
+    if interval is None:
+        interval = float(os.getenv("RAG_WATCH_INTERVAL", "0"))
+    if interval <= 0 or (_watcher is not None and _watcher.is_alive()):
+        return False
+
+    rag = get_rag_instance()
+    _watcher_stop.clear()
+    _watcher = threading.Thread(target=_watch_sources, args=(rag, interval),
+                                name="rag-reload-watcher", daemon=True)
+    _watcher.start()
+    print(f"[RAG] 已启动教材目录监视，间隔 {interval} 秒")
+    return True
+
+
+def stop_reload_watcher() -> None:
+    """停止教材目录监视线程"""
+    global _watcher
+    _watcher_stop.set()
+    if _watcher is not None:
+        _watcher.join(timeout=5)
+        _watcher = None
+
+
+# 预热完成标志：jieba 词典、IDF 和教材索引都已加载
+_ready = threading.Event()
+
+
+def warm_up() -> TextbookRAG:
+    """
+    预热检索服务：加载 jieba 词典和 IDF、教材索引，以及向量索引和嵌入模型（已构建时）
+
+    jieba 默认在第一次分词时才加载词典（耗时数秒），在服务启动时调用本函数，
+    避免部署后的第一个请求承担这部分延迟。
+    """
+    print("[RAG] 正在预热 jieba 词典...")
+    jieba.initialize()
+    rag = get_rag_instance()
+    # 触发一次完整的关键词提取，确保 IDF 词表等惰性资源都已就绪
+    rag.extract_keywords("化学键")
+    # 分片模式不支持 dense 检索，没有向量索引可预热
+    if hasattr(rag, "warm_dense"):
+        rag.warm_dense()
+    _ready.set()
+    print("[RAG] 检索服务已就绪")
+    return rag
+
+
+def preload_for_fork() -> Optional[TextbookRAG]:
+    """
+    在 fork 出 worker 之前预热检索服务（gunicorn preload 模式的主进程中调用）
+
+    语料快照和 jieba 词典在主进程中只加载一次，worker 通过 fork 继承，写时复制共享同一份内存；
+    持久化索引本身是 mmap 映射，所有 worker 共用页缓存。映射索引的文本块默认首次访问时才解码，
+    这里在 fork 前全部解码，否则每个 worker 都会各自解码、缓存一份。加载完成后冻结 GC，
+    避免 worker 中的垃圾回收遍历继承来的对象、改写它们所在的内存页。
+
+    分片模式（RAG_SHARDED=1）下只加载 jieba 词典，不创建检索器：分片工作进程池属于创建它的进程，
+    fork 出的 worker 无法使用主进程的进程池，由每个 worker 启动时自己创建。
+
+    Returns:
+        预热好的检索器；分片模式下为 None
+    """
+    if os.getenv("RAG_SHARDED") == "1":
+        print("[RAG] 分片模式下不在主进程中加载语料，由各 worker 自行创建分片进程")
+        jieba.initialize()
+        gc.freeze()
+        return None
+    rag = warm_up()
+    mapped = rag._corpus.mapped
+    if mapped is not None:
+        mapped.decode_all()
+        print(f"[RAG] 已在主进程中解码 {mapped.n_chunks} 个文本块")
+    gc.freeze()
+    return rag
+
+
+def is_ready() -> bool:
+    """检索服务是否已完成预热"""
+    return _ready.is_set()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+"""
+检索线程池
+把 CPU 密集的检索放到有界线程池中执行，避免阻塞 FastAPI 事件循环；
+并发数和排队长度都有上限，超出时立即拒绝（背压），而不是无限排队。
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+class RetrievalOverloaded(Exception):
+    """检索请求排队已满"""
+
+
+class RetrievalPool:
+    """有界检索线程池"""
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 64):
+        """
+        Args:
+            max_workers: 同时执行检索的线程数
+            max_pending: 除正在执行的请求外，最多允许排队等待的请求数
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers 必须大于 0")
+        if max_pending < 0:
+            raise ValueError("max_pending 不能为负数")
+
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-search")
+        # 已提交但尚未完成的请求数（只在事件循环线程中修改）
+        self._in_flight = 0
+        self.rejected = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_pending
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        在线程池中执行 func，排队已满时抛出 RetrievalOverloaded
+
+        客户端断开导致协程被取消时，线程中的检索仍会执行完毕，名额在其结束后才释放。
+        """
+        if self._in_flight >= self.capacity:
+            self.rejected += 1
+            raise RetrievalOverloaded(f"检索请求过多（上限 {self.capacity}），请稍后重试")
+
+        loop = asyncio.get_running_loop()
+        self._in_flight += 1
+        future = loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        future.add_done_callback(self._release)
+        return await asyncio.shield(future)
+
+    def _release(self, _future) -> None:
+        self._in_flight -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "in_flight": self._in_flight,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局线程池（由 main.py 在启动时配置）
+_pool: Optional[RetrievalPool] = None
+
+
+def configure_pool(max_workers: Optional[int] = None, max_pending: Optional[int] = None) -> RetrievalPool:
+    """
+    创建全局检索线程池
+
+    未指定的参数从环境变量 RAG_MAX_WORKERS / RAG_MAX_PENDING 读取，默认分别为 4 和 64。
+    """
+    global _pool
+    if max_workers is None:
+        max_workers = int(os.getenv("RAG_MAX_WORKERS", "4"))
+    if max_pending is None:
+        max_pending = int(os.getenv("RAG_MAX_PENDING", "64"))
+
+    if _pool is not None:
+        _pool.shutdown()
+    _pool = RetrievalPool(max_workers=max_workers, max_pending=max_pending)
+    return _pool
+
+
+def get_pool() -> RetrievalPool:
+    """获取全局检索线程池，未配置时按默认参数创建"""
+    if _pool is None:
+        return configure_pool()
+    return _pool
+
+
+def shutdown_pool() -> None:
+    """关闭全局检索线程池"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
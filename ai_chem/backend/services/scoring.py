@@ -0,0 +1,234 @@
+"""
+关键词相关性评分
+每个查询构建一次 QueryScorer，对每个文本块只做一轮关键词定位，
+再由各关键词的出现次数和首次出现位置推导同句共现加分
+"""
+import heapq
+from typing import AbstractSet, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from services.chunk_text import SENTENCE_SPLIT_PATTERN, NormalizedText
+
+
+# 化学式索引查询：关键词 -> 以化学式形式包含它的文本块，非化学式返回 None
+FormulaLookup = Callable[[str], Optional[AbstractSet[int]]]
+
+
+def is_self_overlapping(keyword: str) -> bool:
+    """关键词是否存在既是前缀又是后缀的真子串（可能与自身重叠出现）"""
+    return any(keyword[:i] == keyword[-i:] for i in range(1, len(keyword)))
+
+
+class QueryScorer:
+    """
+    单个查询的评分器（评分规则同 TextbookRAG._calculate_relevance）
+
+    - 每个关键词：出现次数（不重叠计数）× 1.0
+    - 第一个包含该关键词的句子中，每出现一个其他关键词 +0.5
+
+    某个关键词 j 是否出现在关键词 k 的首个句子 s 中，可以由 j 的首次出现位置直接判断：
+    j 的首句就是 s 则一定出现；首句在 s 之后或 j 不出现则一定不出现；
+    只有首句在 s 之前时才需要在句子 s 中查找。
+    """
+
+    def __init__(self, keywords: List[str], postings: Optional[Mapping[str, Dict[int, int]]] = None,
+                 gram_size: int = 0, formula_fn: Optional[FormulaLookup] = None):
+        """
+        Args:
+            keywords: 查询关键词
+            postings: 倒排索引（词项 -> {chunk下标: 出现次数}），可选
+            gram_size: 倒排索引的词项长度；长度恰好相同的关键词直接从倒排表读出现次数
+            formula_fn: 化学式索引查询（CorpusSnapshot.formula_chunks），可选；
+                化学式关键词只在返回的文本块中计分
+        """
+        self.keywords = keywords
+        self.keywords_lower = [kw.lower() for kw in keywords]
+        # 含分隔符的关键词不可能落在任何一个句子内
+        self._sentence_bound = [SENTENCE_SPLIT_PATTERN.search(kl) is None for kl in self.keywords_lower]
+
+        # 长度等于词项长度、且不会与自身重叠的关键词，其不重叠出现次数等于倒排表中的词项计数
+        self._count_postings: List[Optional[Dict[int, int]]] = []
+        for kl in self.keywords_lower:
+            posting = None
+            if postings is not None and len(kl) == gram_size and not is_self_overlapping(kl):
+                posting = postings.get(kl) or {}
+            self._count_postings.append(posting)
+
+        # 化学式关键词允许出现的文本块，None 表示不限制
+        self._allowed = [formula_fn(kl) if formula_fn is not None else None for kl in self.keywords_lower]
+
+    def locate(self, norm: NormalizedText, chunk_idx: Optional[int] = None) -> Tuple[List[int], List[int]]:
+        """
+        在文本块中定位每个关键词
+
+        Args:
+            norm: 预处理后的文本块
+            chunk_idx: 文本块下标；提供时可以从倒排表读取二元组关键词的出现次数，
+                并按化学式索引限制化学式关键词
+
+        Returns:
+            (各关键词的不重叠出现次数, 各关键词首次出现所在的句子序号)；
+            句子序号在关键词不出现或不可能在句内时为 -1
+        """
+        text = norm.text
+        keywords_lower = self.keywords_lower
+        n = len(keywords_lower)
+        counts = [0] * n
+        first_sentence = [-1] * n
+
+        for j, keyword_lower in enumerate(keywords_lower):
+            allowed = self._allowed[j]
+            if allowed is not None and chunk_idx is not None and chunk_idx not in allowed:
+                continue
+
+            posting = self._count_postings[j]
+            if posting is not None and chunk_idx is not None:
+                count = posting.get(chunk_idx, 0)
+                if not count:
+                    continue
+                pos = text.find(keyword_lower) if self._sentence_bound[j] else -1
+            else:
+                pos = text.find(keyword_lower)
+                if pos < 0:
+                    continue
+                count = text.count(keyword_lower, pos)
+
+            counts[j] = count
+            if self._sentence_bound[j]:
+                first_sentence[j] = norm.sentence_index(pos)
+
+        return counts, first_sentence
+
+    def score(self, norm: NormalizedText, chunk_idx: Optional[int] = None) -> float:
+        """
+        计算一个文本块的相关性分数
+
+        Args:
+            norm: 预处理后的文本块
+            chunk_idx: 文本块下标；提供时可以从倒排表读取二元组关键词的出现次数
+        """
+        counts, first_sentence = self.locate(norm, chunk_idx)
+        return combine_score(norm, self.keywords, self.keywords_lower, counts, first_sentence, {})
+
+
+def combine_score(norm: NormalizedText, keywords: List[str], keywords_lower: List[str],
+                  counts: List[int], first_sentence: List[int], sentences: Dict[int, str]) -> float:
+    """
+    由各关键词的出现次数和首句位置计算相关性分数
+
+    Args:
+        sentences: 句子切片缓存（句子序号 -> 句子），同一文本块的多次计算可以共用
+    """
+    n = len(keywords)
+    score = 0.0
+
+    for k in range(n):
+        if not counts[k]:
+            continue
+        score += counts[k] * 1.0
+
+        s = first_sentence[k]
+        if s < 0:
+            continue
+
+        others = 0
+        for j in range(n):
+            fj = first_sentence[j]
+            if fj < 0 or fj > s or keywords[j] == keywords[k]:
+                continue
+            if fj < s:
+                sentence = sentences.get(s)
+                if sentence is None:
+                    sentence = sentences[s] = norm.sentence(s)
+                if keywords_lower[j] not in sentence:
+                    continue
+            others += 1
+        score += others * 0.5
+
+    return score
+
+
+class BatchScorer:
+    """
+    多个查询共用的评分器
+
+    所有问题的关键词合并后，每个文本块只定位一次，再分别计算每个问题的分数。
+    """
+
+    def __init__(self, keyword_lists: List[List[str]],
+                 postings: Optional[Mapping[str, Dict[int, int]]] = None, gram_size: int = 0,
+                 formula_fn: Optional[FormulaLookup] = None):
+        self.keyword_lists = keyword_lists
+        merged = list(dict.fromkeys(kw for keywords in keyword_lists for kw in keywords))
+        self._locator = QueryScorer(merged, postings, gram_size, formula_fn)
+        position = {kw: i for i, kw in enumerate(merged)}
+        # 每个问题的关键词在合并列表中的位置
+        self._slots = [[position[kw] for kw in keywords] for keywords in keyword_lists]
+        self._keywords_lower = [[kw.lower() for kw in keywords] for keywords in keyword_lists]
+
+    @property
+    def keywords(self) -> List[str]:
+        """合并去重后的关键词"""
+        return self._locator.keywords
+
+    def score(self, norm: NormalizedText, chunk_idx: Optional[int] = None) -> List[float]:
+        """计算一个文本块对每个问题的相关性分数（与 keyword_lists 顺序一致）"""
+        counts, first_sentence = self._locator.locate(norm, chunk_idx)
+        sentences: Dict[int, str] = {}
+        scores = []
+        for keywords, keywords_lower, slots in zip(self.keyword_lists, self._keywords_lower, self._slots):
+            q_counts = [counts[i] for i in slots]
+            if not any(q_counts):
+                scores.append(0.0)
+                continue
+            q_first = [first_sentence[i] for i in slots]
+            scores.append(combine_score(norm, keywords, keywords_lower, q_counts, q_first, sentences))
+        return scores
+
+
+class TopK:
+    """
+    大小为 k 的最小堆，逐个接收 (下标, 分数) 并保留分数最高的 k 个
+
+    分数相同时下标小的优先，与对全部结果稳定排序后取前 k 个一致（要求按下标升序提交）。
+    """
+
+    __slots__ = ("k", "min_score", "_heap")
+
+    def __init__(self, k: int, min_score: float):
+        self.k = k
+        self.min_score = min_score
+        # 堆元素为 (分数, -下标)：堆顶是当前最差的结果（分数最低、同分时下标最大）
+        self._heap: List[Tuple[float, int]] = []
+
+    def push(self, chunk_idx: int, score: float) -> None:
+        if score < self.min_score or self.k <= 0:
+            return
+        item = (score, -chunk_idx)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, item)
+        elif item > self._heap[0]:
+            heapq.heapreplace(self._heap, item)
+
+    def result(self) -> List[Tuple[int, float]]:
+        """返回 (文本块下标, 分数) 列表，按分数降序"""
+        return [(-neg_idx, score) for score, neg_idx in sorted(self._heap, reverse=True)]
+
+
+def select_top_k(scored: Iterable[Tuple[int, float]], top_k: int, min_score: float) -> List[Tuple[int, float]]:
+    """
+    用大小为 top_k 的最小堆选出分数最高的文本块
+
+    只保存 (分数, 下标) 对，分数相同时下标小的优先，与对全部结果稳定排序后取前 top_k 个一致。
+
+    Args:
+        scored: (文本块下标, 分数) 序列，按下标升序
+        top_k: 返回数量
+        min_score: 最小分数阈值
+
+    Returns:
+        (文本块下标, 分数) 列表，按分数降序
+    """
+    top = TopK(top_k, min_score)
+    for chunk_idx, score in scored:
+        top.push(chunk_idx, score)
+    return top.result()
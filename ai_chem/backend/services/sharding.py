@@ -0,0 +1,289 @@
+"""
+分片检索
+按教材子目录（one、two_e 等）把语料分成多个分片，每个分片由一个独立的工作进程
+加载（各自的持久化索引保存在分片目录下）和检索。协调器把查询并行分发给各分片，
+再合并各分片的 top_k；按 volume（教材子目录）过滤时，其余分片完全不参与。
+
+keyword 排序的分数只取决于文本块本身（化学式词表在分片间共享，见 _share_formulas）。
+近似重复的文本块只在分片内部合并：不同分片（如同一教材的不同版本）中的重复段落不会合并，
+合并结果中可能同时出现两份，而不分片时只返回一份（另一份记在 also_in 中），因此结果可能与不分片时不同；
+bm25 的 IDF 和平均长度、hybrid 的融合排名在分片内部计算，与不分片时略有差异。
+向量索引按整个语料构建，分片模式下不支持 dense 检索。
+
+启用方式：设置环境变量 RAG_SHARDED=1，get_rag_instance 会创建 ShardedRAG。
+每个分片只有一个工作进程，同一时刻只处理一批查询：并发的检索请求在各分片的队列中依次执行，
+单个 ShardedRAG 的吞吐量受最慢的分片限制。需要更高的并发时增加 gunicorn worker 数
+（每个 worker 各自创建一组分片进程），而不是在分片内增加进程——分片内的多个进程
+各自持有一份分片语料，化学式词表同步和增量重新加载也只能送达其中一个进程。
+分片进程池只能由创建它的进程使用，gunicorn preload 模式下由各 worker 在 fork 之后创建（见 preload_for_fork）。
+"""
+import heapq
+import multiprocessing
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from services.facets import Filters, FilterKey, normalize_filters
+from services.query_cache import QueryCache, normalize_question
+from services.rag_service import (
+    DEFAULT_DATA_DIR,
+    INDEX_FILE_NAME,
+    DEFAULT_CONTEXT_TOKENS,
+    RANKING_MODES,
+    RetrievalResult,
+    TextbookRAG,
+    _extract_keywords_cached,
+)
+
+# 工作进程中的分片检索器（由 _init_shard 创建）
+_shard_rag: Optional[TextbookRAG] = None
+
+
+def list_shards(data_dir: Path) -> List[str]:
+    """数据目录下的分片（教材子目录），顺序与 TextbookRAG 遍历子目录的顺序一致"""
+    return [path.name for path in Path(data_dir).iterdir() if path.is_dir()]
+
+
+def _init_shard(data_dir: str, shard: str, options: Dict[str, Any]) -> None:
+    """工作进程初始化：加载一个分片的教材数据"""
+    global _shard_rag
+    index_path = Path(data_dir) / shard / INDEX_FILE_NAME
+    _shard_rag = TextbookRAG(data_dir=data_dir, index_path=str(index_path), subdirs=[shard], **options)
+
+
+def _shard_size() -> int:
+    return _shard_rag.num_chunks
+
+
+def _shard_formulas() -> FrozenSet[str]:
+    return _shard_rag.formula_vocabulary()
+
+
+def _shard_set_formulas(formulas: FrozenSet[str]) -> None:
+    _shard_rag.set_external_formulas(formulas)
+
+
+def _shard_retrieve(questions: List[str], top_k: int, min_score: float, ranking: str,
+                    filters: Optional[Filters]) -> List[Tuple[List[Dict], bool]]:
+    """在分片内检索，返回每个问题的 (结果, 是否降级)"""
+    results = _shard_rag.retrieve_many(questions, top_k=top_k, min_score=min_score, ranking=ranking,
+                                       filters=filters)
+    return [(result.results, result.degraded) for result in results]
+
+
+def _shard_reload() -> Dict[str, Any]:
+    return _shard_rag.reload_changed()
+
+
+def _shard_facet_values() -> Dict[str, Dict[str, int]]:
+    return _shard_rag.facet_values()
+
+
+def _shard_hybrid_dropped() -> Dict[str, int]:
+    return dict(_shard_rag.hybrid_dropped)
+
+
+def merge_shard_results(per_shard: Sequence[List[Dict]], top_k: int) -> List[Dict]:
+    """
+    合并各分片的检索结果（每个分片的结果已按分数降序）
+
+    同分时排在前面的分片、分片内排在前面的结果优先，
+    与不分片时按文本块下标决定同分顺序的结果一致。
+    """
+    ranked = (
+        (-item["relevance_score"], shard_pos, rank, item)
+        for shard_pos, results in enumerate(per_shard)
+        for rank, item in enumerate(results)
+    )
+    return [item for *_, item in heapq.nsmallest(top_k, ranked, key=lambda entry: entry[:3])]
+
+
+class ShardedRAG:
+    """分片检索协调器：接口与 TextbookRAG 的检索方法一致"""
+
+    def __init__(self, data_dir: str = None, shards: Optional[List[str]] = None,
+                 cache_size: int = 1024, cache_ttl: float = 600.0, **shard_options):
+        """
+        Args:
+            data_dir: 教材数据目录，默认同 TextbookRAG
+            shards: 分片列表（教材子目录名），默认为数据目录下的全部子目录
+            cache_size: 协调器检索结果缓存的最大条目数，0 表示关闭缓存
+            cache_ttl: 检索结果缓存的有效期（秒）
+            shard_options: 传给各分片 TextbookRAG 的其他参数（如 scoring_backend）
+        """
+        self.data_dir = Path(data_dir) if data_dir is not None else DEFAULT_DATA_DIR
+        self.shards = shards if shards is not None else list_shards(self.data_dir)
+        # 分片本身就是并行单位，分片内默认单进程加载
+        shard_options.setdefault("load_workers", 1)
+        self.query_cache = QueryCache(max_size=cache_size, ttl=cache_ttl)
+        self._generation = 0
+        self._reload_lock = threading.Lock()
+
+        # 每个分片一个单进程的进程池（并发请求在分片内排队，见模块说明）；
+        # 用 spawn 启动，不继承协调器进程中的线程和锁
+        context = multiprocessing.get_context("spawn")
+        self._executors = {
+            shard: ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_shard,
+                                       initargs=(str(self.data_dir), shard, shard_options))
+            for shard in self.shards
+        }
+
+        # 各分片并行加载
+        sizes = {shard: executor.submit(_shard_size) for shard, executor in self._executors.items()}
+        self.shard_sizes = {shard: future.result() for shard, future in sizes.items()}
+        print(f"[RAG] 分片加载完成: " + "，".join(f"{shard} {size} 个文本块"
+                                                 for shard, size in self.shard_sizes.items()))
+        self._share_formulas()
+        self.index_built = True
+
+    def _share_formulas(self) -> None:
+        """把全部分片的化学式词表发给每个分片：只在其他分片出现的化学式，本分片也按化学式处理"""
+        vocabularies = {shard: executor.submit(_shard_formulas) for shard, executor in self._executors.items()}
+        vocabularies = {shard: future.result() for shard, future in vocabularies.items()}
+        futures = [
+            executor.submit(_shard_set_formulas, frozenset().union(*(
+                vocabulary for other, vocabulary in vocabularies.items() if other != shard)))
+            for shard, executor in self._executors.items()
+        ]
+        for future in futures:
+            future.result()
+
+    @property
+    def num_chunks(self) -> int:
+        """所有分片的文本块数量"""
+        return sum(self.shard_sizes.values())
+
+    @property
+    def hybrid_dropped(self) -> Counter:
+        """各分片混合检索中子检索器超时被放弃的次数之和"""
+        total: Counter = Counter()
+        for future in [executor.submit(_shard_hybrid_dropped) for executor in self._executors.values()]:
+            total.update(future.result())
+        return total
+
+    def _list_source_files(self) -> List[Path]:
+        """列出所有分片的教材JSON文件（供目录监视判断是否有变化）"""
+        return [path for shard in self.shards for path in (self.data_dir / shard).glob("*.json")]
+
+    def _select_shards(self, filter_key: Optional[FilterKey]) -> List[str]:
+        """过滤条件中的 volume 就是分片名，只有这些分片参与检索"""
+        volumes = dict(filter_key or ()).get("volume")
+        if volumes is None:
+            return self.shards
+        return [shard for shard in self.shards if shard in volumes]
+
+    def extract_keywords(self, question: str, top_k: int = 10) -> List[str]:
+        """提取问题中的关键词（与分片内的提取规则相同）"""
+        return list(_extract_keywords_cached(question, top_k))
+
+    def search(self, question: str, top_k: int = 5, min_score: float = 0.1,
+               ranking: str = "keyword", filters: Optional[Filters] = None) -> List[Dict]:
+        """根据问题搜索相关教材内容，参数同 retrieve"""
+        return self.retrieve(question, top_k=top_k, min_score=min_score, ranking=ranking,
+                             filters=filters).copy_results()
+
+    def retrieve(self, question: str, top_k: int = 5, min_score: float = 0.1,
+                 ranking: str = "keyword", filters: Optional[Filters] = None) -> RetrievalResult:
+        """
+        执行一次检索：分发到各分片，合并各分片的 top_k
+
+        Args:
+            filters: 元数据过滤条件（见 services.facets）；volume 决定参与检索的分片，
+                     其余条件由各分片自己的分面位图处理
+        """
+        return self.retrieve_many([question], top_k=top_k, min_score=min_score, ranking=ranking,
+                                  filters=filters)[0]
+
+    def retrieve_many(self, questions: List[str], top_k: int = 5, min_score: float = 0.1,
+                      ranking: str = "keyword", filters: Optional[Filters] = None) -> List[RetrievalResult]:
+        """批量检索，每个分片一次处理全部问题；结果与 questions 顺序一致"""
+        if ranking not in RANKING_MODES:
+            raise ValueError(f"未知的排序方式: {ranking}，可选: {', '.join(RANKING_MODES)}")
+
+        filter_key = normalize_filters(filters)
+        shards = self._select_shards(filter_key)
+        generation = self._generation
+        cache_keys = [(normalize_question(q), top_k, min_score, ranking, filter_key, generation)
+                      for q in questions]
+        results: List[Optional[RetrievalResult]] = [self.query_cache.get(key) for key in cache_keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+
+        pending = [questions[i] for i in missing]
+        futures = [self._executors[shard].submit(_shard_retrieve, pending, top_k, min_score, ranking, filters)
+                   for shard in shards]
+        per_shard = [future.result() for future in futures]
+
+        for pos, i in enumerate(missing):
+            shard_results = [shard_batch[pos] for shard_batch in per_shard]
+            result = RetrievalResult(
+                questions[i],
+                self.extract_keywords(questions[i]),
+                merge_shard_results([items for items, _ in shard_results], top_k),
+                degraded=any(degraded for _, degraded in shard_results),
+            )
+            results[i] = result
+            if not result.degraded:
+                self.query_cache.put(cache_keys[i], result)
+        return results
+
+    def search_many(self, questions: List[str], top_k: int = 5, min_score: float = 0.1,
+                    ranking: str = "keyword", filters: Optional[Filters] = None) -> List[List[Dict]]:
+        """批量搜索，返回每个问题的文本块列表"""
+        return [result.copy_results() for result in
+                self.retrieve_many(questions, top_k=top_k, min_score=min_score, ranking=ranking,
+                                   filters=filters)]
+
+    def get_context(self, question: str, max_tokens: int = DEFAULT_CONTEXT_TOKENS) -> str:
+        """获取问题相关的上下文内容，参数同 TextbookRAG.get_context"""
+        return self.retrieve(question, top_k=5).to_context(max_tokens)
+
+    def get_source_info(self, question: str) -> List[Dict]:
+        """获取检索结果的来源信息，用于显示给用户"""
+        return self.retrieve(question, top_k=5).to_sources()
+
+    def get_context_and_sources(self, question: str,
+                                max_tokens: int = DEFAULT_CONTEXT_TOKENS) -> Tuple[str, List[Dict]]:
+        """只检索一次，同时返回上下文和来源信息"""
+        result = self.retrieve(question, top_k=5)
+        return result.to_context(max_tokens), result.to_sources()
+
+    def facet_values(self) -> Dict[str, Dict[str, int]]:
+        """各过滤字段的取值及对应的文本块数量（汇总所有分片）"""
+        total: Dict[str, Counter] = {}
+        for future in [executor.submit(_shard_facet_values) for executor in self._executors.values()]:
+            for field, values in future.result().items():
+                total.setdefault(field, Counter()).update(values)
+        return {field: dict(sorted(values.items())) for field, values in total.items()}
+
+    def reload_changed(self) -> Dict[str, Any]:
+        """
+        各分片增量重新加载，返回合并后的变化摘要
+
+        分片列表在启动时确定；新增的教材子目录需要重启服务才会成为新的分片。
+        """
+        with self._reload_lock:
+            futures = {shard: executor.submit(_shard_reload) for shard, executor in self._executors.items()}
+            summary = {"reloaded": False, "added": [], "changed": [], "removed": [], "unchanged": 0}
+            for shard, future in futures.items():
+                shard_summary = future.result()
+                summary["reloaded"] |= shard_summary["reloaded"]
+                for key in ("added", "changed", "removed"):
+                    summary[key].extend(shard_summary[key])
+                summary["unchanged"] += shard_summary["unchanged"]
+
+            if summary["reloaded"]:
+                sizes = {shard: executor.submit(_shard_size) for shard, executor in self._executors.items()}
+                self.shard_sizes = {shard: future.result() for shard, future in sizes.items()}
+                self._share_formulas()
+                self._generation += 1
+                self.query_cache.clear()
+            return summary
+
+    def close(self) -> None:
+        """关闭所有分片工作进程"""
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,202 @@
+"""
+NumPy/SciPy 稀疏矩阵评分后端
+把语料表示为 文本块×词项 的稀疏计数矩阵，每个查询的出现次数得分是一次稀疏矩阵-向量乘法，
+同句共现加分按关键词两两做向量化比较，最后用 argpartition 取 top-k。
+
+评分规则与 TextbookRAG._calculate_relevance 完全一致：
+词项列保存的是关键词在每个文本块中的不重叠出现次数（str.count 语义），
+并记录每个关键词出现过的全部句子，用于计算同句共现加分。
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Sequence, Tuple
+
+try:
+    import numpy as np
+    from scipy import sparse
+    SPARSE_AVAILABLE = True
+except ImportError:
+    np = None
+    sparse = None
+    SPARSE_AVAILABLE = False
+
+from services.chunk_text import SENTENCE_SPLIT_PATTERN, NormalizedText
+
+
+class _TermColumn:
+    """一个词项（小写关键词）在整个语料上的统计"""
+
+    __slots__ = ("counts", "first_sentence", "sentences")
+
+    def __init__(self, counts, first_sentence, sentences):
+        # 稀疏列：每个文本块中的不重叠出现次数
+        self.counts = counts
+        # 每个文本块中首次出现所在句子的全局序号，不出现或不可能在句内时为 -1
+        self.first_sentence = first_sentence
+        # 出现过该词项的全部句子的全局序号（有序）
+        self.sentences = sentences
+
+
+class SparseScorer:
+    """
+    稀疏矩阵评分后端
+
+    词项列在第一次被查询时计算（只扫描倒排索引给出的候选文本块）并缓存，
+    之后同一关键词的查询只需要矩阵运算。
+    """
+
+    def __init__(self, normalized: Sequence[NormalizedText],
+                 candidate_fn, max_cached_terms: int = 4096):
+        """
+        Args:
+            normalized: 与文本块一一对应的预处理文本
+            candidate_fn: 给定关键词列表，返回可能包含它们的文本块下标（来自倒排索引）
+            max_cached_terms: 最多缓存的词项列数量（LRU 淘汰）
+        """
+        if not SPARSE_AVAILABLE:
+            raise ImportError("稀疏评分后端需要安装 numpy 和 scipy")
+
+        self.normalized = normalized
+        self.n_chunks = len(normalized)
+        self._candidate_fn = candidate_fn
+        self.max_cached_terms = max_cached_terms
+        self._columns: "OrderedDict[str, _TermColumn]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # 每个文本块的句子边界及其在全局句子编号中的起点
+        self._sentence_ends = [np.frombuffer(norm.sentence_ends, dtype=np.uint32)
+                               for norm in normalized]
+        sentence_counts = np.array([len(ends) for ends in self._sentence_ends], dtype=np.int64)
+        self._sentence_base = np.concatenate(([0], np.cumsum(sentence_counts)[:-1])).astype(np.int64)
+
+    def _build_column(self, term: str) -> _TermColumn:
+        """扫描候选文本块，计算一个词项的计数列和句子分布"""
+        pattern = re.compile(re.escape(term))
+        sentence_bound = SENTENCE_SPLIT_PATTERN.search(term) is None
+
+        rows: List[int] = []
+        counts: List[int] = []
+        first_sentence = np.full(self.n_chunks, -1, dtype=np.int64)
+        sentences: List = []
+
+        for chunk_idx in self._candidate_fn([term]):
+            # finditer 给出的是从左到右的不重叠匹配，与 str.count 的计数一致；
+            # 与之重叠的其他出现必然位于同一句中，不影响句子分布
+            positions = [m.start() for m in pattern.finditer(self.normalized[chunk_idx].text)]
+            if not positions:
+                continue
+            rows.append(chunk_idx)
+            counts.append(len(positions))
+
+            if sentence_bound:
+                local = np.searchsorted(self._sentence_ends[chunk_idx], positions, side="left")
+                global_ids = local.astype(np.int64) + self._sentence_base[chunk_idx]
+                first_sentence[chunk_idx] = global_ids[0]
+                sentences.append(global_ids)
+
+        column = sparse.csc_matrix(
+            (np.array(counts, dtype=np.float64), (np.array(rows, dtype=np.int64),
+                                                  np.zeros(len(rows), dtype=np.int64))),
+            shape=(self.n_chunks, 1)
+        )
+        sentence_ids = np.unique(np.concatenate(sentences)) if sentences else np.empty(0, dtype=np.int64)
+        return _TermColumn(column, first_sentence, sentence_ids)
+
+    def _column(self, term: str) -> _TermColumn:
+        with self._lock:
+            column = self._columns.get(term)
+            if column is not None:
+                self._columns.move_to_end(term)
+                return column
+
+        # 在锁外计算，并发查询同一个新词项时最多重复计算一次
+        column = self._build_column(term)
+        with self._lock:
+            self._columns[term] = column
+            if len(self._columns) > self.max_cached_terms:
+                self._columns.popitem(last=False)
+        return column
+
+    def clear(self) -> None:
+        """清空词项列缓存（语料变化后调用）"""
+        with self._lock:
+            self._columns.clear()
+
+    def score_all(self, keywords: List[str]):
+        """
+        计算所有文本块的相关性分数
+
+        Returns:
+            长度为文本块数量的分数数组
+        """
+        return self.score_batch([keywords])[:, 0]
+
+    def score_batch(self, keyword_lists: List[List[str]]):
+        """
+        一次计算多个查询在所有文本块上的分数
+
+        所有查询的词项合并为一个计数矩阵，出现次数得分是一次 文本块×词项 与 词项×查询
+        的矩阵乘法；同句共现加分逐个查询做向量化计算。
+
+        Returns:
+            形状为 (文本块数量, 查询数量) 的分数矩阵
+        """
+        lowered = [[kw.lower() for kw in keywords] for keywords in keyword_lists]
+        terms = list(dict.fromkeys(term for keywords_lower in lowered for term in keywords_lower))
+        scores = np.zeros((self.n_chunks, len(keyword_lists)), dtype=np.float64)
+        if not terms:
+            return scores
+
+        columns = {term: self._column(term) for term in terms}
+        term_pos = {term: i for i, term in enumerate(terms)}
+
+        # 出现次数得分：计数矩阵 × 各查询的词项重数矩阵
+        matrix = sparse.hstack([columns[term].counts for term in terms], format="csr")
+        weights = np.zeros((len(terms), len(keyword_lists)), dtype=np.float64)
+        for q, keywords_lower in enumerate(lowered):
+            for term in keywords_lower:
+                weights[term_pos[term], q] += 1.0
+        scores += np.asarray(matrix @ weights, dtype=np.float64)
+
+        # 同句共现加分：关键词 k 的首句中每出现一个其他关键词 j 加 0.5
+        for q, (keywords, keywords_lower) in enumerate(zip(keyword_lists, lowered)):
+            bonus = np.zeros(self.n_chunks, dtype=np.int64)
+            for k, kl in enumerate(keywords_lower):
+                first = columns[kl].first_sentence
+                present = np.flatnonzero(first >= 0)
+                if present.size == 0:
+                    continue
+                first_ids = first[present]
+                for j, jl in enumerate(keywords_lower):
+                    if keywords[j] == keywords[k]:
+                        continue
+                    bonus[present] += np.isin(first_ids, columns[jl].sentences)
+            scores[:, q] += bonus * 0.5
+
+        return scores
+
+    @staticmethod
+    def top_k(scores, top_k: int, min_score: float) -> List[Tuple[int, float]]:
+        """
+        取分数最高的 top_k 个文本块
+
+        并列分数按文本块下标升序排列，与稳定排序的结果一致。
+
+        Returns:
+            (文本块下标, 分数) 列表，按分数降序
+        """
+        if top_k <= 0:
+            return []
+
+        eligible = np.flatnonzero(scores >= min_score)
+        if eligible.size > top_k:
+            eligible_scores = scores[eligible]
+            kth = eligible_scores[np.argpartition(-eligible_scores, top_k - 1)[top_k - 1]]
+            above = eligible[eligible_scores > kth]
+            ties = eligible[eligible_scores == kth][:top_k - above.size]
+            eligible = np.concatenate((above, ties))
+
+        order = np.lexsort((eligible, -scores[eligible]))
+        winners = eligible[order]
+        return [(int(idx), float(scores[idx])) for idx in winners]